@@ -36,12 +36,19 @@ from logger import logger, screen
 import random
 import time
 import os
+import pickle
+import shutil
 import itertools
+import threading
 from architectures.tensorflow_components.shared_variables import SharedRunningStats
 from six.moves import range
 
 
 class Agent(object):
+    # whether the losses of the agent are scaled by the importance weights of the batch, which also mask the burn in
+    # steps of sequences
+    applies_importance_weights = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, task_id=0):
         """
         :param env: An environment instance
@@ -70,12 +77,34 @@ class Agent(object):
             self.measurements_size = tuning_parameters.env.measurements_size = (self.measurements_size[0] + 1,)
 
         # modules
-        if tuning_parameters.agent.load_memory_from_file_path:
+        if tuning_parameters.agent.load_memory_from_file_path and \
+                not is_demonstrations_file(tuning_parameters.agent.load_memory_from_file_path):
             screen.log_title("Loading replay buffer from pickle. Pickle path: {}"
                              .format(tuning_parameters.agent.load_memory_from_file_path))
             self.memory = read_pickle(tuning_parameters.agent.load_memory_from_file_path)
         else:
             self.memory = eval(tuning_parameters.memory + '(tuning_parameters)')
+            if tuning_parameters.agent.load_memory_from_file_path:
+                self.load_demonstrations(tuning_parameters.agent.load_memory_from_file_path)
+        # any change to the memory should hold this lock, since the memory can be sampled by a background thread
+        self.memory_lock = threading.Lock()
+        self.batch_prefetcher = None
+
+        # recurrent training on batches of contiguous sequences
+        self.sequence_length = tuning_parameters.agent.recurrent_sequence_length
+        self.burn_in_steps = tuning_parameters.agent.recurrent_burn_in_steps
+        if self.sequence_length > 0:
+            assert tuning_parameters.agent.middleware_type == MiddlewareTypes.LSTM, \
+                'Training on sequences requires an LSTM middleware'
+            assert tuning_parameters.batch_size % (self.burn_in_steps + self.sequence_length) == 0, \
+                'The batch size should be divisible by the sequence length including the burn in steps'
+            assert self.burn_in_steps + self.sequence_length > 1, \
+                'The sequence length including the burn in steps should be at least 2'
+            assert tuning_parameters.agent.prefetch_batches == 0, \
+                'Prefetching batches is not supported when training on sequences'
+            assert self.burn_in_steps == 0 or self.applies_importance_weights, \
+                'Burn in steps are not supported by {}, since it does not mask them out of its loss'.format(
+                    self.__class__.__name__)
         # self.architecture = eval(tuning_parameters.architecture)
 
         self.has_global = replicated_device is not None
@@ -112,6 +141,7 @@ class Agent(object):
         self.signals.append(self.loss)
         self.curr_learning_rate = Signal('Learning Rate')
         self.signals.append(self.curr_learning_rate)
+        self.signals.extend(getattr(self.memory, 'signals', []))
 
         if self.tp.env.normalize_observation and not self.env.is_state_type_image:
             if not self.tp.distributed or not self.tp.agent.share_statistics_between_workers:
@@ -275,7 +305,17 @@ class Agent(object):
         A single training iteration. Sample a batch, train on it and update target networks.
         :return: The training loss.
         """
-        batch = self.memory.sample(self.tp.batch_size)
+        if self.sequence_length > 0:
+            # a batch of batch_size transitions made of whole sequences
+            num_sequences = self.tp.batch_size // (self.burn_in_steps + self.sequence_length)
+            batch = self.memory.sample_sequences(num_sequences, self.sequence_length, self.burn_in_steps)
+        elif self.tp.agent.prefetch_batches > 0:
+            if self.batch_prefetcher is None:
+                self.batch_prefetcher = BatchPrefetcher(self.memory, self.memory_lock, self.tp.batch_size,
+                                                        self.tp.agent.prefetch_batches, self.extract_batch)
+            batch = self.batch_prefetcher.get()
+        else:
+            batch = self.memory.sample(self.tp.batch_size)
         loss = self.learn_from_batch(batch)
 
         if self.tp.learning_rate_decay_rate != 0:
@@ -293,14 +333,63 @@ class Agent(object):
 
         return loss
 
+    def stop_batch_prefetcher(self):
+        """
+        Stop the background sampling of training batches, if it is running. It is started again by the next training
+        step, so batches that were sampled before a change to the memory (e.g. loading it) are not trained on.
+        :return: None
+        """
+        if self.batch_prefetcher is not None:
+            self.batch_prefetcher.stop()
+            self.batch_prefetcher = None
+
+    def load_demonstrations(self, path):
+        """
+        Store the episodes of a demonstrations file in the memory, reading the file one episode at a time
+        :param path: the path of the demonstrations file
+        :return: None
+        """
+        screen.log_title("Loading demonstrations. Demonstrations path: {}".format(path))
+        num_transitions = 0
+        for episode in read_demonstrations(path):
+            for transition in episode:
+                self.memory.store(transition)
+            num_transitions += len(episode)
+        if self.memory.num_transitions() < num_transitions:
+            screen.warning("Only {} out of {} demonstration transitions fit in the memory"
+                           .format(self.memory.num_transitions(), num_transitions))
+
     def extract_batch(self, batch):
         """
         Extracts a single numpy array for each object in a batch of transitions (state, action, etc.)
-        :param batch: An array of transitions
+        :param batch: An array of transitions or a TransitionBatch
         :return: For each transition element, returns a numpy array of all the transitions in the batch
         """
+        if isinstance(batch, TransitionBatch) and batch.extracted is not None:
+            # the batch was already extracted by the batch prefetcher. the arrays are handed out only once, since the
+            # caller may change them in place
+            extracted, batch.extracted = batch.extracted, None
+            return extracted
+
         current_states = {}
         next_states = {}
+        if isinstance(batch, TransitionBatch):
+            # the batch was already gathered into arrays by the memory
+            current_states['observation'] = batch.states['observation']
+            next_states['observation'] = batch.next_states['observation']
+            if self.tp.agent.use_measurements:
+                current_states['measurements'] = batch.states['measurements']
+                next_states['measurements'] = batch.next_states['measurements']
+            if batch.sequence_length is not None and 'rnn_c_in' in batch.info:
+                # the lstm state at the start of each sequence. the next states sequences start one step later.
+                sequences_start = np.arange(0, len(batch), batch.sequence_length)
+                current_states['lstm_c_in'] = batch.info['rnn_c_in'][sequences_start]
+                current_states['lstm_h_in'] = batch.info['rnn_h_in'][sequences_start]
+                next_states['lstm_c_in'] = batch.info['rnn_c_in'][sequences_start + 1]
+                next_states['lstm_h_in'] = batch.info['rnn_h_in'][sequences_start + 1]
+            return current_states, next_states, batch.actions, np.copy(batch.rewards), np.copy(batch.game_overs), \
+                np.copy(batch.total_returns)
+
         current_states['observation'] = np.array([np.array(transition.state['observation']) for transition in batch])
         next_states['observation'] = np.array([np.array(transition.next_state['observation']) for transition in batch])
         actions = np.array([transition.action for transition in batch])
@@ -378,6 +467,14 @@ class Agent(object):
             if self.tp.agent.use_accumulated_reward_as_measurement:
                 self.curr_state['measurements'] = np.append(self.curr_state['measurements'], 0)
 
+    def get_transition_info(self):
+        """
+        Get any additional info fields to store with the transition of the current step. The fields are added
+        before the transition is stored, since it can be sampled by the batch prefetcher right after that.
+        :return: A dictionary of the info fields
+        """
+        return {}
+
     def act(self, phase=RunPhase.TRAIN):
         """
         Take one step in the environment according to the network prediction and store the transition in memory
@@ -389,6 +486,11 @@ class Agent(object):
             self.total_steps_counter += 1
         self.current_episode_steps_counter += 1
 
+        # the lstm state before the step is the initial state of a training sequence that starts at this step
+        if self.sequence_length > 0:
+            online_network = self.networks[0].online_network
+            rnn_state_in = (online_network.curr_rnn_c_in, online_network.curr_rnn_h_in)
+
         # get new action
         action_info = {"action_probability": 1.0 / self.env.action_space_size, "action_value": 0, "max_action_value": 0}
 
@@ -435,7 +537,12 @@ class Agent(object):
                 transition.info[key] = action_info[key]
             if self.tp.agent.add_a_normalized_timestep_to_the_observation:
                 transition.info['timestep'] = float(self.current_episode_steps_counter) / self.env.timestep_limit
-            self.memory.store(transition)
+            if self.sequence_length > 0:
+                transition.info['rnn_c_in'] = rnn_state_in[0][0]
+                transition.info['rnn_h_in'] = rnn_state_in[1][0]
+            transition.info.update(self.get_transition_info())
+            with self.memory_lock:
+                self.memory.store(transition)
         elif phase == RunPhase.TEST and self.tp.visualization.dump_gifs:
             # we store the transitions only for saving gifs
             self.last_episode_images.append(self.env.get_rendered_image())
@@ -514,8 +621,15 @@ class Agent(object):
         for network in self.networks:
             network.sync()
 
+        # resume the training state of the restored checkpoint. the memory is already filled, so heatup is skipped.
+        resumed_training_state = False
+        if self.tp.checkpoint_restore_dir and \
+                os.path.exists(os.path.join(self.tp.checkpoint_restore_dir, 'training_state')):
+            self.load_training_state(os.path.join(self.tp.checkpoint_restore_dir, 'training_state'))
+            resumed_training_state = True
+
         # heatup phase
-        if self.tp.num_heatup_steps != 0:
+        if self.tp.num_heatup_steps != 0 and not resumed_training_state:
             self.in_heatup = True
             screen.log_title("Starting heatup {}".format(self.task_id))
             num_steps_required_for_one_training_batch = self.tp.batch_size * self.tp.env.observation_stack_size
@@ -576,5 +690,79 @@ class Agent(object):
                         self.log_to_screen(RunPhase.TRAIN)
                 self.post_training_commands()
 
+        self.stop_batch_prefetcher()
+
     def save_model(self, model_id):
         self.main_network.save_model(model_id)
+        if isinstance(self.memory, MemoryMappedExperienceReplay):
+            self.stop_batch_prefetcher()
+            with self.memory_lock:
+                self.memory.flush()
+        if self.tp.save_training_state:
+            self.save_training_state()
+
+    def save_training_state(self):
+        """
+        Save everything besides the network weights that is needed for resuming the training from the last model
+        checkpoint - the memory, the exploration policy state, the counters, the running statistics and the random
+        generators state. Only the last training state is kept, and it replaces the previous one once it is complete.
+        :return: None
+        """
+        state_dir = os.path.join(self.tp.save_model_dir, 'training_state')
+        temp_state_dir = state_dir + '.tmp'
+        if os.path.exists(temp_state_dir):
+            shutil.rmtree(temp_state_dir)
+        os.makedirs(temp_state_dir)
+
+        # the prefetching thread samples from the memory and uses the random generators, which are saved below
+        self.stop_batch_prefetcher()
+        with self.memory_lock:
+            self.memory.save(os.path.join(temp_state_dir, 'memory'))
+        state = {
+            'total_steps_counter': self.total_steps_counter,
+            'training_iteration': self.training_iteration,
+            'current_episode': self.current_episode,
+            'last_episode_evaluation_ran': self.last_episode_evaluation_ran,
+            'running_reward': self.running_reward,
+            'exploration_policy': self.exploration_policy.get_state(),
+            'numpy_random_state': np.random.get_state(),
+            'random_state': random.getstate(),
+            # the target values cached in the memory are tagged with these versions
+            'target_network_versions': [network.target_network_version for network in self.networks]
+        }
+        if isinstance(getattr(self, 'running_observation_stats', None), RunningStat):
+            state['running_observation_stats'] = self.running_observation_stats
+            state['running_reward_stats'] = self.running_reward_stats
+        with open(os.path.join(temp_state_dir, 'agent_state.p'), 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+        if os.path.exists(state_dir):
+            shutil.rmtree(state_dir)
+        os.rename(temp_state_dir, state_dir)
+
+    def load_training_state(self, state_dir):
+        """
+        Load a training state that was saved using save_training_state()
+        :param state_dir: the directory of the training state
+        :return: None
+        """
+        screen.log_title("Loading training state: {}".format(state_dir))
+        with open(os.path.join(state_dir, 'agent_state.p'), 'rb') as f:
+            state = pickle.load(f)
+        self.stop_batch_prefetcher()
+        with self.memory_lock:
+            self.memory.load(os.path.join(state_dir, 'memory'))
+        self.total_steps_counter = state['total_steps_counter']
+        self.training_iteration = state['training_iteration']
+        self.current_episode = self.tp.current_episode = state['current_episode']
+        self.last_episode_evaluation_ran = state['last_episode_evaluation_ran']
+        self.running_reward = state['running_reward']
+        self.exploration_policy.set_state(state['exploration_policy'])
+        np.random.set_state(state['numpy_random_state'])
+        random.setstate(state['random_state'])
+        for network, version in zip(self.networks, state['target_network_versions']):
+            network.target_network_version = version
+        if 'running_observation_stats' in state:
+            self.running_observation_stats = state['running_observation_stats']
+            self.running_reward_stats = state['running_reward_stats']
+        logger.set_current_time(self.current_episode)
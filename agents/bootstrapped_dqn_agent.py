@@ -15,6 +15,8 @@
 #
 
 from agents.value_optimization_agent import *
+from agents.td_targets import *
+from memories.memory import TransitionBatch
 
 
 # Bootstrapped DQN - https://arxiv.org/pdf/1602.04621.pdf
@@ -36,23 +38,24 @@ class BootstrappedDQNAgent(ValueOptimizationAgent):
         # initialize with the current prediction so that we will
         TD_targets = self.main_network.online_network.predict(current_states)
 
-        #  only update the action that we have actually done in this transition
-        for i in range(self.tp.batch_size):
-            mask = batch[i].info['mask']
-            for head_idx in range(self.tp.exploration.architecture_num_q_heads):
-                if mask[head_idx] == 1:
-                    TD_targets[head_idx][i, actions[i]] = rewards[i] + \
-                                                          (1.0 - game_overs[i]) * self.tp.agent.discount * np.max(
-                                                              q_st_plus_1[head_idx][i], 0)
+        #  only update the action that we have actually done in this transition, for the heads that the transition
+        #  was shared with
+        if isinstance(batch, TransitionBatch):
+            masks = batch.info['mask']
+        else:
+            masks = np.array([transition.info['mask'] for transition in batch])
+        TD_targets = np.array(TD_targets)
+        new_targets = bootstrapped_q_learning_targets(rewards, game_overs, self.tp.agent.discount,
+                                                      np.array(q_st_plus_1))
+        set_action_targets(TD_targets, actions, new_targets, mask=np.transpose(masks) == 1)
 
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(current_states, list(TD_targets))
 
         total_loss = result[0]
 
         return total_loss
 
-    def act(self, phase=RunPhase.TRAIN):
-        ValueOptimizationAgent.act(self, phase)
+    def get_transition_info(self):
         mask = np.random.binomial(1, self.tp.exploration.bootstrapped_data_sharing_probability,
                                   self.tp.exploration.architecture_num_q_heads)
-        self.memory.update_last_transition_info({'mask': mask})
+        return {'mask': mask}
@@ -19,6 +19,8 @@ from agents.value_optimization_agent import *
 
 # Categorical Deep Q Network - https://arxiv.org/pdf/1707.06887.pdf
 class CategoricalDQNAgent(ValueOptimizationAgent):
+    applies_importance_weights = True
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.z_values = np.linspace(self.tp.agent.v_min, self.tp.agent.v_max, self.tp.agent.atoms)
@@ -32,29 +34,22 @@ class CategoricalDQNAgent(ValueOptimizationAgent):
 
         # for the action we actually took, the error is calculated by the atoms distribution
         # for all other actions, the error is 0
+        # the distribution of the next states is projected on the atoms by the head (see CategoricalQHead)
         distributed_q_st_plus_1 = self.main_network.target_network.predict(next_states)
-        # initialize with the current prediction so that we will
-        TD_targets = self.main_network.online_network.predict(current_states)
-
-        # only update the action that we have actually done in this transition
-        target_actions = np.argmax(self.get_q_values(distributed_q_st_plus_1), axis=1)
-        m = np.zeros((self.tp.batch_size, self.z_values.size))
-
-        batches = np.arange(self.tp.batch_size)
-        for j in range(self.z_values.size):
-            tzj = np.fmax(np.fmin(rewards + (1.0 - game_overs) * self.tp.agent.discount * self.z_values[j],
-                                self.z_values[self.z_values.size - 1]),
-                                self.z_values[0])
-            bj = (tzj - self.z_values[0])/(self.z_values[1] - self.z_values[0])
-            u = (np.ceil(bj)).astype(int)
-            l = (np.floor(bj)).astype(int)
-            m[batches, l] = m[batches, l] + (distributed_q_st_plus_1[batches, target_actions, j] * (u - bj))
-            m[batches, u] = m[batches, u] + (distributed_q_st_plus_1[batches, target_actions, j] * (bj - l))
-        # total_loss = cross entropy between actual result above and predicted result for the given action
-        TD_targets[batches, actions] = m
-
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+
+        # total_loss = cross entropy between the projected distribution and predicted result for the given action
+        head = self.main_network.online_network.output_heads[0]
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, {
+            **current_states,
+            'output_0_0': actions,
+            'output_0_1': rewards,
+            'output_0_2': game_overs,
+        }), distributed_q_st_plus_1, additional_fetches=[head.cross_entropy])
         total_loss = result[0]
+        cross_entropy = result[3][0]
+
+        # the priority of a transition in distributional RL is its cross entropy loss
+        self.update_transition_priorities(batch, cross_entropy)
 
         return total_loss
 
@@ -15,7 +15,6 @@
 #
 
 from agents.actor_critic_agent import *
-from random import shuffle
 
 
 # Clipped Proximal Policy Optimization - https://arxiv.org/abs/1707.06347
@@ -71,14 +70,15 @@ class ClippedPPOAgent(ActorCriticAgent):
         # standardize
         advantages = (advantages - np.mean(advantages)) / (np.std(advantages) + 1e-8)
 
-        for transition, advantage, value_target in zip(batch, advantages, value_targets):
-            transition.info['advantage'] = advantage
-            transition.info['gae_based_value_target'] = value_target
-
         self.action_advantages.add_sample(advantages)
+        return advantages, np.array(value_targets)
 
-    def train_network(self, dataset, epochs):
+    def train_network(self, dataset, advantages, gae_based_value_targets, epochs):
         loss = []
+        # the dataset is converted to arrays once, and the batches of all the epochs are gathered from these arrays
+        all_current_states, _, all_actions, _, _, all_total_return = self.extract_batch(dataset)
+        if not self.tp.env_instance.discrete_controls and len(all_actions.shape) == 1:
+            all_actions = np.expand_dims(all_actions, -1)
         for j in range(epochs):
             loss = {
                 'total_loss': [],
@@ -86,15 +86,12 @@ class ClippedPPOAgent(ActorCriticAgent):
                 'unclipped_grads': [],
                 'fetch_result': []
             }
-            shuffle(dataset)
+            shuffled_indices = np.random.permutation(len(dataset))
             for i in range(int(len(dataset) / self.tp.batch_size)):
-                batch = dataset[i * self.tp.batch_size:(i + 1) * self.tp.batch_size]
-                current_states, _, actions, _, _, total_return = self.extract_batch(batch)
-
-                advantages = np.array([t.info['advantage'] for t in batch])
-                gae_based_value_targets = np.array([t.info['gae_based_value_target'] for t in batch])
-                if not self.tp.env_instance.discrete_controls and len(actions.shape) == 1:
-                    actions = np.expand_dims(actions, -1)
+                batch = shuffled_indices[i * self.tp.batch_size:(i + 1) * self.tp.batch_size]
+                current_states = {k: v[batch] for k, v in all_current_states.items()}
+                actions = all_actions[batch]
+                total_return = all_total_return[batch]
 
                 # get old policy probabilities and distribution
                 result = self.main_network.target_network.predict(current_states)
@@ -105,7 +102,8 @@ class ClippedPPOAgent(ActorCriticAgent):
                            self.main_network.online_network.output_heads[1].entropy]
 
                 total_return = np.expand_dims(total_return, -1)
-                value_targets = gae_based_value_targets if self.tp.agent.estimate_value_using_gae else total_return
+                value_targets = gae_based_value_targets[batch] if self.tp.agent.estimate_value_using_gae \
+                    else total_return
                 inputs = copy.copy(current_states)
                 # TODO: why is this output 0 and not output 1?
                 inputs['output_0_0'] = actions
@@ -116,7 +114,7 @@ class ClippedPPOAgent(ActorCriticAgent):
                     inputs['output_0_{}'.format(input_index + 1)] = input
                 total_loss, policy_losses, unclipped_grads, fetch_result =\
                     self.main_network.online_network.accumulate_gradients(
-                        inputs, [total_return, advantages], additional_fetches=fetches)
+                        inputs, [total_return, advantages[batch]], additional_fetches=fetches)
 
                 self.value_targets.add_sample(value_targets)
                 if self.tp.distributed:
@@ -168,17 +166,19 @@ class ClippedPPOAgent(ActorCriticAgent):
     def train(self):
         self.main_network.sync()
 
-        dataset = self.memory.transitions
+        dataset = self.memory.get_all_transitions()
 
-        self.fill_advantages(dataset)
+        advantages, gae_based_value_targets = self.fill_advantages(dataset)
 
         # take only the requested number of steps
         dataset = dataset[:self.tp.agent.num_consecutive_playing_steps]
+        advantages = advantages[:self.tp.agent.num_consecutive_playing_steps]
+        gae_based_value_targets = gae_based_value_targets[:self.tp.agent.num_consecutive_playing_steps]
 
         if self.tp.distributed and self.tp.agent.share_statistics_between_workers:
-            self.running_observation_stats.push(np.array([np.array(t.state['observation']) for t in dataset]))
+            self.running_observation_stats.push(self.extract_batch(dataset)[0]['observation'])
 
-        losses = self.train_network(dataset, 10)
+        losses = self.train_network(dataset, advantages, gae_based_value_targets, 10)
         self.value_loss.add_sample(losses[0])
         self.policy_loss.add_sample(losses[1])
         self.update_log()  # should be done in order to update the data that has been accumulated * while not playing *
@@ -15,28 +15,48 @@
 #
 
 from agents.value_optimization_agent import *
+from agents.td_targets import *
 
 
 # Double DQN - https://arxiv.org/abs/1509.06461
 class DDQNAgent(ValueOptimizationAgent):
+    fused_targets_type = 'DDQN'
+    applies_importance_weights = True
+    uses_n_step_targets = True
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
 
     def learn_from_batch(self, batch):
-        current_states, next_states, actions, rewards, game_overs, _ = self.extract_batch(batch)
-
-        selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
-        q_st_plus_1 = self.main_network.target_network.predict(next_states)
+        if self.main_network.fused_training_step is not None:
+            return self.learn_from_batch_in_fused_step(batch)
+
+        current_states, next_states, actions, rewards, game_overs, total_return = self.extract_batch(batch)
+
+        if self.has_n_step_bootstrap(batch):
+            # the n-step returns bootstrap from the state that follows the n-step window of each transition
+            bootstrap_states = self.extract_bootstrap_states(batch)
+            selected_actions = np.argmax(self.main_network.online_network.predict(bootstrap_states), 1)
+            q_bootstrap = self.predict_target_values(batch, bootstrap_states, indices=batch.bootstrap_indices)
+        else:
+            selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
+            q_st_plus_1 = self.predict_target_values(batch, next_states)
         TD_targets = self.main_network.online_network.predict(current_states)
 
         # initialize with the current prediction so that we will
         #  only update the action that we have actually done in this transition
-        for i in range(self.tp.batch_size):
-            TD_targets[i, actions[i]] = rewards[i] \
-                                        + (1.0 - game_overs[i]) * self.tp.agent.discount * q_st_plus_1[i][
-                selected_actions[i]]
-
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        if self.has_n_step_bootstrap(batch):
+            new_targets = n_step_targets(total_return, batch.bootstrap_discounts,
+                                         selected_action_values(q_bootstrap, selected_actions))
+        else:
+            new_targets = double_q_learning_targets(rewards, game_overs, self.tp.agent.discount, q_st_plus_1,
+                                                    selected_actions)
+        td_errors = set_action_targets(TD_targets, actions, new_targets)
+
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
         total_loss = result[0]
 
+        self.update_transition_priorities(batch, td_errors)
+
         return total_loss
@@ -25,6 +25,10 @@ class HumanAgent(Agent):
         self.clock = pygame.time.Clock()
         self.max_fps = int(self.tp.visualization.max_fps_for_human_control)
 
+        # the episodes are written to the disk as they finish, and are not kept in the memory
+        self.demonstrations_path = os.path.join(logger.experiments_path, 'demonstrations.bin')
+        self.demonstrations_writer = DemonstrationsWriter(self.demonstrations_path)
+
         screen.log_title("Human Control Mode")
         available_keys = self.env.get_available_keys()
         if available_keys:
@@ -48,11 +52,18 @@ class HumanAgent(Agent):
 
         return action, {"action_value": 0}
 
+    def act(self, phase=RunPhase.TRAIN):
+        episode_ended = super().act(phase)
+        if episode_ended and phase != RunPhase.TEST:
+            self.demonstrations_writer.write_episode(self.memory.get_last_complete_episode())
+            with self.memory_lock:
+                self.memory.clean()
+        return episode_ended
+
     def save_replay_buffer_and_exit(self):
-        replay_buffer_path = os.path.join(logger.experiments_path, 'replay_buffer.p')
-        self.memory.tp = None
-        to_pickle(self.memory, replay_buffer_path)
-        screen.log_title("Replay buffer was stored in {}".format(replay_buffer_path))
+        self.demonstrations_writer.close()
+        screen.log_title("{} episodes were stored in {}".format(self.demonstrations_writer.num_episodes,
+                                                                self.demonstrations_path))
         exit()
 
     def log_to_screen(self, phase):
@@ -15,26 +15,33 @@
 #
 
 from agents.value_optimization_agent import *
+from agents.td_targets import *
 
 
 class MixedMonteCarloAgent(ValueOptimizationAgent):
+    fused_targets_type = 'MMC'
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.mixing_rate = tuning_parameters.agent.monte_carlo_mixing_rate
+        assert not tuning_parameters.agent.calculate_returns_on_sample, \
+            'The Monte Carlo targets require the returns of complete episodes'
 
     def learn_from_batch(self, batch):
+        if self.main_network.fused_training_step is not None:
+            return self.learn_from_batch_in_fused_step(batch)
+
         current_states, next_states, actions, rewards, game_overs, total_return = self.extract_batch(batch)
 
         TD_targets = self.main_network.online_network.predict(current_states)
         selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
-        q_st_plus_1 = self.main_network.target_network.predict(next_states)
+        q_st_plus_1 = self.predict_target_values(batch, next_states)
         # initialize with the current prediction so that we will
         #  only update the action that we have actually done in this transition
-        for i in range(self.tp.batch_size):
-            one_step_target = rewards[i] + (1.0 - game_overs[i]) * self.tp.agent.discount * q_st_plus_1[i][
-                selected_actions[i]]
-            monte_carlo_target = total_return[i]
-            TD_targets[i, actions[i]] = (1 - self.mixing_rate) * one_step_target + self.mixing_rate * monte_carlo_target
+        one_step_target = double_q_learning_targets(rewards, game_overs, self.tp.agent.discount, q_st_plus_1,
+                                                    selected_actions)
+        set_action_targets(TD_targets, actions, mixed_monte_carlo_targets(one_step_target, total_return,
+                                                                          self.mixing_rate))
 
         result = self.main_network.train_and_sync_networks(current_states, TD_targets)
         total_loss = result[0]
@@ -18,6 +18,7 @@ import scipy.signal
 
 from agents.value_optimization_agent import ValueOptimizationAgent
 from agents.policy_optimization_agent import PolicyOptimizationAgent
+from agents.td_targets import *
 from logger import logger
 from utils import Signal, last_sample
 
@@ -42,15 +43,11 @@ class NStepQAgent(ValueOptimizationAgent, PolicyOptimizationAgent):
         state_value_head_targets = self.main_network.online_network.predict(current_states)
 
         # the targets for the state value estimator
-        num_transitions = len(game_overs)
-
         if self.tp.agent.targets_horizon == '1-Step':
             # 1-Step Q learning
             q_st_plus_1 = self.main_network.target_network.predict(next_states)
-
-            for i in reversed(range(num_transitions)):
-                state_value_head_targets[i][actions[i]] = \
-                    rewards[i] + (1.0 - game_overs[i]) * self.tp.agent.discount * np.max(q_st_plus_1[i], 0)
+            set_action_targets(state_value_head_targets, actions,
+                               q_learning_targets(rewards, game_overs, self.tp.agent.discount, q_st_plus_1))
 
         elif self.tp.agent.targets_horizon == 'N-Step':
             # N-Step Q learning
@@ -59,9 +56,7 @@ class NStepQAgent(ValueOptimizationAgent, PolicyOptimizationAgent):
             else:
                 R = np.max(self.main_network.target_network.predict(last_sample(next_states)))
 
-            for i in reversed(range(num_transitions)):
-                R = rewards[i] + self.tp.agent.discount * R
-                state_value_head_targets[i][actions[i]] = R
+            set_action_targets(state_value_head_targets, actions, segment_n_step_targets(rewards, self.tp.agent.discount, R))
 
         else:
             assert True, 'The available values for targets_horizon are: 1-Step, N-Step'
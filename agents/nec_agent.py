@@ -15,20 +15,29 @@
 #
 
 import numpy as np
-import os, pickle
+import os
 from agents.value_optimization_agent import ValueOptimizationAgent
 from logger import screen
+from memories.differentiable_neural_dictionary import DNDWriter
 from utils import RunPhase
 
 
 # Neural Episodic Control - https://arxiv.org/pdf/1703.01988.pdf
 class NECAgent(ValueOptimizationAgent):
+    applies_importance_weights = True
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id,
                                         create_target_network=False)
         self.current_episode_state_embeddings = []
         self.training_started = False
 
+        # insert the episodes to the DND from a background thread
+        self.dnd_writer = None
+        if self.tp.agent.async_dnd_insertions:
+            self.dnd_writer = DNDWriter(self.main_network.online_network.output_heads[0].DND,
+                                        self.tp.agent.dnd_max_pending_insertions)
+
     def learn_from_batch(self, batch):
         if not self.main_network.online_network.output_heads[0].DND.has_enough_entries(self.tp.agent.number_of_knn):
             return 0
@@ -46,7 +55,8 @@ class NECAgent(ValueOptimizationAgent):
             TD_targets[i, actions[i]] = total_return[i]
 
         # train the neural network
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
 
         total_loss = result[0]
 
@@ -85,12 +95,25 @@ class NECAgent(ValueOptimizationAgent):
             # this won't be required after fixing this so that when the heatup is ended, the episode is closed
             returns = episode.get_transitions_attribute('total_return')[:len(self.current_episode_state_embeddings)]
             actions = episode.get_transitions_attribute('action')[:len(self.current_episode_state_embeddings)]
-            self.main_network.online_network.output_heads[0].DND.add(self.current_episode_state_embeddings,
-                                                                     actions, returns)
+            if self.dnd_writer is not None:
+                self.dnd_writer.add(self.current_episode_state_embeddings, actions, returns)
+            else:
+                self.main_network.online_network.output_heads[0].DND.add(self.current_episode_state_embeddings,
+                                                                         actions, returns)
 
         self.current_episode_state_embeddings = []
 
+    def improve(self):
+        super().improve()
+        # the episodes that are still queued are added, so that they are not lost when the agent is done
+        if self.dnd_writer is not None:
+            self.dnd_writer.stop()
+            self.dnd_writer = None
+
     def save_model(self, model_id):
-        self.main_network.save_model(model_id)
-        with open(os.path.join(self.tp.save_model_dir, str(model_id) + '.dnd'), 'wb') as f:
-            pickle.dump(self.main_network.online_network.output_heads[0].DND, f, pickle.HIGHEST_PROTOCOL)
+        super().save_model(model_id)
+        # the checkpoint includes all the episodes that were played until now
+        if self.dnd_writer is not None:
+            self.dnd_writer.flush()
+        self.main_network.online_network.output_heads[0].DND.save(
+            os.path.join(self.tp.save_model_dir, str(model_id) + '.dnd'))
@@ -15,49 +15,48 @@
 #
 
 from agents.value_optimization_agent import *
+from agents.td_targets import *
 
 
 # Persistent Advantage Learning - https://arxiv.org/pdf/1512.04860.pdf
 class PALAgent(ValueOptimizationAgent):
+    fused_targets_type = 'PAL'
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.alpha = tuning_parameters.agent.pal_alpha
         self.persistent = tuning_parameters.agent.persistent_advantage_learning
         self.monte_carlo_mixing_rate = tuning_parameters.agent.monte_carlo_mixing_rate
+        assert not tuning_parameters.agent.calculate_returns_on_sample, \
+            'The Monte Carlo targets require the returns of complete episodes'
 
     def learn_from_batch(self, batch):
+        if self.main_network.fused_training_step is not None:
+            return self.learn_from_batch_in_fused_step(batch)
+
         current_states, next_states, actions, rewards, game_overs, total_return = self.extract_batch(batch)
 
         selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
 
         # next state values
-        q_st_plus_1_target = self.main_network.target_network.predict(next_states)
-        v_st_plus_1_target = np.max(q_st_plus_1_target, 1)
+        q_st_plus_1_target = self.predict_target_values(batch, next_states)
 
         # current state values according to online network
         q_st_online = self.main_network.online_network.predict(current_states)
 
         # current state values according to target network
-        q_st_target = self.main_network.target_network.predict(current_states)
-        v_st_target = np.max(q_st_target, 1)
+        q_st_target = self.predict_target_values(batch, current_states, key='state')
 
         # calculate TD error
         TD_targets = np.copy(q_st_online)
-        for i in range(self.tp.batch_size):
-            TD_targets[i, actions[i]] = rewards[i] + (1.0 - game_overs[i]) * self.tp.agent.discount * \
-                                                     q_st_plus_1_target[i][selected_actions[i]]
-            advantage_learning_update = v_st_target[i] - q_st_target[i, actions[i]]
-            next_advantage_learning_update = v_st_plus_1_target[i] - q_st_plus_1_target[i, selected_actions[i]]
-            # Persistent Advantage Learning or Regular Advantage Learning
-            if self.persistent:
-                TD_targets[i, actions[i]] -= self.alpha * min(advantage_learning_update, next_advantage_learning_update)
-            else:
-                TD_targets[i, actions[i]] -= self.alpha * advantage_learning_update
-
-            # mixing monte carlo updates
-            monte_carlo_target = total_return[i]
-            TD_targets[i, actions[i]] = (1 - self.monte_carlo_mixing_rate) * TD_targets[i, actions[i]] \
-                                        + self.monte_carlo_mixing_rate * monte_carlo_target
+        new_targets = double_q_learning_targets(rewards, game_overs, self.tp.agent.discount, q_st_plus_1_target,
+                                                selected_actions)
+        # Persistent Advantage Learning or Regular Advantage Learning
+        new_targets = advantage_learning_targets(new_targets, actions, q_st_target, q_st_plus_1_target,
+                                                 selected_actions, self.alpha, self.persistent)
+        # mixing monte carlo updates
+        new_targets = mixed_monte_carlo_targets(new_targets, total_return, self.monte_carlo_mixing_rate)
+        set_action_targets(TD_targets, actions, new_targets)
 
         result = self.main_network.train_and_sync_networks(current_states, TD_targets)
         total_loss = result[0]
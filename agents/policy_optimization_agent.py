@@ -64,15 +64,12 @@ class PolicyOptimizationAgent(Agent):
             )
 
     def update_episode_statistics(self, episode):
-        episode_discounted_returns = []
-        for i in range(episode.length()):
-            transition = episode.get_transition(i)
-            episode_discounted_returns.append(transition.total_return)
-            self.num_episodes_where_step_has_been_seen[i] += 1
-            self.mean_return_over_multiple_episodes[i] -= self.mean_return_over_multiple_episodes[i] / \
-                                                          self.num_episodes_where_step_has_been_seen[i]
-            self.mean_return_over_multiple_episodes[i] += transition.total_return / \
-                                                          self.num_episodes_where_step_has_been_seen[i]
+        episode_discounted_returns = np.array(episode.get_returns(), dtype=float)
+        steps = slice(0, episode.length())
+        self.num_episodes_where_step_has_been_seen[steps] += 1
+        self.mean_return_over_multiple_episodes[steps] += \
+            (episode_discounted_returns - self.mean_return_over_multiple_episodes[steps]) / \
+            self.num_episodes_where_step_has_been_seen[steps]
         self.mean_discounted_return = np.mean(episode_discounted_returns)
         self.std_discounted_return = np.std(episode_discounted_returns)
 
@@ -92,18 +89,16 @@ class PolicyOptimizationAgent(Agent):
         total_loss = 0
         if num_steps_passed_since_last_update > 0:
 
-            # we need to update the returns of the episode until now
-            episode.update_returns(self.tp.agent.discount)
+            # we need to update the returns of the episode until now. only the new transitions are calculated.
+            episode.update_segment_returns(self.tp.agent.discount)
 
             # get t_max transitions or less if the we got to a terminal state
             # will be used for both actor-critic and vanilla PG.
             # # In order to get full episodes, Vanilla PG will set the end_idx to a very big value.
-            transitions = []
             start_idx = self.last_gradient_update_step_idx
             end_idx = episode.length()
 
-            for idx in range(start_idx, end_idx):
-                transitions.append(episode.get_transition(idx))
+            transitions = episode.get_batch(start_idx, end_idx)
             self.last_gradient_update_step_idx = end_idx
 
             # update the statistics for the variance reduction techniques
@@ -81,10 +81,8 @@ class PPOAgent(ActorCriticAgent):
         # standardize
         advantages = (advantages - np.mean(advantages)) / np.std(advantages)
 
-        for transition, advantage in zip(self.memory.transitions, advantages):
-            transition.info['advantage'] = advantage
-
         self.action_advantages.add_sample(advantages)
+        return advantages
 
     def train_value_network(self, dataset, epochs):
         loss = []
@@ -137,8 +135,12 @@ class PPOAgent(ActorCriticAgent):
         current_states_with_timestep = np.expand_dims(current_states_with_timestep, -1)
         return current_states_with_timestep
 
-    def train_policy_network(self, dataset, epochs):
+    def train_policy_network(self, dataset, advantages, epochs):
         loss = []
+        # the dataset is converted to arrays once, and the batches of all the epochs are slices of these arrays
+        all_current_states, _, all_actions, _, _, _ = self.extract_batch(dataset)
+        if not self.tp.env_instance.discrete_controls and len(all_actions.shape) == 1:
+            all_actions = np.expand_dims(all_actions, -1)
         for j in range(epochs):
             loss = {
                 'total_loss': [],
@@ -148,11 +150,9 @@ class PPOAgent(ActorCriticAgent):
             }
             #shuffle(dataset)
             for i in range(len(dataset) // self.tp.batch_size):
-                batch = dataset[i * self.tp.batch_size:(i + 1) * self.tp.batch_size]
-                current_states, _, actions, _, _, total_return = self.extract_batch(batch)
-                advantages = np.array([t.info['advantage'] for t in batch])
-                if not self.tp.env_instance.discrete_controls and len(actions.shape) == 1:
-                    actions = np.expand_dims(actions, -1)
+                batch = slice(i * self.tp.batch_size, (i + 1) * self.tp.batch_size)
+                current_states = {k: v[batch] for k, v in all_current_states.items()}
+                actions = all_actions[batch]
 
                 # get old policy probabilities and distribution
                 old_policy = force_list(self.policy_network.target_network.predict(current_states))
@@ -171,7 +171,7 @@ class PPOAgent(ActorCriticAgent):
                     inputs['output_0_{}'.format(input_index + 1)] = input
                 total_loss, policy_losses, unclipped_grads, fetch_result =\
                     self.policy_network.online_network.accumulate_gradients(
-                        inputs, [advantages], additional_fetches=fetches)
+                        inputs, [advantages[batch]], additional_fetches=fetches)
 
                 self.policy_network.apply_gradients_to_online_network()
                 if self.tp.distributed:
@@ -249,15 +249,16 @@ class PPOAgent(ActorCriticAgent):
         self.policy_network.sync()
         self.critic_network.sync()
 
-        dataset = self.memory.transitions
+        dataset = self.memory.get_all_transitions()
 
-        self.fill_advantages(dataset)
+        advantages = self.fill_advantages(dataset)
 
         # take only the requested number of steps
         dataset = dataset[:self.tp.agent.num_consecutive_playing_steps]
+        advantages = advantages[:self.tp.agent.num_consecutive_playing_steps]
 
         value_loss = self.train_value_network(dataset, 1)
-        policy_loss = self.train_policy_network(dataset, 10)
+        policy_loss = self.train_policy_network(dataset, advantages, 10)
 
         self.value_loss.add_sample(value_loss)
         self.policy_loss.add_sample(policy_loss)
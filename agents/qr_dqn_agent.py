@@ -19,6 +19,8 @@ from agents.value_optimization_agent import *
 
 # Quantile Regression Deep Q Network - https://arxiv.org/pdf/1710.10044v1.pdf
 class QuantileRegressionDQNAgent(ValueOptimizationAgent):
+    applies_importance_weights = True
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.quantile_probabilities = np.ones(self.tp.agent.atoms) / float(self.tp.agent.atoms)
@@ -30,37 +32,21 @@ class QuantileRegressionDQNAgent(ValueOptimizationAgent):
     def learn_from_batch(self, batch):
         current_states, next_states, actions, rewards, game_overs, _ = self.extract_batch(batch)
 
-        # get the quantiles of the next states and current states
+        # get the quantiles of the next states. the Bellman update of the quantiles of the optimal next actions, and
+        # the ordering of the quantile midpoints, are calculated by the head (see QuantileRegressionQHead)
         next_state_quantiles = self.main_network.target_network.predict(next_states)
-        current_quantiles = self.main_network.online_network.predict(current_states)
-
-        # get the optimal actions to take for the next states
-        target_actions = np.argmax(self.get_q_values(next_state_quantiles), axis=1)
-
-        # calculate the Bellman update
-        batch_idx = list(range(self.tp.batch_size))
-        rewards = np.expand_dims(rewards, -1)
-        game_overs = np.expand_dims(game_overs, -1)
-        TD_targets = rewards + (1.0 - game_overs) * self.tp.agent.discount \
-                               * next_state_quantiles[batch_idx, target_actions]
-
-        # get the locations of the selected actions within the batch for indexing purposes
-        actions_locations = [[b, a] for b, a in zip(batch_idx, actions)]
-
-        # calculate the cumulative quantile probabilities and reorder them to fit the sorted quantiles order
-        cumulative_probabilities = np.array(range(self.tp.agent.atoms+1))/float(self.tp.agent.atoms)  # tau_i
-        quantile_midpoints = 0.5*(cumulative_probabilities[1:] + cumulative_probabilities[:-1])  # tau^hat_i
-        quantile_midpoints = np.tile(quantile_midpoints, (self.tp.batch_size, 1))
-        sorted_quantiles = np.argsort(current_quantiles[batch_idx, actions])
-        for idx in range(self.tp.batch_size):
-            quantile_midpoints[idx, :] = quantile_midpoints[idx, sorted_quantiles[idx]]
 
         # train
-        result = self.main_network.train_and_sync_networks({
+        head = self.main_network.online_network.output_heads[0]
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, {
             **current_states,
-            'output_0_0': actions_locations,
-            'output_0_1': quantile_midpoints,
-        }, TD_targets)
+            'output_0_0': actions,
+            'output_0_1': rewards,
+            'output_0_2': game_overs,
+        }), next_state_quantiles, additional_fetches=[head.td_errors])
         total_loss = result[0]
 
+        # the priority of a transition is the mean absolute difference between its target and predicted quantiles
+        self.update_transition_priorities(batch, result[3][0])
+
         return total_loss
@@ -0,0 +1,156 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import scipy.signal
+
+
+def selected_action_values(q_values, actions):
+    """
+    :param q_values: the action values of a batch (batch x actions)
+    :param actions: the action to select for each transition of the batch
+    :return: the value of the selected action of each transition
+    """
+    return q_values[np.arange(len(q_values)), actions]
+
+
+def one_step_targets(rewards, game_overs, discount, next_state_values):
+    """
+    The 1-step targets r + discount * V(s') of a batch. The next state value is not used when the episode is over.
+    :param rewards: the rewards of the batch
+    :param game_overs: the game over flags of the batch
+    :param discount: the discount factor
+    :param next_state_values: the value of the next state of each transition
+    :return: the targets
+    """
+    return rewards + (1.0 - game_overs) * discount * next_state_values
+
+
+def q_learning_targets(rewards, game_overs, discount, q_st_plus_1):
+    """
+    The Q learning targets r + discount * max_a Q(s', a) of a batch
+    :param rewards: the rewards of the batch
+    :param game_overs: the game over flags of the batch
+    :param discount: the discount factor
+    :param q_st_plus_1: the action values of the next states (batch x actions)
+    :return: the targets
+    """
+    return one_step_targets(rewards, game_overs, discount, np.max(q_st_plus_1, axis=1))
+
+
+def double_q_learning_targets(rewards, game_overs, discount, q_st_plus_1, selected_actions):
+    """
+    The double Q learning targets r + discount * Q_target(s', argmax_a Q_online(s', a)) of a batch
+    :param rewards: the rewards of the batch
+    :param game_overs: the game over flags of the batch
+    :param discount: the discount factor
+    :param q_st_plus_1: the action values of the next states according to the target network (batch x actions)
+    :param selected_actions: the best actions in the next states according to the online network
+    :return: the targets
+    """
+    return one_step_targets(rewards, game_overs, discount, selected_action_values(q_st_plus_1, selected_actions))
+
+
+def n_step_targets(n_step_returns, bootstrap_discounts, bootstrap_state_values):
+    """
+    The n-step targets r_t + discount * r_t+1 + ... + discount^n * V(s_t+n) of a batch
+    :param n_step_returns: the discounted rewards of the n-step window of each transition
+    :param bootstrap_discounts: the discount of the bootstrap value of each transition (0 when its window reaches the
+                                end of the episode)
+    :param bootstrap_state_values: the value of the state that follows the n-step window of each transition
+    :return: the targets
+    """
+    return n_step_returns + bootstrap_discounts * bootstrap_state_values
+
+
+def mixed_monte_carlo_targets(targets, total_returns, mixing_rate):
+    """
+    Mix bootstrapped targets with the Monte Carlo returns of the transitions
+    :param targets: the bootstrapped targets of the batch
+    :param total_returns: the discounted returns of the transitions until the end of their episode
+    :param mixing_rate: the weight of the Monte Carlo returns
+    :return: the mixed targets
+    """
+    return (1 - mixing_rate) * targets + mixing_rate * total_returns
+
+
+def advantage_learning_targets(targets, actions, q_st_target, q_st_plus_1_target, selected_actions, alpha,
+                               persistent=False):
+    """
+    Subtract the action gaps of (persistent) advantage learning from the targets -
+    https://arxiv.org/pdf/1512.04860.pdf
+    :param targets: the targets of the batch
+    :param actions: the actions of the batch
+    :param q_st_target: the action values of the current states according to the target network (batch x actions)
+    :param q_st_plus_1_target: the action values of the next states according to the target network
+    :param selected_actions: the actions that the targets were bootstrapped from in the next states
+    :param alpha: the weight of the action gap
+    :param persistent: use the smaller of the action gaps in the current and the next states
+    :return: the advantage learning targets
+    """
+    action_gap = np.max(q_st_target, axis=1) - selected_action_values(q_st_target, actions)
+    if persistent:
+        next_action_gap = np.max(q_st_plus_1_target, axis=1) - selected_action_values(q_st_plus_1_target,
+                                                                                      selected_actions)
+        action_gap = np.minimum(action_gap, next_action_gap)
+    return targets - alpha * action_gap
+
+
+def bootstrapped_q_learning_targets(rewards, game_overs, discount, q_st_plus_1_heads):
+    """
+    The Q learning targets of every head of a multi-head network
+    :param rewards: the rewards of the batch
+    :param game_overs: the game over flags of the batch
+    :param discount: the discount factor
+    :param q_st_plus_1_heads: the action values of the next states of each head (heads x batch x actions)
+    :return: the targets of each head (heads x batch)
+    """
+    return one_step_targets(rewards, game_overs, discount, np.max(q_st_plus_1_heads, axis=2))
+
+
+def segment_n_step_targets(rewards, discount, bootstrap_value):
+    """
+    The n-step targets of a contiguous segment of an episode, bootstrapped from the value of the state that follows
+    the last transition - R_i = r_i + discount * R_i+1, where R_n is the bootstrap value. The recursion is a first
+    order filter that runs backwards over the rewards.
+    :param rewards: the rewards of the segment
+    :param discount: the discount factor
+    :param bootstrap_value: the value of the state after the segment (0 if the episode is over)
+    :return: the targets of the segment transitions
+    """
+    rewards = np.asarray(rewards, dtype='float')
+    discounted_rewards = scipy.signal.lfilter([1], [1, -discount], rewards[::-1])[::-1]
+    return discounted_rewards + discount ** np.arange(len(rewards), 0, -1) * bootstrap_value
+
+
+def set_action_targets(q_values, actions, targets, mask=None):
+    """
+    Replace the values of the taken actions with their targets, in place, so that the values of the other actions
+    are trained towards the current prediction (no error)
+    :param q_values: the current action values of the batch (batch x actions), or of each head (heads x batch x
+                     actions)
+    :param actions: the actions of the batch
+    :param targets: the targets of the batch, or of each head (heads x batch)
+    :param mask: which of the transitions are trained (or heads x batch for heads). the rest keep their prediction.
+    :return: the TD errors of the taken actions (targets - current values, 0 where masked)
+    """
+    batch_idx = np.arange(len(actions))
+    current_values = q_values[..., batch_idx, actions]
+    if mask is not None:
+        targets = np.where(mask, targets, current_values)
+    td_errors = targets - current_values
+    q_values[..., batch_idx, actions] = targets
+    return td_errors
@@ -22,13 +22,33 @@ from utils import RunPhase, Signal
 
 
 class ValueOptimizationAgent(Agent):
+    # the targets of the agent for the fused training step, or None if the agent does not support it
+    fused_targets_type = None
+    # whether the agent trains on n-step targets when the returns are calculated on sample
+    uses_n_step_targets = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0, create_target_network=True):
         Agent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.main_network = NetworkWrapper(tuning_parameters, create_target_network, self.has_global, 'main',
                                            self.replicated_device, self.worker_device)
         self.networks.append(self.main_network)
+        assert not tuning_parameters.agent.cache_target_values or self.sequence_length == 0, \
+            'The target values of sequences depend on the recurrent state, so they cannot be cached'
+        assert not tuning_parameters.agent.cache_target_values or tuning_parameters.agent.prefetch_batches == 0, \
+            'Prefetched transitions can be overwritten before they are trained on, so their target values cannot be ' \
+            'cached'
         self.q_values = Signal("Q")
         self.signals.append(self.q_values)
+        if self.uses_n_step_targets and tuning_parameters.agent.calculate_returns_on_sample:
+            assert not tuning_parameters.agent.bootstrap_total_return_from_old_policy, \
+                'The n-step targets bootstrap from the target network, so the returns should not be bootstrapped ' \
+                'from the old policy'
+        if tuning_parameters.agent.fused_training_step:
+            assert self.fused_targets_type is not None, \
+                'The fused training step is not supported by {}'.format(self.__class__.__name__)
+            assert not tuning_parameters.agent.calculate_returns_on_sample, \
+                'The fused training step does not support the n-step targets of returns calculated on sample'
+            self.main_network.create_fused_training_step(self.fused_targets_type)
 
         self.reset_game(do_not_reset_env=True)
 
@@ -75,3 +95,90 @@ class ValueOptimizationAgent(Agent):
 
         action_value = {"action_value": actions_q_values[action], "max_action_value": np.max(actions_q_values)}
         return action, action_value
+
+    def add_importance_weights(self, batch, inputs):
+        """
+        Add the importance sampling weights of a batch that was sampled from a prioritized memory (or the burn in
+        mask of a batch of sequences) to the inputs of the online network, so that the loss of each sample is scaled
+        by its weight
+        :param batch: the batch that the inputs were extracted from
+        :param inputs: the inputs dictionary for the online network
+        :return: the inputs dictionary including the importance sampling weights
+        """
+        if getattr(batch, 'importance_weights', None) is None:
+            return inputs
+        importance_weight = self.main_network.online_network.output_heads[0].importance_weight
+        return {**inputs, importance_weight: batch.importance_weights}
+
+    def update_transition_priorities(self, batch, td_errors):
+        """
+        Update the priorities of the batch transitions in the memory, if the memory is prioritized
+        :param batch: the batch that was trained on
+        :param td_errors: the TD error of each transition in the batch
+        :return: None
+        """
+        if hasattr(self.memory, 'update_priorities') and getattr(batch, 'indices', None) is not None:
+            with self.memory_lock:
+                self.memory.update_priorities(batch.indices, td_errors)
+
+    def learn_from_batch_in_fused_step(self, batch):
+        """
+        Train on a batch through the fused training step of the main network, which calculates the targets inside the
+        graph, and update the priorities of the batch transitions
+        :param batch: the batch to train on
+        :return: the total loss
+        """
+        current_states, next_states, actions, rewards, game_overs, total_return = self.extract_batch(batch)
+        total_loss, td_errors = self.main_network.fused_training_step.train(
+            current_states, next_states, actions, rewards, game_overs, total_return,
+            getattr(batch, 'importance_weights', None))
+        self.update_transition_priorities(batch, td_errors)
+        return total_loss
+
+    def predict_target_values(self, batch, states, key='next_state', indices=None):
+        """
+        Predict the outputs of the target network for the given states of the batch transitions. If the memory caches
+        target values, only the transitions that are missing from the cache, or that were cached before the last
+        target network update, are predicted.
+        :param batch: the batch that the states were extracted from
+        :param states: the inputs dictionary for the target network
+        :param key: the name of the states in the cache (e.g. 'state' or 'next_state')
+        :param indices: the buffer indices of the transitions that the states belong to (the batch indices by default)
+        :return: the target network outputs
+        """
+        target_network = self.main_network.target_network
+        if indices is None:
+            indices = getattr(batch, 'indices', None)
+        if not self.tp.agent.cache_target_values or indices is None:
+            return target_network.predict(states)
+
+        version = self.main_network.target_network_version
+        with self.memory_lock:
+            values, is_missing = self.memory.get_cached_targets(key, indices, version)
+        if values is None:
+            values = target_network.predict(states)
+        elif np.any(is_missing):
+            values[is_missing] = target_network.predict({k: v[is_missing] for k, v in states.items()})
+        if np.any(is_missing):
+            with self.memory_lock:
+                self.memory.cache_targets(key, indices[is_missing], values[is_missing], version)
+        return values
+
+    def has_n_step_bootstrap(self, batch):
+        """
+        Check if the returns of the batch were calculated on sample, so the batch has the n-step bootstrap states
+        :param batch: the sampled batch
+        :return: True if the n-step targets should be used for the batch
+        """
+        return getattr(batch, 'bootstrap_discounts', None) is not None
+
+    def extract_bootstrap_states(self, batch):
+        """
+        Extract the inputs of the states that the n-step returns of the batch bootstrap from
+        :param batch: a batch whose returns were calculated on sample
+        :return: the inputs dictionary for the network
+        """
+        bootstrap_states = {'observation': batch.bootstrap_next_states['observation']}
+        if self.tp.agent.use_measurements:
+            bootstrap_states['measurements'] = batch.bootstrap_next_states['measurements']
+        return bootstrap_states
@@ -20,6 +20,7 @@ from logger import *
 try:
     import tensorflow as tf
     from architectures.tensorflow_components.general_network import GeneralTensorFlowNetwork
+    from architectures.tensorflow_components.fused_training_step import FusedTrainingStep
 except ImportError:
     failed_imports.append("TensorFlow")
 
@@ -49,6 +50,9 @@ class NetworkWrapper(object):
         self.has_global = has_global
         self.name = name
         self.sess = tuning_parameters.sess
+        # incremented on every change to the target network weights, so that cached target values can be invalidated
+        self.target_network_version = 0
+        self.fused_training_step = None
 
         if self.tp.framework == Frameworks.TensorFlow:
             general_network = GeneralTensorFlowNetwork
@@ -88,6 +92,18 @@ class NetworkWrapper(object):
                 self.model_saver.restore(self.tp.sess, checkpoint)
                 self.update_target_network()
 
+    def create_fused_training_step(self, targets_type):
+        """
+        Create a training step that calculates the targets of the online network from the target network and trains
+        it in a single session run (see FusedTrainingStep)
+        :param targets_type: the targets to calculate - 'DQN', 'DDQN', 'MMC' or 'PAL'
+        :return: None
+        """
+        assert self.tp.framework == Frameworks.TensorFlow, 'The fused training step works only with TensorFlow'
+        assert self.target_network is not None, 'The fused training step requires a target network'
+        assert self.global_network is None, 'The fused training step cannot be used with distributed training'
+        self.fused_training_step = FusedTrainingStep(self.tp, self.online_network, self.target_network, targets_type)
+
     def sync(self):
         """
         Initializes the weights of the networks to match each other
@@ -103,6 +119,7 @@ class NetworkWrapper(object):
         """
         if self.target_network:
             self.target_network.set_weights(self.online_network.get_weights(), rate)
+            self.target_network_version += 1
 
     def update_online_network(self, rate=1.0):
         """
@@ -192,8 +192,10 @@ class TensorFlowArchitecture(Architecture):
             additional_fetches_start_idx = len(fetches)
             fetches += additional_fetches
 
-            # feed the lstm state if necessary
-            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+            # feed the lstm state if necessary. a batch of sequences comes with the initial state of each sequence
+            lstm_state_is_given = self.tp.agent.middleware_type == MiddlewareTypes.LSTM and \
+                self.middleware_embedder.c_in in feed_dict
+            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM and not lstm_state_is_given:
                 # we can't always assume that we are starting from scratch here can we?
                 feed_dict[self.middleware_embedder.c_in] = self.middleware_embedder.c_init
                 feed_dict[self.middleware_embedder.h_in] = self.middleware_embedder.h_init
@@ -208,7 +210,7 @@ class TensorFlowArchitecture(Architecture):
 
             # extract the fetches
             norm_unclipped_grads, grads, total_loss, losses = result[:4]
-            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM and not lstm_state_is_given:
                 (self.curr_rnn_c_in, self.curr_rnn_h_in) = result[4]
             fetched_tensors = []
             if len(additional_fetches) > 0:
@@ -283,7 +285,7 @@ class TensorFlowArchitecture(Architecture):
                     ))
 
                 feed_dict[self.inputs[input_name]] = input_value
-            elif isinstance(input_name, tf.Tensor) and input_name.op.type == 'Placeholder':
+            elif isinstance(input_name, tf.Tensor) and input_name.op.type in ['Placeholder', 'PlaceholderWithDefault']:
                 feed_dict[input_name] = input_value
             else:
                 raise ValueError((
@@ -310,7 +312,10 @@ class TensorFlowArchitecture(Architecture):
         if outputs is None:
             outputs = self.outputs
 
-        if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+        if self.tp.agent.middleware_type == MiddlewareTypes.LSTM and self.middleware_embedder.c_in in feed_dict:
+            # a batch of sequences with their initial states. this does not advance the current lstm state.
+            output = self.tp.sess.run(outputs, feed_dict)
+        elif self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
             feed_dict[self.middleware_embedder.c_in] = self.curr_rnn_c_in
             feed_dict[self.middleware_embedder.h_in] = self.curr_rnn_h_in
 
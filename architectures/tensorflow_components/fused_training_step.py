@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import tensorflow as tf
+
+from configurations import MiddlewareTypes
+
+# the targets that the fused training step can calculate, and whether they need the online network values of the
+# next states and the target network values of the current states. the distributional agents (C51 and QR-DQN) are not
+# fused - they still predict the target distributions and train in two session runs, although their targets are
+# calculated inside the graph.
+FUSED_TARGETS_TYPES = {
+    'DQN': (False, False),
+    'DDQN': (True, False),
+    'MMC': (True, False),
+    'PAL': (True, True),
+}
+
+
+class FusedTrainingStep(object):
+    def __init__(self, tuning_parameters, online_network, target_network, targets_type):
+        """
+        A training step of a Q head that runs in a single session run - the target network values of the next
+        states, the Bellman targets, the gradients of the online network and the optimizer update are all a part of
+        one op, so the batch is fed once and no values or gradients are copied back from the graph.
+        When the targets need the values of the online network for the next states (or of the target network for the
+        current states), the network is fed with the current states followed by the next states, and its output is
+        split in two.
+
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :param online_network: the online network, whose first head is a Q head
+        :param target_network: the target network
+        :param targets_type: the targets to calculate - one of FUSED_TARGETS_TYPES
+        """
+        assert targets_type in FUSED_TARGETS_TYPES, \
+            'The fused training step supports the targets {}'.format(', '.join(sorted(FUSED_TARGETS_TYPES.keys())))
+        assert tuning_parameters.agent.middleware_type != MiddlewareTypes.LSTM, \
+            'The fused training step splits the batch of the network, so it cannot be used with an LSTM middleware'
+        assert online_network.optimizer_type != 'LBFGS', 'The fused training step cannot be used with LBFGS'
+        assert len(online_network.output_heads[0].loss_type) == 1, 'The fused training step only trains a Q head'
+        self.tp = tuning_parameters
+        self.online_network = online_network
+        self.target_network = target_network
+        self.targets_type = targets_type
+        self.online_network_gets_next_states, self.target_network_gets_current_states = \
+            FUSED_TARGETS_TYPES[targets_type]
+
+        existing_variables = set(tf.global_variables())
+        with tf.variable_scope(online_network.name + '/fused_training_step'):
+            self.actions = tf.placeholder(tf.int32, [None], name='actions')
+            self.rewards = tf.placeholder(tf.float32, [None], name='rewards')
+            self.game_overs = tf.placeholder(tf.float32, [None], name='game_overs')
+            self.total_returns = tf.placeholder(tf.float32, [None], name='total_returns')
+            self.importance_weights = tf.placeholder_with_default(tf.ones_like(self.rewards), [None],
+                                                                  name='importance_weights')
+            self._build_targets()
+            self._build_update()
+
+        # the slots of the optimizer are shared with the regular training step, so usually nothing is new here
+        new_variables = [v for v in tf.global_variables() if v not in existing_variables]
+        if len(new_variables) > 0 and self.tp.sess:
+            self.tp.sess.run(tf.variables_initializer(new_variables))
+
+    def _build_targets(self):
+        batch_size = tf.shape(self.actions)[0]
+        batch_idx = tf.range(batch_size)
+        discount = self.tp.agent.discount
+
+        online_values = self.online_network.outputs[0]
+        target_values = self.target_network.outputs[0]
+        self.q_st = online_values[:batch_size]
+        if self.target_network_gets_current_states:
+            q_st_target = target_values[:batch_size]
+            q_st_plus_1_target = target_values[batch_size:]
+        else:
+            q_st_plus_1_target = target_values
+
+        if self.targets_type == 'DQN':
+            next_state_values = tf.reduce_max(q_st_plus_1_target, axis=1)
+        else:
+            # double Q learning - the target network value of the best next action according to the online network
+            selected_actions = tf.cast(tf.argmax(online_values[batch_size:], axis=1), tf.int32)
+            next_state_values = tf.gather_nd(q_st_plus_1_target, tf.stack([batch_idx, selected_actions], axis=1))
+        targets = self.rewards + (1.0 - self.game_overs) * discount * next_state_values
+
+        if self.targets_type == 'PAL':
+            # (persistent) advantage learning
+            action_gap = tf.reduce_max(q_st_target, axis=1) - \
+                tf.gather_nd(q_st_target, tf.stack([batch_idx, self.actions], axis=1))
+            if self.tp.agent.persistent_advantage_learning:
+                next_action_gap = tf.reduce_max(q_st_plus_1_target, axis=1) - next_state_values
+                action_gap = tf.minimum(action_gap, next_action_gap)
+            targets -= self.tp.agent.pal_alpha * action_gap
+
+        if self.targets_type in ['MMC', 'PAL']:
+            mixing_rate = self.tp.agent.monte_carlo_mixing_rate
+            targets = (1 - mixing_rate) * targets + mixing_rate * self.total_returns
+
+        # only the action that was taken has an error, and the rest of the actions are trained towards their current
+        # values, as in the regular training step
+        taken_action_values = tf.gather_nd(self.q_st, tf.stack([batch_idx, self.actions], axis=1))
+        self.td_errors = tf.stop_gradient(targets - taken_action_values)
+        num_actions = tf.shape(self.q_st)[1]
+        self.targets = tf.stop_gradient(self.q_st + tf.one_hot(self.actions, num_actions) *
+                                        tf.expand_dims(self.td_errors, 1))
+
+    def _build_update(self):
+        head = self.online_network.output_heads[0]
+        # the same loss as the Q head, but it is not added to the losses collection of the network
+        self.loss = head.loss_type[0](self.targets, self.q_st,
+                                      weights=head.loss_weight[0] * tf.expand_dims(self.importance_weights, 1),
+                                      loss_collection=None)
+        regularizations = head.regularizations + tf.losses.get_regularization_losses(self.online_network.name)
+        self.total_loss = tf.add_n([self.loss] + regularizations)
+
+        weights = self.online_network.trainable_weights
+        gradients = tf.gradients(self.total_loss, weights)
+        if self.tp.clip_gradients is not None and self.tp.clip_gradients != 0:
+            gradients, _ = tf.clip_by_global_norm(gradients, self.tp.clip_gradients)
+        self.train_op = self.online_network.optimizer.apply_gradients(
+            [(gradient, weight) for gradient, weight in zip(gradients, weights) if gradient is not None],
+            global_step=self.online_network.global_step)
+
+    def train(self, current_states, next_states, actions, rewards, game_overs, total_returns=None,
+              importance_weights=None):
+        """
+        Run a training step on a batch
+        :param current_states: the inputs dictionary of the current states
+        :param next_states: the inputs dictionary of the next states
+        :param actions: the actions of the batch
+        :param rewards: the rewards of the batch
+        :param game_overs: the game over flags of the batch
+        :param total_returns: the discounted returns of the batch (for the Monte Carlo mixing targets)
+        :param importance_weights: the importance sampling weights of the batch (optional)
+        :return: the total loss and the TD errors of the taken actions
+        """
+        feed_dict = {
+            self.actions: actions,
+            self.rewards: rewards,
+            self.game_overs: game_overs,
+        }
+        if self.targets_type in ['MMC', 'PAL']:
+            feed_dict[self.total_returns] = total_returns
+        if importance_weights is not None:
+            feed_dict[self.importance_weights] = importance_weights
+
+        for name, placeholder in self.online_network.inputs.items():
+            if name in current_states:
+                feed_dict[placeholder] = np.concatenate([current_states[name], next_states[name]]) \
+                    if self.online_network_gets_next_states else current_states[name]
+        for name, placeholder in self.target_network.inputs.items():
+            if name in next_states:
+                feed_dict[placeholder] = np.concatenate([current_states[name], next_states[name]]) \
+                    if self.target_network_gets_current_states else next_states[name]
+
+        _, total_loss, td_errors = self.tp.sess.run([self.train_op, self.total_loss, self.td_errors],
+                                                    feed_dict=feed_dict)
+        return total_loss, td_errors
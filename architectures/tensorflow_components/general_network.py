@@ -141,6 +141,10 @@ class GeneralTensorFlowNetwork(TensorFlowArchitecture):
                 state_embedding = tf.concat(state_embedding, axis=-1) if len(state_embedding) > 1 else state_embedding[0]
                 self.middleware_embedder = self.get_middleware_embedder(self.tp.agent.middleware_type)
                 _, self.state_embedding = self.middleware_embedder(state_embedding)
+                if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+                    # allows feeding the initial state of each sequence in a batch of sequences
+                    self.inputs['lstm_c_in'] = self.middleware_embedder.c_in
+                    self.inputs['lstm_h_in'] = self.middleware_embedder.h_in
 
                 ################
                 # Output Heads #
@@ -48,6 +48,10 @@ class Head(object):
         :return: the output of the last layer and the target placeholder
         """
         with tf.variable_scope(self.get_name(), initializer=tf.contrib.layers.xavier_initializer()):
+            # per sample loss weights, used for correcting the bias of non uniform sampling from the replay buffer.
+            # when they are not fed, all the samples are weighted equally.
+            self.importance_weight = tf.placeholder_with_default(tf.ones_like(input_layer[:, 0]), [None],
+                                                                 name='importance_weight')
             self._build_module(input_layer)
 
             self.output = force_list(self.output)
@@ -103,8 +107,15 @@ class Head(object):
         for idx in range(len(self.loss_type)):
             target = tf.placeholder('float', self.output[idx].shape, '{}_target'.format(self.get_name()))
             self.target.append(target)
+            # broadcast the per sample weights over the rest of the output dimensions. the rank of outputs that
+            # come from a py_func can be unknown, in which case the weights are reshaped according to the runtime rank
+            if self.output[idx].shape.ndims is not None:
+                weights_shape = [-1] + [1] * (self.output[idx].shape.ndims - 1)
+            else:
+                weights_shape = tf.concat([[-1], tf.ones([tf.rank(self.output[idx]) - 1], tf.int32)], axis=0)
+            importance_weight = tf.reshape(self.importance_weight, weights_shape)
             loss = self.loss_type[idx](self.target[-1], self.output[idx],
-                                       weights=self.loss_weight[idx], scope=self.get_name())
+                                       weights=self.loss_weight[idx] * importance_weight, scope=self.get_name())
             self.loss.append(loss)
 
         # add regularizations
@@ -286,36 +297,56 @@ class DNDQHead(Head):
 
     def _build_module(self, input_layer):
         # DND based Q head
-        from memories import differentiable_neural_dictionary
-
-        if self.tp.checkpoint_restore_dir:
+        from memories import differentiable_neural_dictionary, dnd_server
+
+        if self.tp.agent.dnd_index_type == 'IVF':
+            index_parameters = {'num_lists': self.tp.agent.dnd_ivf_num_lists,
+                                'num_probes': self.tp.agent.dnd_ivf_num_probes}
+        elif self.tp.agent.dnd_index_type == 'Annoy':
+            index_parameters = {'num_trees': self.tp.agent.dnd_annoy_num_trees,
+                                'search_k': self.tp.agent.dnd_annoy_search_k}
+        else:
+            index_parameters = {}
+
+        if self.tp.agent.dnd_server_address:
+            # a DND that is shared by all the workers. the server restores it from the checkpoint by itself.
+            self.DND = dnd_server.RemoteQDND(
+                self.tp.agent.dnd_server_address, self.tp.agent.dnd_server_authkey, self.DND_size,
+                input_layer.get_shape()[-1], self.num_actions,
+                new_value_shift_coefficient=self.new_value_shift_coefficient,
+                key_error_threshold=self.DND_key_error_threshold, learning_rate=self.tp.learning_rate,
+                index_type=self.tp.agent.dnd_index_type, index_parameters=index_parameters,
+                num_query_threads=self.tp.agent.dnd_query_threads)
+        elif self.tp.checkpoint_restore_dir:
             self.DND = differentiable_neural_dictionary.load_dnd(self.tp.checkpoint_restore_dir)
         else:
             self.DND = differentiable_neural_dictionary.QDND(
                 self.DND_size, input_layer.get_shape()[-1], self.num_actions, self.new_value_shift_coefficient,
-                key_error_threshold=self.DND_key_error_threshold, learning_rate=self.tp.learning_rate)
+                key_error_threshold=self.DND_key_error_threshold, learning_rate=self.tp.learning_rate,
+                index_type=self.tp.agent.dnd_index_type, index_parameters=index_parameters,
+                num_query_threads=self.tp.agent.dnd_query_threads)
 
         # Retrieve info from DND dictionary
         # We assume that all actions have enough entries in the DND
-        self.output = tf.transpose([
-            self._q_value(input_layer, action)
-            for action in range(self.num_actions)
-        ])
-
-    def _q_value(self, input_layer, action):
-        result = tf.py_func(self.DND.query,
-                            [input_layer, action, self.number_of_nn],
-                            [tf.float64, tf.float64, tf.int64])
-        self.dnd_embeddings[action] = tf.to_float(result[0])
-        self.dnd_values[action] = tf.to_float(result[1])
-        self.dnd_indices[action] = result[2]
+        # all the action dictionaries are queried for the whole batch in a single call
+        embeddings, values, indices = tf.py_func(self.DND.query_all,
+                                                 [input_layer, self.number_of_nn],
+                                                 [tf.float32, tf.float32, tf.int64])
+        key_width = input_layer.get_shape()[-1]
+        embeddings.set_shape([self.num_actions, None, self.number_of_nn, key_width])
+        values.set_shape([self.num_actions, None, self.number_of_nn])
+        indices.set_shape([self.num_actions, None, self.number_of_nn])
+        for action in range(self.num_actions):
+            self.dnd_embeddings[action] = embeddings[action]
+            self.dnd_values[action] = values[action]
+            self.dnd_indices[action] = indices[action]
 
         # DND calculation
-        square_diff = tf.square(self.dnd_embeddings[action] - tf.expand_dims(input_layer, 1))
-        distances = tf.reduce_sum(square_diff, axis=2) + [self.l2_norm_added_delta]
+        square_diff = tf.square(embeddings - tf.expand_dims(tf.expand_dims(input_layer, 0), 2))
+        distances = tf.reduce_sum(square_diff, axis=3) + [self.l2_norm_added_delta]
         weights = 1.0 / distances
-        normalised_weights = weights / tf.reduce_sum(weights, axis=1, keep_dims=True)
-        return tf.reduce_sum(self.dnd_values[action] * normalised_weights, axis=1)
+        normalised_weights = weights / tf.reduce_sum(weights, axis=2, keep_dims=True)
+        self.output = tf.transpose(tf.reduce_sum(values * normalised_weights, axis=2))
 
 
 class NAFHead(Head):
@@ -495,22 +526,62 @@ class CategoricalQHead(Head):
         self.name = 'categorical_dqn_head'
         self.num_actions = tuning_parameters.env_instance.action_space_size
         self.num_atoms = tuning_parameters.agent.atoms
+        self.discount = tuning_parameters.agent.discount
+        self.z_values = np.linspace(tuning_parameters.agent.v_min, tuning_parameters.agent.v_max, self.num_atoms)
 
     def _build_module(self, input_layer):
         self.actions = tf.placeholder(tf.int32, [None], name="actions")
-        self.input = [self.actions]
+        self.rewards = tf.placeholder(tf.float32, [None], name="rewards")
+        self.game_overs = tf.placeholder(tf.float32, [None], name="game_overs")
+        self.input = [self.actions, self.rewards, self.game_overs]
 
         values_distribution = tf.layers.dense(input_layer, self.num_actions * self.num_atoms, name='output')
         values_distribution = tf.reshape(values_distribution, (tf.shape(values_distribution)[0], self.num_actions, self.num_atoms))
         # softmax on atoms dimension
         self.output = tf.nn.softmax(values_distribution)
 
-        # calculate cross entropy loss
+        # the target is the distribution of the next states according to the target network. the distribution of the
+        # best next action is projected on the atoms here, so that the agent does not calculate it.
         self.distributions = tf.placeholder(tf.float32, shape=(None, self.num_actions, self.num_atoms), name="distributions")
         self.target = self.distributions
-        self.loss = tf.nn.softmax_cross_entropy_with_logits(labels=self.target, logits=values_distribution)
+        batch_idx = tf.range(tf.shape(self.actions)[0])
+        target_distribution = tf.stop_gradient(self._project_distribution(batch_idx))
+
+        # calculate cross entropy loss, only for the action that was actually taken
+        taken_action_logits = tf.gather_nd(values_distribution, tf.stack([batch_idx, self.actions], axis=1))
+        self.cross_entropy = tf.nn.softmax_cross_entropy_with_logits(labels=target_distribution,
+                                                                     logits=taken_action_logits)
+        self.loss = self.cross_entropy * self.importance_weight
         tf.losses.add_loss(self.loss)
 
+    def _project_distribution(self, batch_idx):
+        z_values = tf.constant(self.z_values, dtype=tf.float32)
+        v_min, v_max = float(self.z_values[0]), float(self.z_values[-1])
+
+        # the distribution of the best action in the next states
+        target_actions = tf.cast(tf.argmax(tf.reduce_sum(self.distributions * z_values, axis=2), axis=1), tf.int32)
+        target_probabilities = tf.gather_nd(self.distributions, tf.stack([batch_idx, target_actions], axis=1))
+
+        # the bellman update of every atom, and its position between the atoms
+        tz = tf.clip_by_value(tf.expand_dims(self.rewards, 1) +
+                              tf.expand_dims(1.0 - self.game_overs, 1) * self.discount * z_values, v_min, v_max)
+        bj = (tz - v_min) / float(self.z_values[1] - self.z_values[0])
+        u = tf.ceil(bj)
+        l = tf.floor(bj)
+        # when an update lands exactly on an atom, u == l and both of the splits below are 0, so the probability is
+        # moved entirely to one of the neighbors instead
+        l = tf.where((u > 0) & tf.equal(l, u), l - 1, l)
+        u = tf.where((l < self.num_atoms - 1) & tf.equal(l, u), u + 1, u)
+
+        # split the probability of every atom between its lower and upper neighbor atoms. the atoms of all the batch
+        # are summed together, so each sample is offset to its own segment of atoms.
+        offsets = tf.expand_dims(batch_idx * self.num_atoms, 1)
+        segment_ids = tf.concat([offsets + tf.cast(l, tf.int32), offsets + tf.cast(u, tf.int32)], axis=1)
+        probabilities = tf.concat([target_probabilities * (u - bj), target_probabilities * (bj - l)], axis=1)
+        m = tf.unsorted_segment_sum(tf.reshape(probabilities, [-1]), tf.reshape(segment_ids, [-1]),
+                                    tf.shape(batch_idx)[0] * self.num_atoms)
+        return tf.reshape(m, [-1, self.num_atoms])
+
 
 class QuantileRegressionQHead(Head):
     def __init__(self, tuning_parameters, head_idx=0, loss_weight=1., is_local=True):
@@ -519,29 +590,46 @@ class QuantileRegressionQHead(Head):
         self.num_actions = tuning_parameters.env_instance.action_space_size
         self.num_atoms = tuning_parameters.agent.atoms  # we use atom / quantile interchangeably
         self.huber_loss_interval = 1  # k
+        self.discount = tuning_parameters.agent.discount
 
     def _build_module(self, input_layer):
-        self.actions = tf.placeholder(tf.int32, [None, 2], name="actions")
-        self.quantile_midpoints = tf.placeholder(tf.float32, [None, self.num_atoms], name="quantile_midpoints")
-        self.input = [self.actions, self.quantile_midpoints]
+        self.actions = tf.placeholder(tf.int32, [None], name="actions")
+        self.rewards = tf.placeholder(tf.float32, [None], name="rewards")
+        self.game_overs = tf.placeholder(tf.float32, [None], name="game_overs")
+        self.input = [self.actions, self.rewards, self.game_overs]
 
         # the output of the head is the N unordered quantile locations {theta_1, ..., theta_N}
         quantiles_locations = tf.layers.dense(input_layer, self.num_actions * self.num_atoms, name='output')
         quantiles_locations = tf.reshape(quantiles_locations, (tf.shape(quantiles_locations)[0], self.num_actions, self.num_atoms))
         self.output = quantiles_locations
 
-        self.quantiles = tf.placeholder(tf.float32, shape=(None, self.num_atoms), name="quantiles")
-        self.target = self.quantiles
+        # the target is the quantiles of the next states according to the target network
+        self.next_state_quantiles = tf.placeholder(tf.float32, shape=(None, self.num_actions, self.num_atoms),
+                                                   name="quantiles")
+        self.target = self.next_state_quantiles
+        batch_idx = tf.range(tf.shape(self.actions)[0])
+
+        # the Bellman update of the quantiles of the best next actions
+        target_actions = tf.cast(tf.argmax(tf.reduce_mean(self.next_state_quantiles, axis=2), axis=1), tf.int32)
+        target_quantiles = tf.expand_dims(self.rewards, 1) + tf.expand_dims(1.0 - self.game_overs, 1) * \
+            self.discount * tf.gather_nd(self.next_state_quantiles, tf.stack([batch_idx, target_actions], axis=1))
+        target_quantiles = tf.stop_gradient(target_quantiles)
 
         # only the quantiles of the taken action are taken into account
-        quantiles_for_used_actions = tf.gather_nd(quantiles_locations, self.actions)
+        quantiles_for_used_actions = tf.gather_nd(quantiles_locations, tf.stack([batch_idx, self.actions], axis=1))
+
+        # the cumulative quantile probabilities, reordered to fit the sorted quantiles order
+        cumulative_probabilities = np.arange(self.num_atoms + 1) / float(self.num_atoms)  # tau_i
+        quantile_midpoints = 0.5 * (cumulative_probabilities[1:] + cumulative_probabilities[:-1])  # tau^hat_i
+        sorted_quantiles = tf.nn.top_k(-tf.stop_gradient(quantiles_for_used_actions), k=self.num_atoms).indices
+        quantile_midpoints = tf.gather(tf.constant(quantile_midpoints, dtype=tf.float32), sorted_quantiles)
 
         # reorder the output quantiles and the target quantiles as a preparation step for calculating the loss
         # the output quantiles vector and the quantile midpoints are tiled as rows of a NxN matrix (N = num quantiles)
         # the target quantiles vector is tiled as column of a NxN matrix
         theta_i = tf.tile(tf.expand_dims(quantiles_for_used_actions, -1), [1, 1, self.num_atoms])
-        T_theta_j = tf.tile(tf.expand_dims(self.target, -2), [1, self.num_atoms, 1])
-        tau_i = tf.tile(tf.expand_dims(self.quantile_midpoints, -1), [1, 1, self.num_atoms])
+        T_theta_j = tf.tile(tf.expand_dims(target_quantiles, -2), [1, self.num_atoms, 1])
+        tau_i = tf.tile(tf.expand_dims(quantile_midpoints, -1), [1, 1, self.num_atoms])
 
         # Huber loss of T(theta_j) - theta_i
         error = T_theta_j - theta_i
@@ -549,8 +637,12 @@ class QuantileRegressionQHead(Head):
         quadratic = tf.minimum(abs_error, self.huber_loss_interval)
         huber_loss = self.huber_loss_interval * (abs_error - quadratic) + 0.5 * quadratic ** 2
 
+        # the priority of a transition is the mean absolute difference between its target and predicted quantiles
+        self.td_errors = tf.reduce_mean(abs_error, axis=[1, 2])
+
         # Quantile Huber loss
         quantile_huber_loss = tf.abs(tau_i - tf.cast(error < 0, dtype=tf.float32)) * huber_loss
+        quantile_huber_loss = quantile_huber_loss * tf.reshape(self.importance_weight, [-1, 1, 1])
 
         # Quantile regression loss (the probability for each quantile is 1/num_quantiles)
         quantile_regression_loss = tf.reduce_sum(quantile_huber_loss) / float(self.num_atoms)
@@ -44,12 +44,11 @@ class MiddlewareEmbedder(object):
 class LSTM_Embedder(MiddlewareEmbedder):
     def _build_module(self):
         """
-        self.state_in: tuple of placeholders containing the initial state
-        self.state_out: tuple of output state
+        self.state_in: tuple of placeholders containing the initial state of each sequence in the batch
+        self.state_out: tuple of output state of each sequence in the batch
 
-        todo: it appears that the shape of the output is batch, feature
-        the code here seems to be slicing off the first element in the batch
-        which would definitely be wrong. need to double check the shape
+        The batch is a concatenation of equal length sequences - one sequence for each row of the initial state.
+        Feeding a single initial state treats the whole batch as one sequence.
         """
 
         middleware = tf.layers.dense(self.input, 512, activation=self.activation_function, name='fc1')
@@ -57,16 +56,16 @@ class LSTM_Embedder(MiddlewareEmbedder):
         self.c_init = np.zeros((1, lstm_cell.state_size.c), np.float32)
         self.h_init = np.zeros((1, lstm_cell.state_size.h), np.float32)
         self.state_init = [self.c_init, self.h_init]
-        self.c_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.c])
-        self.h_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.h])
+        self.c_in = tf.placeholder(tf.float32, [None, lstm_cell.state_size.c], name='c_in')
+        self.h_in = tf.placeholder(tf.float32, [None, lstm_cell.state_size.h], name='h_in')
         self.state_in = (self.c_in, self.h_in)
-        rnn_in = tf.expand_dims(middleware, [0])
-        step_size = tf.shape(middleware)[:1]
+        num_sequences = tf.shape(self.c_in)[0]
+        rnn_in = tf.reshape(middleware, [num_sequences, -1, 512])
         state_in = tf.contrib.rnn.LSTMStateTuple(self.c_in, self.h_in)
         lstm_outputs, lstm_state = tf.nn.dynamic_rnn(
-            lstm_cell, rnn_in, initial_state=state_in, sequence_length=step_size, time_major=False)
+            lstm_cell, rnn_in, initial_state=state_in, time_major=False)
         lstm_c, lstm_h = lstm_state
-        self.state_out = (lstm_c[:1, :], lstm_h[:1, :])
+        self.state_out = (lstm_c, lstm_h)
         self.output = tf.reshape(lstm_outputs, [-1, 256])
 
 
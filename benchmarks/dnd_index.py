@@ -0,0 +1,104 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Fills a DND with episodes of keys through each of the nearest neighbors indices, and measures the time it takes to
+add an episode (the mean and the worst case, which includes the index rebuilds), the time it takes to query it, and
+the recall of the queried neighbors compared to an exact search.
+
+    python3 benchmarks/dnd_index.py -s 100000 -w 512 -e 1000
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from memories.differentiable_neural_dictionary import NeuralDictionary, DND_INDEX_TYPES
+from memories.dnd_index import k_nearest_neighbors
+
+
+def random_keys(centers, num_keys):
+    # keys that are clustered, like the state embeddings of an agent
+    return centers[np.random.randint(len(centers), size=num_keys)] + np.random.randn(num_keys, centers.shape[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index_types',
+                        help="(string) comma separated index types to measure",
+                        default=','.join(sorted(DND_INDEX_TYPES.keys())),
+                        type=str)
+    parser.add_argument('-s', '--dict_size',
+                        help="(int) the size of the dictionary",
+                        default=100000,
+                        type=int)
+    parser.add_argument('-w', '--key_width',
+                        help="(int) the width of the keys",
+                        default=512,
+                        type=int)
+    parser.add_argument('-e', '--episode_length',
+                        help="(int) the number of keys added together at the end of each episode",
+                        default=1000,
+                        type=int)
+    parser.add_argument('-k', '--number_of_knn',
+                        help="(int) the number of neighbors of each query",
+                        default=50,
+                        type=int)
+    parser.add_argument('-q', '--num_queries',
+                        help="(int) the number of queries to measure",
+                        default=100,
+                        type=int)
+    parser.add_argument('--num_lists',
+                        help="(int) the number of lists of the IVF index",
+                        default=256,
+                        type=int)
+    parser.add_argument('--num_probes',
+                        help="(int) the number of lists that the IVF index searches",
+                        default=8,
+                        type=int)
+    args = parser.parse_args()
+
+    centers = 5 * np.random.randn(1000, args.key_width)
+    episodes = [random_keys(centers, args.episode_length)
+                for _ in range(args.dict_size // args.episode_length)]
+    queries = random_keys(centers, args.num_queries)
+
+    print('{:>8} | {:>14} {:>14} | {:>14} | {:>8}'.format('index', 'add mean', 'add max', 'query', 'recall'))
+    for index_type in args.index_types.split(','):
+        index_parameters = {'num_lists': args.num_lists, 'num_probes': args.num_probes} if index_type == 'IVF' else {}
+        dictionary = NeuralDictionary(args.dict_size, args.key_width, key_error_threshold=0,
+                                      index_type=index_type, index_parameters=index_parameters)
+
+        add_times = []
+        for episode in episodes:
+            start_time = time.time()
+            dictionary.add(episode, np.random.randn(len(episode), 1))
+            add_times.append(time.time() - start_time)
+
+        start_time = time.time()
+        for query in queries:
+            _, _, indices = dictionary.query([query], args.number_of_knn)
+        query_time = (time.time() - start_time) / len(queries)
+
+        _, found = dictionary.index.search(queries, args.number_of_knn)
+        _, exact = k_nearest_neighbors(queries, dictionary.embeddings[:dictionary.curr_size], args.number_of_knn)
+        recall = np.mean([len(set(f) & set(e)) / float(args.number_of_knn) for f, e in zip(found, exact)])
+
+        print('{:>8} | {:>11.3f} ms {:>11.3f} ms | {:>11.3f} ms | {:>8.3f}'.format(
+            index_type, 1000 * np.mean(add_times), 1000 * np.max(add_times), 1000 * query_time, recall))
@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Measures the time it takes to close an episode - calculating the n-step returns and the DFP measurement targets -
+as a function of the episode length, and compares it to the loop based implementation that was used before.
+
+    python3 benchmarks/episode_kernels.py -l 100,1000,10000 -n 100
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from memories.memory import calculate_discounted_returns, calculate_future_measurements
+
+
+def loop_discounted_returns(rewards, discount, bootstraps=None, n_step_return=-1):
+    num_steps = len(rewards)
+    if n_step_return == -1 or n_step_return > num_steps:
+        n_step_return = num_steps
+    rewards = np.asarray(rewards).astype('float')
+    total_return = rewards.copy()
+    current_discount = discount
+    for i in range(1, n_step_return):
+        total_return += current_discount * np.pad(rewards[i:], (0, i), 'constant', constant_values=0)
+        current_discount *= discount
+    if bootstraps is not None:
+        bootstraps = np.asarray(bootstraps).astype('float')[n_step_return:]
+        total_return += current_discount * np.pad(bootstraps, (0, n_step_return), 'constant', constant_values=0)
+    return total_return
+
+
+def loop_future_measurements(measurements, next_measurements, num_steps):
+    episode_length, measurements_size = measurements.shape
+    future_measurements = np.zeros((episode_length, num_steps, measurements_size))
+    for transition_idx in range(episode_length):
+        for step in range(num_steps):
+            offset_idx = transition_idx + 2 ** step
+            if offset_idx >= episode_length:
+                offset_idx = -1
+            future_measurements[transition_idx, step] = next_measurements[offset_idx] - measurements[transition_idx]
+    return future_measurements
+
+
+def measure(function, repeats):
+    return min(timeit.repeat(function, number=1, repeat=repeats)) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--episode_lengths',
+                        help="(string) comma separated episode lengths to measure",
+                        default='100,1000,10000,100000',
+                        type=str)
+    parser.add_argument('-n', '--n_step',
+                        help="(int) the number of steps in the n-step return (-1 for the full episode return)",
+                        default=100,
+                        type=int)
+    parser.add_argument('-d', '--discount',
+                        help="(float) the discount factor",
+                        default=0.99,
+                        type=float)
+    parser.add_argument('-s', '--num_predicted_steps_ahead',
+                        help="(int) the number of DFP prediction steps",
+                        default=6,
+                        type=int)
+    parser.add_argument('-r', '--repeats',
+                        help="(int) the number of times to repeat each measurement",
+                        default=3,
+                        type=int)
+    args = parser.parse_args()
+
+    print('{:>10} | {:>14} {:>14} {:>8} | {:>14} {:>14} {:>8}'.format(
+        'length', 'returns loop', 'returns vec', 'speedup', 'targets loop', 'targets vec', 'speedup'))
+    for episode_length in [int(length) for length in args.episode_lengths.split(',')]:
+        rewards = np.random.randn(episode_length)
+        bootstraps = np.random.randn(episode_length)
+        measurements = np.cumsum(np.random.randn(episode_length, 3), axis=0)
+        next_measurements = np.roll(measurements, -1, axis=0)
+
+        assert np.allclose(loop_discounted_returns(rewards, args.discount, bootstraps, args.n_step),
+                           calculate_discounted_returns(rewards, args.discount, bootstraps, args.n_step))
+        assert np.allclose(loop_future_measurements(measurements, next_measurements, args.num_predicted_steps_ahead),
+                           calculate_future_measurements(measurements, next_measurements,
+                                                         args.num_predicted_steps_ahead))
+
+        returns_loop = measure(lambda: loop_discounted_returns(rewards, args.discount, bootstraps, args.n_step),
+                               args.repeats)
+        returns_vectorized = measure(lambda: calculate_discounted_returns(rewards, args.discount, bootstraps,
+                                                                          args.n_step), args.repeats)
+        targets_loop = measure(lambda: loop_future_measurements(measurements, next_measurements,
+                                                                args.num_predicted_steps_ahead), args.repeats)
+        targets_vectorized = measure(lambda: calculate_future_measurements(measurements, next_measurements,
+                                                                           args.num_predicted_steps_ahead),
+                                     args.repeats)
+
+        print('{:>10} | {:>11.3f} ms {:>11.3f} ms {:>7.1f}x | {:>11.3f} ms {:>11.3f} ms {:>7.1f}x'.format(
+            episode_length, returns_loop, returns_vectorized, returns_loop / returns_vectorized,
+            targets_loop, targets_vectorized, targets_loop / targets_vectorized))
@@ -0,0 +1,158 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Measures the time it takes to calculate the Bellman targets of a batch through the per transition loops that the
+value optimization agents used, and through the batched calculations of agents/td_targets.py, and checks that both
+give the same targets.
+
+    python3 benchmarks/td_targets.py -b 32,64,128,256,512,1024
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.td_targets import *
+
+DISCOUNT = 0.99
+ALPHA = 0.9
+MIXING_RATE = 0.1
+
+
+def dqn_loop(q_st, actions, rewards, game_overs, q_st_plus_1):
+    targets = np.copy(q_st)
+    for i in range(len(actions)):
+        targets[i, actions[i]] = rewards[i] + (1.0 - game_overs[i]) * DISCOUNT * np.max(q_st_plus_1[i], 0)
+    return targets
+
+
+def dqn_batched(q_st, actions, rewards, game_overs, q_st_plus_1):
+    targets = np.copy(q_st)
+    set_action_targets(targets, actions, q_learning_targets(rewards, game_overs, DISCOUNT, q_st_plus_1))
+    return targets
+
+
+def pal_loop(q_st, actions, rewards, game_overs, q_st_plus_1, q_st_target, selected_actions, total_returns):
+    targets = np.copy(q_st)
+    v_st_plus_1 = np.max(q_st_plus_1, 1)
+    v_st_target = np.max(q_st_target, 1)
+    for i in range(len(actions)):
+        targets[i, actions[i]] = rewards[i] + (1.0 - game_overs[i]) * DISCOUNT * q_st_plus_1[i][selected_actions[i]]
+        advantage_learning_update = v_st_target[i] - q_st_target[i, actions[i]]
+        next_advantage_learning_update = v_st_plus_1[i] - q_st_plus_1[i, selected_actions[i]]
+        targets[i, actions[i]] -= ALPHA * min(advantage_learning_update, next_advantage_learning_update)
+        targets[i, actions[i]] = (1 - MIXING_RATE) * targets[i, actions[i]] + MIXING_RATE * total_returns[i]
+    return targets
+
+
+def pal_batched(q_st, actions, rewards, game_overs, q_st_plus_1, q_st_target, selected_actions, total_returns):
+    targets = np.copy(q_st)
+    new_targets = double_q_learning_targets(rewards, game_overs, DISCOUNT, q_st_plus_1, selected_actions)
+    new_targets = advantage_learning_targets(new_targets, actions, q_st_target, q_st_plus_1, selected_actions,
+                                             ALPHA, persistent=True)
+    set_action_targets(targets, actions, mixed_monte_carlo_targets(new_targets, total_returns, MIXING_RATE))
+    return targets
+
+
+def bootstrapped_loop(q_st_heads, actions, rewards, game_overs, q_st_plus_1_heads, masks):
+    targets = [np.copy(q) for q in q_st_heads]
+    for i in range(len(actions)):
+        for head_idx in range(len(q_st_heads)):
+            if masks[i][head_idx] == 1:
+                targets[head_idx][i, actions[i]] = rewards[i] + (1.0 - game_overs[i]) * DISCOUNT * \
+                                                   np.max(q_st_plus_1_heads[head_idx][i], 0)
+    return np.array(targets)
+
+
+def bootstrapped_batched(q_st_heads, actions, rewards, game_overs, q_st_plus_1_heads, masks):
+    targets = np.array(q_st_heads)
+    set_action_targets(targets, actions,
+                       bootstrapped_q_learning_targets(rewards, game_overs, DISCOUNT, np.array(q_st_plus_1_heads)),
+                       mask=np.transpose(masks) == 1)
+    return targets
+
+
+def n_step_loop(q_st, actions, rewards, bootstrap_value):
+    targets = np.copy(q_st)
+    R = bootstrap_value
+    for i in reversed(range(len(actions))):
+        R = rewards[i] + DISCOUNT * R
+        targets[i][actions[i]] = R
+    return targets
+
+
+def n_step_batched(q_st, actions, rewards, bootstrap_value):
+    targets = np.copy(q_st)
+    set_action_targets(targets, actions, segment_n_step_targets(rewards, DISCOUNT, bootstrap_value))
+    return targets
+
+
+def measure(function, args, repetitions):
+    start_time = time.time()
+    for _ in range(repetitions):
+        result = function(*args)
+    return 1000 * (time.time() - start_time) / repetitions, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--batch_sizes',
+                        help="(string) comma separated batch sizes to measure",
+                        default='32,64,128,256,512,1024',
+                        type=str)
+    parser.add_argument('-a', '--num_actions',
+                        help="(int) the number of actions",
+                        default=18,
+                        type=int)
+    parser.add_argument('--num_heads',
+                        help="(int) the number of heads of bootstrapped DQN",
+                        default=10,
+                        type=int)
+    parser.add_argument('-r', '--repetitions',
+                        help="(int) the number of times to calculate each target",
+                        default=100,
+                        type=int)
+    args = parser.parse_args()
+
+    print('{:>8} | {:>12} | {:>12} {:>12} {:>8}'.format('batch', 'targets', 'loop', 'batched', 'speedup'))
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        q_values = lambda: np.random.randn(batch_size, args.num_actions).astype(np.float32)
+        actions = np.random.randint(args.num_actions, size=batch_size)
+        rewards = np.random.randn(batch_size)
+        game_overs = np.random.rand(batch_size) < 0.05
+        selected_actions = np.random.randint(args.num_actions, size=batch_size)
+        masks = np.random.binomial(1, 0.5, (batch_size, args.num_heads))
+
+        cases = [
+            ('DQN', dqn_loop, dqn_batched, (q_values(), actions, rewards, game_overs, q_values())),
+            ('PAL', pal_loop, pal_batched, (q_values(), actions, rewards, game_overs, q_values(), q_values(),
+                                            selected_actions, np.random.randn(batch_size))),
+            ('Boot', bootstrapped_loop, bootstrapped_batched,
+             ([q_values() for _ in range(args.num_heads)], actions, rewards, game_overs,
+              [q_values() for _ in range(args.num_heads)], masks)),
+            ('N-Step', n_step_loop, n_step_batched, (q_values(), actions, rewards, 1.5)),
+        ]
+        for name, loop, batched, case_args in cases:
+            loop_time, loop_targets = measure(loop, case_args, args.repetitions)
+            batched_time, batched_targets = measure(batched, case_args, args.repetitions)
+            assert np.allclose(loop_targets, batched_targets, atol=1e-4), \
+                'The {} targets do not match the loop'.format(name)
+            print('{:>8} | {:>12} | {:>9.3f} ms {:>9.3f} ms {:>7.1f}x'.format(
+                batch_size, name, loop_time, batched_time, loop_time / batched_time))
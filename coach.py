@@ -298,6 +298,21 @@ if __name__ == "__main__":
         ]
         parameter_server = Popen(cmd)
 
+        # a DND that is shared by all the workers is served by a separate process
+        dnd_server = None
+        if json_to_preset(run_dict_to_json(run_dict)).agent.shared_dnd:
+            run_dict['agent.dnd_server_address'] = "localhost:{}".format(get_open_port())
+            run_dict['agent.dnd_server_authkey'] = os.urandom(16).hex()
+            cmd = [
+                "python3",
+                "./parallel_actor.py",
+                "--ps_hosts={}".format(ps_hosts),
+                "--worker_hosts={}".format(worker_hosts),
+                "--job_name=dnd",
+                "--load_json={}".format(run_dict_to_json(run_dict)),
+            ]
+            dnd_server = Popen(cmd)
+
         screen.log_title("*** Distributed Training ***")
         time.sleep(1)
 
@@ -331,3 +346,7 @@ if __name__ == "__main__":
         # wait for all workers
         [w.wait() for w in workers]
         evaluation_worker.kill()
+        if dnd_server is not None:
+            # the server removes its shared memory files when it is terminated
+            dnd_server.terminate()
+            dnd_server.wait()
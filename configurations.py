@@ -108,6 +108,17 @@ class AgentParameters(Parameters):
     n_step = -1
     num_episodes_in_experience_replay = 200
     num_transitions_in_experience_replay = None
+    deduplicate_frames_in_replay_buffer = False
+    replay_buffer_paging_dir = None  # used by MemoryMappedExperienceReplay. defaults to the experiment directory
+    store_episodes_in_arrays = False  # used by EpisodicExperienceReplay
+    prefetch_batches = 0  # the number of training batches to sample in a background thread. 0 disables prefetching
+    replay_buffer_compression = None  # None, 'zlib' or 'lz4'. used by ArrayExperienceReplay
+    replay_buffer_decompression_threads = 4
+    cache_target_values = False  # keep the target network outputs in ArrayExperienceReplay (not with prefetching)
+    calculate_returns_on_sample = False  # n-step returns (and DQN/DDQN targets) for ArrayExperienceReplay on sample
+    fused_training_step = False  # calculate the targets and train in a single session run (DQN, DDQN, MMC, PAL)
+    recurrent_sequence_length = 0  # train an LSTM middleware on sequences of this length. 0 disables it
+    recurrent_burn_in_steps = 0  # steps before each sequence which only warm up the LSTM state (DQN, DDQN, C51, QR, NEC)
     discount = 0.99
     policy_gradient_rescaler = 'A_VALUE'
     apply_gradients_every_x_episodes = 5
@@ -121,6 +132,9 @@ class AgentParameters(Parameters):
     targets_horizon = 'N-Step'
     replace_mse_with_huber_loss = False
     load_memory_from_file_path = None
+    demonstrations_files = None  # a glob pattern of the demonstrations files streamed by DemonstrationsDataset
+    demonstrations_shuffle_buffer_size = 100000
+    demonstrations_prefetch_batches = 4
     collect_new_data = True
     input_rescaler = 255.0
 
@@ -144,6 +158,23 @@ class AgentParameters(Parameters):
     new_value_shift_coefficient = 0.1
     number_of_knn = 50
     DND_key_error_threshold = 0.01
+    dnd_index_type = 'Annoy'  # the nearest neighbors index of the DND - 'Annoy', 'IVF' or 'Exact'
+    dnd_annoy_num_trees = 50
+    dnd_annoy_search_k = -1  # -1 searches num_trees x k nodes
+    dnd_ivf_num_lists = 256
+    dnd_ivf_num_probes = 8
+    dnd_query_threads = 0  # the number of threads that query the action DNDs in parallel (0 for no threads)
+    async_dnd_insertions = False  # insert the episodes to the DND from a background thread
+    dnd_max_pending_insertions = 4  # the number of episodes that can wait for the background DND insertions
+    shared_dnd = False  # with -n > 1, all the workers use a single DND that is served by a separate process
+    dnd_server_address = None  # the 'host:port' of the shared DND server. set when launching the workers.
+    dnd_server_authkey = None  # set when launching the workers
+
+    # Prioritized experience replay params
+    prioritized_replay_alpha = 0.6
+    prioritized_replay_beta = 0.4
+    prioritized_replay_beta_annealing_steps = 0  # 0 keeps beta constant
+    prioritized_replay_epsilon = 1e-6
 
     # Framework support
     neon_support = False
@@ -228,6 +259,7 @@ class GeneralParameters(Parameters):
     batch_size = 32
     save_model_sec = None
     save_model_dir = None
+    save_training_state = False  # save the memory, exploration and counters with each model, for resuming with -crd
     checkpoint_restore_dir = None
     learning_rate = 0.00025
     learning_rate_decay_rate = 0
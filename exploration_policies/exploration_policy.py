@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 
+import copy
 import numpy as np
 from utils import *
 from configurations import *
@@ -55,4 +56,21 @@ class ExplorationPolicy(object):
         self.phase = phase
 
     def get_control_param(self):
-        return 0
\ No newline at end of file
+        return 0
+
+    def get_state(self):
+        """
+        Get the state of the exploration policy (e.g. the current epsilon), for saving it with a checkpoint
+        :return: A dictionary of the policy attributes that are numbers or numpy arrays
+        """
+        return {name: copy.deepcopy(value) for name, value in self.__dict__.items()
+                if isinstance(value, (int, float, np.number, np.ndarray))}
+
+    def set_state(self, state):
+        """
+        Restore the state of the exploration policy that was returned by get_state()
+        :param state: A dictionary of the policy attributes
+        :return: None
+        """
+        self.__dict__.update(state)
+
@@ -14,6 +14,13 @@
 # limitations under the License.
 #
 
+from memories.array_experience_replay import *
+from memories.batch_prefetcher import *
+from memories.demonstrations import *
 from memories.differentiable_neural_dictionary import *
+from memories.dnd_index import *
+from memories.dnd_server import *
 from memories.episodic_experience_replay import *
 from memories.memory import *
+from memories.memory_mapped_experience_replay import *
+from memories.prioritized_experience_replay import *
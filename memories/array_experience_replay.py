@@ -0,0 +1,598 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from memories.memory import *
+from utils import LazyStack, Signal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+from logger import failed_imports
+import os
+import pickle
+import time
+import zlib
+try:
+    import lz4.frame
+except ImportError:
+    failed_imports.append("lz4")
+
+
+class ArrayExperienceReplay(Memory):
+    def __init__(self, tuning_parameters):
+        """
+        An experience replay which stores the transitions in preallocated numpy arrays (one array per transition
+        element) that are used as a ring buffer. The oldest transitions are overwritten once the buffer is full.
+        Sampling returns a TransitionBatch which is gathered from the arrays using fancy indexing.
+
+        When agent.deduplicate_frames_in_replay_buffer is set, each observation frame is stored only once, and the
+        stacked observations of the state and the next state are rebuilt from the frames while sampling.
+
+        When agent.calculate_returns_on_sample is set, the n-step returns are calculated while sampling instead of
+        when the episode ends, so a transition of the running episode can be sampled once n transitions follow it.
+        The batches also carry the state that each n-step return bootstraps from, for the n-step targets of the DQN
+        and DDQN agents.
+
+        When agent.cache_target_values is set, the memory keeps the target network outputs of the transitions
+        (see get_cached_targets and cache_targets), so that they are predicted again only after the target network
+        changes.
+
+        When agent.replay_buffer_compression is set ('zlib' or 'lz4'), each observation is compressed on store and
+        decompressed on sample by a pool of agent.replay_buffer_decompression_threads threads. Combined with the frames
+        deduplication, each frame is compressed separately. The decompression time of each sampled batch and the
+        compression ratio of the stored observations are exposed through the memory signals.
+
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        Memory.__init__(self, tuning_parameters)
+        self.tp = tuning_parameters
+        self.capacity = tuning_parameters.agent.num_transitions_in_experience_replay
+        assert self.capacity, 'ArrayExperienceReplay requires setting agent.num_transitions_in_experience_replay'
+        self.discount = tuning_parameters.agent.discount
+        self.return_is_bootstrapped = tuning_parameters.agent.bootstrap_total_return_from_old_policy
+        self.n_step = tuning_parameters.agent.n_step
+        self.returns_on_sample = tuning_parameters.agent.calculate_returns_on_sample
+        assert not self.returns_on_sample or self.n_step > 0, \
+            'Calculating the returns on sample requires setting agent.n_step'
+        self.num_predicted_steps_ahead = tuning_parameters.agent.num_predicted_steps_ahead
+
+        # the arrays are allocated on the first store, since only then the shapes and types are known
+        self.states = {}
+        self.next_states = {}
+        self.info = {}
+        self.actions = None
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.game_overs = np.zeros(self.capacity, dtype=np.bool_)
+        self.total_returns = np.zeros(self.capacity, dtype=np.float32)
+
+        # frames deduplication - the frame at slot i is the newest frame of the state of transition i. a transition
+        # which is not followed by its next state (e.g. the last transition of an episode) keeps its newest next state
+        # frame at slot capacity + i.
+        self.deduplicate_frames = tuning_parameters.agent.deduplicate_frames_in_replay_buffer
+        self.observation_stack_size = tuning_parameters.env.observation_stack_size
+        self.frames = None
+        self.frame_positions = np.zeros(self.capacity, dtype=np.int32)  # the index of the frame in its frames run
+        self.has_separate_next_frame = np.zeros(self.capacity, dtype=np.bool_)
+
+        # observations compression - the compressed observations are stored as bytes objects
+        self.compression = tuning_parameters.agent.replay_buffer_compression
+        assert self.compression in [None, 'zlib', 'lz4'], \
+            'The replay buffer compression should be one of None, \'zlib\' or \'lz4\''
+        assert self.compression != 'lz4' or 'lz4' not in failed_imports, \
+            'The lz4 replay buffer compression requires the lz4 package'
+        self.decompression_threads = tuning_parameters.agent.replay_buffer_decompression_threads
+        self._decompression_pool = None
+        self.compressed_shape = None
+        self.compressed_dtype = None
+        # target values cache - the outputs of the target network for the transitions, tagged with the version of
+        # the target network that predicted them
+        self.cache_target_values = tuning_parameters.agent.cache_target_values
+        self.cached_targets = {}
+        self.cached_targets_version = {}
+        if self.cache_target_values:
+            self.target_cache_hit_rate = Signal('Target Cache Hit Rate')
+            self.signals.append(self.target_cache_hit_rate)
+
+        if self.compression is not None:
+            self.decompression_time = Signal('Decompression Time')
+            self.compression_ratio = Signal('Compression Ratio')
+            self.signals += [self.decompression_time, self.compression_ratio]
+
+        self.clean()
+
+    def _allocate_column(self, name, shape, dtype, length=None):
+        """
+        Allocate an array for a single transition element
+        :param name: the name of the transition element
+        :param shape: the shape of a single element
+        :param dtype: the type of the element
+        :param length: the number of elements to allocate. defaults to the capacity of the buffer
+        :return: the allocated array
+        """
+        length = self.capacity if length is None else length
+        return np.zeros((length,) + tuple(shape), dtype=dtype)
+
+    def _store_in_columns(self, columns, prefix, values, slot):
+        for key, value in values.items():
+            if self.deduplicate_frames and key == 'observation' and prefix != 'info/':
+                continue
+            if self.compression is not None and key == 'observation' and prefix != 'info/':
+                if key not in columns:
+                    columns[key] = self._allocate_column(prefix + key, (), object)
+                columns[key][slot] = self._compress(value)
+                continue
+            value = np.asarray(value)
+            if key not in columns:
+                dtype = value.dtype if value.dtype.kind in 'biuf' else object
+                columns[key] = self._allocate_column(prefix + key, value.shape, dtype)
+            columns[key][slot] = value
+
+    def _compress(self, observation):
+        observation = np.ascontiguousarray(observation)
+        if self.compressed_shape is None:
+            self.compressed_shape = observation.shape
+            self.compressed_dtype = observation.dtype
+        data = observation.tobytes()
+        if self.compression == 'zlib':
+            compressed_data = zlib.compress(data, 1)
+        else:
+            compressed_data = lz4.frame.compress(data)
+        self.compression_ratio.add_sample(len(data) / float(len(compressed_data)))
+        return compressed_data
+
+    def _decompress(self, compressed_observations):
+        """
+        Decompress a batch of observations using the decompression threads pool
+        :param compressed_observations: an array of compressed observations
+        :return: an array of the decompressed observations
+        """
+        start_time = time.time()
+        decompress = zlib.decompress if self.compression == 'zlib' else lz4.frame.decompress
+        observations = np.empty((len(compressed_observations),) + self.compressed_shape, dtype=self.compressed_dtype)
+
+        def decompress_chunk(chunk):
+            for i in chunk:
+                observations[i] = np.frombuffer(decompress(compressed_observations[i]), dtype=self.compressed_dtype)\
+                    .reshape(self.compressed_shape)
+
+        if self._decompression_pool is None:
+            self._decompression_pool = ThreadPoolExecutor(self.decompression_threads)
+        chunks = np.array_split(np.arange(len(compressed_observations)), self.decompression_threads)
+        list(self._decompression_pool.map(decompress_chunk, chunks))
+        self.decompression_time.add_sample(time.time() - start_time)
+        return observations
+
+    # attributes that belong to the running process and are not saved with the memory
+    transient_attributes = ['_decompression_pool']
+
+    @staticmethod
+    def _is_saved_as_array(value):
+        return isinstance(value, np.ndarray) and value.dtype != object and value.ndim > 0
+
+    @staticmethod
+    def _column_name(name, key):
+        return {'states': 'state/', 'next_states': 'next_state/', 'info': 'info/'}.get(name, name + '/') + key
+
+    def save(self, directory):
+        """
+        Save the content of the memory into the given directory. Each array is written to a separate file in the numpy
+        binary format, so that loading it is a sequential read into the preallocated columns. The rest of the memory
+        attributes are pickled.
+        :param directory: the directory to save the memory into
+        :return: None
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        attributes = {}
+        arrays = {}
+        for name, value in self._saved_attributes().items():
+            if name in self.transient_attributes:
+                continue
+            if self._is_saved_as_array(value):
+                np.save(os.path.join(directory, name + '.npy'), value)
+                arrays[name] = None
+            elif isinstance(value, dict) and len(value) > 0 and all(self._is_saved_as_array(v) for v in value.values()):
+                for key, column in value.items():
+                    np.save(os.path.join(directory, '{}.{}.npy'.format(name, key)), column)
+                arrays[name] = list(value.keys())
+            else:
+                attributes[name] = value
+        attributes['saved_arrays'] = arrays
+        with open(os.path.join(directory, 'memory.p'), 'wb') as f:
+            pickle.dump(attributes, f, pickle.HIGHEST_PROTOCOL)
+
+    def _load_column(self, path, column_name):
+        saved_column = np.load(path, mmap_mode='r')
+        column = self._allocate_column(column_name, saved_column.shape[1:], saved_column.dtype, len(saved_column))
+        column[:] = saved_column
+        return column
+
+    def load(self, directory):
+        """
+        Load the content of a memory that was saved using save()
+        :param directory: the directory that the memory was saved into
+        :return: None
+        """
+        with open(os.path.join(directory, 'memory.p'), 'rb') as f:
+            attributes = pickle.load(f)
+        arrays = attributes.pop('saved_arrays')
+        self.__dict__.update(attributes)
+        for name, keys in arrays.items():
+            if keys is None:
+                column = self._load_column(os.path.join(directory, name + '.npy'), name)
+            else:
+                column = {key: self._load_column(os.path.join(directory, '{}.{}.npy'.format(name, key)),
+                                                 self._column_name(name, key))
+                          for key in keys}
+            setattr(self, name, column)
+
+    def __getstate__(self):
+        # the threads pool can't be pickled, and is recreated when needed
+        state = self.__dict__.copy()
+        state['_decompression_pool'] = None
+        return state
+
+    def length(self):
+        """ Get the number of episodes in the ER (even if they are not complete) """
+        return len(self._complete_episodes) + int(self._open_episode_length > 0)
+
+    def num_complete_episodes(self):
+        """ Get the number of complete episodes in ER """
+        return len(self._complete_episodes)
+
+    def num_transitions(self):
+        return self._size
+
+    def num_transitions_in_complete_episodes(self):
+        return self._size - self._open_episode_length
+
+    def _tail(self):
+        return (self._head - self._size) % self.capacity
+
+    def _num_unsampleable_oldest_transitions(self):
+        """
+        With the frames deduplication, the frames that precede the oldest transition in the buffer were already
+        overwritten. The oldest transitions whose stacked observations reach back to these frames (at most
+        observation_stack_size - 1 transitions, which continue the frames run of an evicted transition) cannot be
+        rebuilt, so they are excluded from sampling. Such transitions are always the first ones after the tail.
+        :return: the number of transitions after the tail that cannot be sampled
+        """
+        if not self.deduplicate_frames or self._size == 0:
+            return 0
+        offsets = np.arange(min(self.observation_stack_size - 1, self._size))
+        positions = self.frame_positions[(self._tail() + offsets) % self.capacity]
+        return int(np.sum(np.minimum(positions, self.observation_stack_size - 1) > offsets))
+
+    def _evict_oldest_transition(self):
+        if len(self._complete_episodes) > 0:
+            start, length = self._complete_episodes[0]
+            if length == 1:
+                self._complete_episodes.popleft()
+            else:
+                self._complete_episodes[0] = ((start + 1) % self.capacity, length - 1)
+        else:
+            # the open episode is longer than the entire buffer
+            self._episode_start = (self._episode_start + 1) % self.capacity
+            self._open_episode_length -= 1
+        self._size -= 1
+
+    def store(self, transition):
+        if self._size == self.capacity:
+            self._evict_oldest_transition()
+
+        slot = self._head
+        if self.deduplicate_frames:
+            self._store_frames(transition, slot)
+        self._store_in_columns(self.states, 'state/', transition.state, slot)
+        self._store_in_columns(self.next_states, 'next_state/', transition.next_state, slot)
+        self._store_in_columns(self.info, 'info/', transition.info, slot)
+        action = np.asarray(transition.action)
+        if self.actions is None:
+            self.actions = self._allocate_column('action', action.shape, action.dtype)
+        self.actions[slot] = action
+        self.rewards[slot] = transition.reward
+        self.game_overs[slot] = transition.game_over
+        for versions in self.cached_targets_version.values():
+            versions[slot] = -1
+
+        self._head = (self._head + 1) % self.capacity
+        self._size += 1
+        self._open_episode_length += 1
+
+        if transition.game_over:
+            self._close_episode()
+
+    @staticmethod
+    def _newest_frame(observation):
+        if isinstance(observation, LazyStack):
+            return observation.history[-1]
+        return np.asarray(observation)[..., -1]
+
+    def _store_frames(self, transition, slot):
+        frame = self._newest_frame(transition.state['observation'])
+        next_frame = self._newest_frame(transition.next_state['observation'])
+        if self.frames is None:
+            frame_array = np.asarray(frame)
+            if self.compression is not None:
+                self.frames = self._allocate_column('frames', (), object, 2 * self.capacity)
+            else:
+                self.frames = self._allocate_column('frames', frame_array.shape, frame_array.dtype, 2 * self.capacity)
+
+        # check if this state continues the frames run of the previous transition. lazy stacks share the frame
+        # objects between consecutive states, so for them the frames are compared by identity.
+        is_lazy_stack = isinstance(transition.state['observation'], LazyStack)
+        if self._last_next_frame is not None and \
+                (frame is self._last_next_frame or
+                 (not is_lazy_stack and np.array_equal(frame, self._last_next_frame))):
+            self.frame_positions[slot] = self.frame_positions[self._last_slot] + 1
+        else:
+            if self._last_next_frame is not None:
+                # the previous transition was not followed by its next state so its frame must be kept separately
+                self.frames[self.capacity + self._last_slot] = self._encode_frame(self._last_next_frame)
+                self.has_separate_next_frame[self._last_slot] = True
+            self.frame_positions[slot] = 0
+
+        self.frames[slot] = self._encode_frame(frame)
+        self.has_separate_next_frame[slot] = transition.game_over
+        if transition.game_over:
+            self.frames[self.capacity + slot] = self._encode_frame(next_frame)
+            self._last_next_frame = None
+        else:
+            self._last_next_frame = next_frame
+        self._last_slot = slot
+
+    def _encode_frame(self, frame):
+        if self.compression is not None:
+            return self._compress(frame)
+        return frame
+
+    def _gather_frames(self, frame_indices):
+        if self.compression is None:
+            return self.frames[frame_indices]
+        # each frame appears in several stacked observations, so it is decompressed only once
+        unique_frame_indices, inverse = np.unique(frame_indices, return_inverse=True)
+        frames = self._decompress(self.frames[unique_frame_indices])
+        return frames[inverse].reshape(frame_indices.shape + frames.shape[1:])
+
+    def _gather_stacked_frames(self, indices, next_state=False):
+        """
+        Rebuild the stacked observations of the given transitions from the stored frames. Frames from before the
+        beginning of the frames run are padded by repeating the first frame, the same way the agent pads the
+        observation stack when an episode starts. Frames from before the oldest transition in the buffer were
+        overwritten and are padded the same way, which is why these transitions are not sampled (see
+        _num_unsampleable_oldest_transitions).
+        :param indices: an array of indices in the buffer
+        :param next_state: rebuild the next state observations instead of the state observations
+        :return: an array of stacked observations where the stacking axis is the last axis
+        """
+        indices = np.asarray(indices)
+        positions = np.minimum(self.frame_positions[indices], (indices - self._tail()) % self.capacity)
+        newest = indices
+        if next_state:
+            positions = positions + 1
+            newest = indices + 1
+        offsets = np.minimum(np.arange(self.observation_stack_size - 1, -1, -1)[np.newaxis, :],
+                             positions[:, np.newaxis])
+        frame_indices = (newest[:, np.newaxis] - offsets) % self.capacity
+        if next_state:
+            frame_indices[:, -1] = np.where(self.has_separate_next_frame[indices],
+                                            self.capacity + indices, frame_indices[:, -1])
+        return np.moveaxis(self._gather_frames(frame_indices), 1, -1)
+
+    def _close_episode(self):
+        slots = self._episode_slots(self._episode_start, self._open_episode_length)
+        bootstraps = None
+        if self.return_is_bootstrapped:
+            bootstraps = self.info['max_action_value'][slots].reshape(len(slots))
+        self.total_returns[slots] = calculate_discounted_returns(self.rewards[slots], self.discount, bootstraps,
+                                                                 self.n_step)
+        if 'measurements' in self.states:
+            future_measurements = calculate_future_measurements(self.states['measurements'][slots],
+                                                                self.next_states['measurements'][slots],
+                                                                self.num_predicted_steps_ahead)
+            self._store_episode_column(self.info, 'info/', 'future_measurements', slots, future_measurements)
+            self._store_episode_column(self.info, 'info/', 'total_episode_return', slots,
+                                       np.full(len(slots), np.sum(self.rewards[slots])))
+
+        self._complete_episodes.append((self._episode_start, self._open_episode_length))
+        self._episode_start = self._head
+        self._open_episode_length = 0
+
+    def _store_episode_column(self, columns, prefix, key, slots, values):
+        if key not in columns:
+            columns[key] = self._allocate_column(prefix + key, values.shape[1:], values.dtype)
+        columns[key][slots] = values
+
+    def _episode_slots(self, start, length):
+        return (start + np.arange(length)) % self.capacity
+
+    def num_transitions_available_for_sampling(self):
+        """ Get the number of transitions that can be sampled - the transitions of complete episodes, and when the
+        returns are calculated on sample, also the transitions of the open episode that n transitions follow. The
+        oldest transitions whose stacked observations cannot be rebuilt are not counted. """
+        num_transitions = self.num_transitions_in_complete_episodes()
+        if self.returns_on_sample:
+            num_transitions += max(self._open_episode_length - self.n_step, 0)
+        return max(num_transitions - self._num_unsampleable_oldest_transitions(), 0)
+
+    def sample(self, size):
+        num_transitions = self.num_transitions_available_for_sampling()
+        assert num_transitions > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested transitions: {}.'\
+                .format(num_transitions, size)
+
+        # the transitions of complete episodes are the oldest transitions in the buffer, and the open episode follows
+        offsets = self._num_unsampleable_oldest_transitions() + np.random.randint(num_transitions, size=size)
+        batch = self.get_batch((self._tail() + offsets) % self.capacity)
+        if self.returns_on_sample:
+            self.calculate_returns_on_sample(batch)
+        return batch
+
+    def calculate_returns_on_sample(self, batch):
+        """
+        Calculate the n-step returns of the sampled transitions, vectorized over the batch. The n-step window of each
+        transition ends either n steps later or at the end of its episode. The batch gets the returns, the buffer
+        index of the last transition in each window, the next state of that transition (the bootstrap state) and the
+        discount of the bootstrap value, which is 0 for windows that end with the episode.
+        :param batch: a TransitionBatch that was gathered from the buffer
+        :return: None
+        """
+        windows = (batch.indices[:, np.newaxis] + np.arange(self.n_step)[np.newaxis, :]) % self.capacity
+        game_overs = self.game_overs[windows]
+        # the steps up to and including the first game over of each window
+        in_episode = (np.cumsum(game_overs, axis=1) - game_overs) == 0
+        discounts = self.discount ** np.arange(self.n_step)
+        returns = np.sum(in_episode * discounts * self.rewards[windows], axis=1)
+        episode_ended = np.any(game_overs & in_episode, axis=1)
+        bootstrap_discounts = np.where(episode_ended, 0, self.discount ** self.n_step)
+
+        if self.return_is_bootstrapped:
+            # the old policy value of the state that follows the window is stored with the transition that starts there
+            bootstrap_values = self.info['max_action_value'][(batch.indices + self.n_step) % self.capacity]
+            returns += bootstrap_discounts * bootstrap_values.reshape(len(batch))
+
+        batch.total_returns = returns.astype(np.float32)
+        batch.bootstrap_indices = (batch.indices + np.sum(in_episode, axis=1) - 1) % self.capacity
+        batch.bootstrap_next_states = self._gather_next_states(batch.bootstrap_indices)
+        batch.bootstrap_discounts = bootstrap_discounts.astype(np.float32)
+
+    def sample_sequences(self, num_sequences, sequence_length, burn_in=0):
+        """
+        Sample contiguous sequences of transitions for training a recurrent network. Each sequence is contained in a
+        single complete episode and starts with burn_in transitions that only warm up the recurrent state.
+        :param num_sequences: The number of sequences to sample
+        :param sequence_length: The number of trained transitions in each sequence
+        :param burn_in: The number of transitions that precede the trained transitions of each sequence
+        :return: a TransitionBatch of num_sequences * (burn_in + sequence_length) transitions, sequence after sequence
+        """
+        total_length = burn_in + sequence_length
+        episodes = np.array(self._complete_episodes, dtype=np.int64).reshape(-1, 2)
+        if len(episodes) > 0:
+            # the oldest complete episode starts at the tail, so the unsampleable transitions are at its beginning
+            num_unsampleable = self._num_unsampleable_oldest_transitions()
+            episodes[0] += [num_unsampleable, -num_unsampleable]
+        episodes_idx, offsets = sample_sequence_starts(episodes[:, 1], num_sequences, total_length)
+        starts = episodes[episodes_idx, 0] + offsets
+        indices = (starts[:, np.newaxis] + np.arange(total_length)[np.newaxis, :]) % self.capacity
+        batch = self.get_batch(indices.reshape(-1))
+        batch.set_sequences(total_length, burn_in)
+        return batch
+
+    def get_batch(self, indices):
+        """
+        Gather the transitions in the given buffer indices into a batch
+        :param indices: an array of indices in the buffer
+        :return: a TransitionBatch
+        """
+        states = {k: v[indices] for k, v in self.states.items()}
+        if self.deduplicate_frames:
+            states['observation'] = self._gather_stacked_frames(indices)
+        elif self.compression is not None:
+            states['observation'] = self._decompress(states['observation'])
+        return TransitionBatch(
+            states=states,
+            next_states=self._gather_next_states(indices),
+            actions=self.actions[indices],
+            rewards=self.rewards[indices],
+            game_overs=self.game_overs[indices],
+            total_returns=self.total_returns[indices],
+            info={k: v[indices] for k, v in self.info.items()},
+            indices=indices
+        )
+
+    def _gather_next_states(self, indices):
+        next_states = {k: v[indices] for k, v in self.next_states.items()}
+        if self.deduplicate_frames:
+            next_states['observation'] = self._gather_stacked_frames(indices, next_state=True)
+        elif self.compression is not None:
+            next_states['observation'] = self._decompress(next_states['observation'])
+        return next_states
+
+    def get_episode(self, episode_index):
+        if self.length() == 0 and episode_index != -1:
+            return None
+        episodes = list(self._complete_episodes) + [(self._episode_start, self._open_episode_length)]
+        start, length = episodes[episode_index]
+        episode = Episode()
+        batch = self.get_batch(self._episode_slots(start, length))
+        for i in range(length):
+            episode.insert(batch[i])
+        return episode
+
+    # for API compatibility
+    def get(self, index):
+        return self.get_episode(index)
+
+    def get_last_complete_episode(self) -> Union[None, Episode]:
+        """
+        Returns the last complete episode in the memory or None if there are no complete episodes
+        :return: None or the last complete episode
+        """
+        if self.num_complete_episodes() > 0:
+            return self.get_episode(self.num_complete_episodes() - 1)
+        else:
+            return None
+
+    def get_cached_targets(self, key, indices, version):
+        """
+        Get the cached target values of the given transitions
+        :param key: the name of the cached values (e.g. the next state values)
+        :param indices: the indices of the transitions in the buffer
+        :param version: the version of the target network that the values should be predicted by
+        :return: the cached values (or None if nothing was cached yet) and a mask of the transitions that are missing
+                 from the cache or were cached by another version of the target network
+        """
+        if key not in self.cached_targets:
+            is_missing = np.ones(len(indices), dtype=np.bool_)
+            values = None
+        else:
+            is_missing = self.cached_targets_version[key][indices] != version
+            values = self.cached_targets[key][indices]
+        self.target_cache_hit_rate.add_sample(1 - np.mean(is_missing))
+        return values, is_missing
+
+    def cache_targets(self, key, indices, values, version):
+        """
+        Store the target values of the given transitions in the cache
+        :param key: the name of the cached values (e.g. the next state values)
+        :param indices: the indices of the transitions in the buffer
+        :param values: the target values of the transitions
+        :param version: the version of the target network that predicted the values
+        :return: None
+        """
+        values = np.asarray(values)
+        if key not in self.cached_targets:
+            self.cached_targets[key] = self._allocate_column('cached_targets/' + key, values.shape[1:], values.dtype)
+            self.cached_targets_version[key] = np.full(self.capacity, -1, dtype=np.int64)
+        self.cached_targets[key][indices] = values
+        self.cached_targets_version[key][indices] = version
+
+    def update_last_transition_info(self, info):
+        if self._size == 0:
+            return
+        self._store_in_columns(self.info, 'info/', info, (self._head - 1) % self.capacity)
+
+    def clean(self):
+        self._head = 0
+        self._size = 0
+        self._episode_start = 0
+        self._open_episode_length = 0
+        self._complete_episodes = deque()
+        for versions in self.cached_targets_version.values():
+            versions[:] = -1
+        self._last_next_frame = None
+        self._last_slot = 0
@@ -0,0 +1,89 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import queue
+import threading
+from memories.memory import *
+
+
+class BatchPrefetcher(object):
+    def __init__(self, memory, memory_lock, batch_size, num_batches, prepare_batch=None):
+        """
+        Samples training batches from a memory in a background thread, and keeps up to num_batches of them ready in
+        a queue. Batches that are sampled as lists of transitions are gathered into a TransitionBatch by the thread,
+        so that stacking the observations is also done in the background. The session run of the training step and
+        most of the numpy gathering release the GIL, so the next batch is prepared while the current one is trained on.
+
+        The feed arrays themselves are built by the agent's networks, so they cannot be prepared here. Instead, the
+        thread runs prepare_batch on each batch and stores its result in the batch extracted field. The agent passes
+        its extract_batch, so that the training thread gets the state dictionaries and arrays ready to be fed.
+
+        :param memory: The memory to sample from
+        :param memory_lock: A lock that is held by any other thread that changes the memory
+        :param batch_size: The number of transitions in each batch
+        :param num_batches: The maximal number of batches that are kept ready
+        :param prepare_batch: A function that is called on each TransitionBatch in the thread (optional)
+        """
+        self.memory = memory
+        self.memory_lock = memory_lock
+        self.batch_size = batch_size
+        self.prepare_batch = prepare_batch
+        self.batches = queue.Queue(maxsize=num_batches)
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                with self.memory_lock:
+                    batch = self.memory.sample(self.batch_size)
+                if not isinstance(batch, TransitionBatch):
+                    batch = TransitionBatch.from_transitions(batch)
+                if self.prepare_batch is not None:
+                    batch.extracted = self.prepare_batch(batch)
+
+                while not self.stop_event.is_set():
+                    try:
+                        self.batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as e:
+            self.error = e
+
+    def get(self):
+        """
+        Get the next ready batch, waiting for it if necessary
+        :return: a TransitionBatch
+        """
+        while True:
+            try:
+                return self.batches.get(timeout=0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+
+    def stop(self):
+        """
+        Stop the background thread and wait for it to exit. The batches that are already in the queue are dropped.
+        This should not be called while holding the memory lock, since the thread may be waiting for it.
+        :return: None
+        """
+        self.stop_event.set()
+        self.thread.join()
@@ -0,0 +1,293 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import glob
+import io
+import os
+import queue
+import struct
+import threading
+from memories.memory import *
+from utils import LazyStack
+
+# A demonstrations file starts with this header, followed by one record for each episode. Each record is the length
+# of the record data as an unsigned 64 bit integer, followed by the data - a compressed npz archive of the episode
+# columns. A record that was not written completely (e.g. the recording crashed) is ignored by the reader.
+DEMONSTRATIONS_FILE_HEADER = b'COACH_DEMONSTRATIONS_V1\n'
+RECORD_LENGTH_FORMAT = '<Q'
+
+
+def is_demonstrations_file(path):
+    """
+    Check if the given file is a demonstrations file (and not a pickled memory)
+    :param path: the path of the file
+    :return: True if the file starts with the demonstrations file header
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(DEMONSTRATIONS_FILE_HEADER)) == DEMONSTRATIONS_FILE_HEADER
+
+
+def _observation_frames(observation):
+    if isinstance(observation, LazyStack):
+        return [np.asarray(frame) for frame in observation.history]
+    observation = np.asarray(observation)
+    return [observation[..., i] for i in range(observation.shape[-1])]
+
+
+def _typed_column(values):
+    column = np.asarray(values)
+    if column.dtype.kind not in 'biuf':
+        return None
+    return column
+
+
+def _complete_records_end(f):
+    record_length_size = struct.calcsize(RECORD_LENGTH_FORMAT)
+    file_size = os.fstat(f.fileno()).st_size
+    records_end = len(DEMONSTRATIONS_FILE_HEADER)
+    f.seek(records_end)
+    while True:
+        record_length = f.read(record_length_size)
+        if len(record_length) < record_length_size:
+            return records_end
+        record_end = records_end + record_length_size + struct.unpack(RECORD_LENGTH_FORMAT, record_length)[0]
+        if record_end > file_size:
+            return records_end
+        records_end = record_end
+        f.seek(records_end)
+
+
+class DemonstrationsWriter(object):
+    def __init__(self, path):
+        """
+        Appends complete episodes to a demonstrations file as they finish, so that a recording is never held in
+        memory as a whole, and a crash loses at most the running episode.
+
+        The observations of an episode are stored as its frames - the stacked frames of the first state followed by
+        the newest frame of each next state - in their original type (uint8 for images). The actions, rewards, game
+        overs, measurements and numeric info fields are stored as typed columns.
+
+        :param path: the path of the demonstrations file. an existing file is appended to.
+        """
+        self.path = path
+        is_new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new_file:
+            assert is_demonstrations_file(path), '{} is not a demonstrations file'.format(path)
+            # drop a record that was not written completely, so that the new records follow the complete ones
+            with open(path, 'r+b') as f:
+                f.truncate(_complete_records_end(f))
+        self.file = open(path, 'ab')
+        if is_new_file:
+            self.file.write(DEMONSTRATIONS_FILE_HEADER)
+            self.file.flush()
+        self.num_episodes = 0
+
+    def write_episode(self, episode):
+        """
+        Append an episode to the file, and flush it to the disk
+        :param episode: a complete episode
+        :return: None
+        """
+        transitions = episode.transitions
+        if len(transitions) == 0:
+            return
+
+        first_state_frames = _observation_frames(transitions[0].state['observation'])
+        frames = first_state_frames + [_observation_frames(t.next_state['observation'])[-1] for t in transitions]
+        columns = {
+            'frames': np.stack(frames),
+            'stack_size': np.array(len(first_state_frames)),
+            'action': np.array([t.action for t in transitions]),
+            'reward': np.array([t.reward for t in transitions], dtype=np.float32),
+            'game_over': np.array([t.game_over for t in transitions], dtype=np.bool_),
+        }
+        for key in transitions[0].state.keys():
+            if key != 'observation':
+                columns['state/' + key] = np.array([t.state[key] for t in transitions])
+                columns['next_state/' + key] = np.array([t.next_state[key] for t in transitions])
+        for key in transitions[0].info.keys():
+            column = _typed_column([t.info.get(key, 0) for t in transitions])
+            if column is not None:
+                columns['info/' + key] = column
+
+        record = io.BytesIO()
+        np.savez_compressed(record, **columns)
+        record = record.getvalue()
+        self.file.write(struct.pack(RECORD_LENGTH_FORMAT, len(record)))
+        self.file.write(record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.num_episodes += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_demonstrations(path):
+    """
+    Read the episodes of a demonstrations file one at a time
+    :param path: the path of the demonstrations file
+    :return: a generator of episodes, each given as a list of transitions
+    """
+    record_length_size = struct.calcsize(RECORD_LENGTH_FORMAT)
+    with open(path, 'rb') as f:
+        assert f.read(len(DEMONSTRATIONS_FILE_HEADER)) == DEMONSTRATIONS_FILE_HEADER, \
+            '{} is not a demonstrations file'.format(path)
+        while True:
+            record_length = f.read(record_length_size)
+            if len(record_length) < record_length_size:
+                return
+            record_length = struct.unpack(RECORD_LENGTH_FORMAT, record_length)[0]
+            record = f.read(record_length)
+            if len(record) < record_length:
+                return
+
+            columns = np.load(io.BytesIO(record))
+            frames = list(columns['frames'])
+            stack_size = int(columns['stack_size'])
+            state_keys = [key[len('state/'):] for key in columns.keys() if key.startswith('state/')]
+            info_keys = [key[len('info/'):] for key in columns.keys() if key.startswith('info/')]
+            actions = columns['action']
+            rewards = columns['reward']
+            game_overs = columns['game_over']
+            state_columns = {key: columns['state/' + key] for key in state_keys}
+            next_state_columns = {key: columns['next_state/' + key] for key in state_keys}
+            info_columns = {key: columns['info/' + key] for key in info_keys}
+
+            episode = []
+            for i in range(len(rewards)):
+                state = {'observation': LazyStack(frames[i:i + stack_size], -1)}
+                next_state = {'observation': LazyStack(frames[i + 1:i + 1 + stack_size], -1)}
+                for key in state_keys:
+                    state[key] = state_columns[key][i]
+                    next_state[key] = next_state_columns[key][i]
+                transition = Transition(state, actions[i], rewards[i], next_state, game_overs[i])
+                for key in info_keys:
+                    transition.info[key] = info_columns[key][i]
+                episode.append(transition)
+            yield episode
+
+
+class DemonstrationsDataset(Memory):
+    def __init__(self, tuning_parameters):
+        """
+        A read only memory for imitation agents that streams the episodes of demonstrations files from the disk, so
+        that the demonstrations do not need to fit in RAM. The files that match agent.demonstrations_files are read
+        episode by episode in a random order, and their transitions pass through a shuffle buffer of
+        agent.demonstrations_shuffle_buffer_size transitions. Each epoch goes over every transition exactly once.
+        The batches are gathered by a background thread, which keeps agent.demonstrations_prefetch_batches of them
+        ready.
+
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        Memory.__init__(self, tuning_parameters)
+        self.files = sorted(glob.glob(tuning_parameters.agent.demonstrations_files or ''))
+        assert len(self.files) > 0, \
+            'No demonstrations files match {}'.format(tuning_parameters.agent.demonstrations_files)
+        self.shuffle_buffer_size = tuning_parameters.agent.demonstrations_shuffle_buffer_size
+        self.num_prefetched_batches = tuning_parameters.agent.demonstrations_prefetch_batches
+        self.epoch = 0
+        self.num_transitions_in_shuffle_buffer = 0
+        self.batch_size = None
+        self.batches = None
+        self.thread = None
+        self.error = None
+        self.stop_event = threading.Event()
+        self.epoch_signal = Signal('Demonstrations Epoch')
+        self.signals.append(self.epoch_signal)
+
+    def _transitions(self):
+        # an endless stream of transitions. every epoch ends by emptying the shuffle buffer, so that each transition
+        # is given once in every epoch
+        shuffle_buffer = []
+        while True:
+            num_transitions_in_epoch = 0
+            for path in np.random.permutation(self.files):
+                for episode in read_demonstrations(path):
+                    for transition in episode:
+                        num_transitions_in_epoch += 1
+                        if len(shuffle_buffer) < self.shuffle_buffer_size:
+                            shuffle_buffer.append(transition)
+                            continue
+                        transition_idx = np.random.randint(len(shuffle_buffer))
+                        yield shuffle_buffer[transition_idx]
+                        shuffle_buffer[transition_idx] = transition
+                    self.num_transitions_in_shuffle_buffer = len(shuffle_buffer)
+            assert num_transitions_in_epoch > 0, 'The demonstrations files do not contain any transitions'
+
+            for transition_idx in np.random.permutation(len(shuffle_buffer)):
+                yield shuffle_buffer[transition_idx]
+            shuffle_buffer = []
+            self.epoch += 1
+
+    def _run(self):
+        try:
+            transitions = self._transitions()
+            while not self.stop_event.is_set():
+                batch = TransitionBatch.from_transitions([next(transitions) for _ in range(self.batch_size)])
+                while not self.stop_event.is_set():
+                    try:
+                        self.batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as e:
+            self.error = e
+
+    def sample(self, size):
+        """
+        Get the next batch of the stream, waiting for it if necessary
+        :param size: the batch size. the batches are gathered in advance, so the size cannot change between calls.
+        :return: a TransitionBatch
+        """
+        if self.thread is None:
+            self.batch_size = size
+            self.batches = queue.Queue(maxsize=self.num_prefetched_batches)
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        assert size == self.batch_size, 'The batch size of a DemonstrationsDataset cannot change'
+
+        self.epoch_signal.add_sample(self.epoch)
+        while True:
+            try:
+                return self.batches.get(timeout=0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+
+    def store(self, transition):
+        raise ValueError('A DemonstrationsDataset is read only. Set agent.collect_new_data to False.')
+
+    def length(self):
+        return 0
+
+    def num_transitions(self):
+        return self.num_transitions_in_shuffle_buffer
+
+    def get_last_complete_episode(self):
+        return None
+
+    def _saved_attributes(self):
+        # the stream restarts from a new epoch when loading
+        return {'epoch': self.epoch}
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+
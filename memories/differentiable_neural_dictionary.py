@@ -15,69 +15,203 @@
 #
 
 import numpy as np
-from annoy import AnnoyIndex
-import os, pickle
-
-
-class AnnoyDictionary(object):
-    def __init__(self, dict_size, key_width, new_value_shift_coefficient=0.1, batch_size=100, key_error_threshold=0.01):
+import os, pickle, shutil, threading, queue, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from memories.dnd_index import *
+
+# the available nearest neighbors indices of the dictionary
+DND_INDEX_TYPES = {
+    'Annoy': AnnoyDNDIndex,
+    'IVF': IVFDNDIndex,
+    'Exact': ExactDNDIndex,
+}
+
+
+class LRUQueue(object):
+    def __init__(self, size, compaction_factor=2):
+        """
+        Orders the slots of a dictionary by their last use, so that the least recently used slots can be evicted
+        without going over all the slots. Since the timestamps only grow, using a batch of slots appends them to the
+        end of a queue, and their previous entries in the queue become stale (each slot counts its uses, and an
+        entry is valid only if it holds the current count of its slot). Evicting pops valid entries from the front
+        of the queue and skips the stale ones. Both are amortized O(1) per slot, and once the queue holds
+        compaction_factor times more entries than slots, it is rebuilt from the valid entries in O(n log n).
+        :param size: the number of slots
+        :param compaction_factor: the ratio of queue entries to slots that triggers a compaction
+        """
+        self.timestamps = np.zeros(size)
+        self.use_counts = np.zeros(size, dtype=np.int64)
+        self.in_queue = np.zeros(size, dtype=bool)
+        self.compaction_factor = compaction_factor
+
+        # chunks of (slots, use counts) in the order of use, and the position of the queue head in the first chunk
+        self.chunks = deque()
+        self.head_position = 0
+        self.queue_length = 0
+
+    def touch(self, slots, timestamp):
+        """
+        Mark slots as used
+        :param slots: the used slots
+        :param timestamp: the current time
+        :return: None
+        """
+        slots = np.unique(slots)
+        if len(slots) == 0:
+            return
+        self.timestamps[slots] = timestamp
+        self.use_counts[slots] += 1
+        self.in_queue[slots] = True
+        self.chunks.append((slots, self.use_counts[slots]))
+        self.queue_length += len(slots)
+        if self.queue_length > self.compaction_factor * len(self.use_counts) + 1024:
+            self._compact()
+
+    def evict(self, num_slots):
+        """
+        Remove the least recently used slots from the queue. They are queued again once they are used.
+        :param num_slots: the number of slots to evict
+        :return: the evicted slots, from the least recently used
+        """
+        evicted = []
+        num_evicted = 0
+        while num_evicted < num_slots and len(self.chunks) > 0:
+            slots, use_counts = self.chunks[0]
+            # look at a window of the chunk that most likely holds enough valid entries
+            window_end = min(len(slots), self.head_position + 2 * (num_slots - num_evicted) + 64)
+            window = slots[self.head_position:window_end]
+            valid = np.flatnonzero(self.use_counts[window] == use_counts[self.head_position:window_end])
+            valid = valid[:num_slots - num_evicted]
+            evicted.append(window[valid])
+            num_evicted += len(valid)
+
+            consumed = valid[-1] + 1 if num_evicted == num_slots else len(window)
+            self.head_position += consumed
+            self.queue_length -= consumed
+            if self.head_position == len(slots):
+                self.chunks.popleft()
+                self.head_position = 0
+
+        evicted = np.concatenate(evicted) if len(evicted) > 0 else np.zeros(0, dtype=np.int64)
+        # the evicted entries are invalidated, so that a slot that is not used again is not evicted twice
+        self.use_counts[evicted] += 1
+        self.in_queue[evicted] = False
+        return evicted
+
+    def ordered_slots(self):
+        """
+        :return: the queued slots, from the least recently used
+        """
+        if len(self.chunks) == 0:
+            return np.zeros(0, dtype=np.int64)
+        slots = np.concatenate([chunk_slots for chunk_slots, _ in self.chunks])[self.head_position:]
+        use_counts = np.concatenate([chunk_use_counts for _, chunk_use_counts in self.chunks])[self.head_position:]
+        return slots[self.use_counts[slots] == use_counts]
+
+    def set_order(self, slots, timestamps):
+        """
+        Replace the queue with the given slots
+        :param slots: the slots, from the least recently used
+        :param timestamps: the last use time of each slot
+        :return: None
+        """
+        self.timestamps[slots] = timestamps
+        self.in_queue[:] = False
+        self.in_queue[slots] = True
+        self.chunks = deque([(slots, self.use_counts[slots])])
+        self.head_position = 0
+        self.queue_length = len(slots)
+
+    def _compact(self):
+        slots = self.ordered_slots()
+        self.set_order(slots, self.timestamps[slots])
+
+
+class NeuralDictionary(object):
+    # set when the dictionary is queried by other threads while keys are added to it (see DNDWriter and DNDServer).
+    # the index is then rebuilt into a new copy without the lock, and the copy is swapped in under the lock.
+    # otherwise the index is rebuilt in place, which is cheaper.
+    snapshot_rebuilds = False
+
+    def __init__(self, dict_size, key_width, new_value_shift_coefficient=0.1, batch_size=100, key_error_threshold=0.01,
+                 index_type='Annoy', index_parameters=None):
         self.max_size = dict_size
         self.curr_size = 0
         self.new_value_shift_coefficient = new_value_shift_coefficient
 
-        self.index = AnnoyIndex(key_width, metric='euclidean')
-        self.index.set_seed(1)
+        self.embeddings = np.zeros((dict_size, key_width), dtype=np.float32)
+        self.values = np.zeros(dict_size, dtype=np.float32)
 
-        self.embeddings = np.zeros((dict_size, key_width))
-        self.values = np.zeros(dict_size)
-
-        self.lru_timestamps = np.zeros(dict_size)
+        self.lru = LRUQueue(dict_size)
         self.current_timestamp = 0.0
 
         # keys that are in this distance will be considered as the same key
         self.key_error_threshold = key_error_threshold
 
-        self.initial_update_size = batch_size
-        self.min_update_size = self.initial_update_size
         self.key_dimension = key_width
         self.value_dimension = 1
-        self._reset_buffer()
 
-        self.built_capacity = 0
+        index_parameters = dict(index_parameters or {})
+        if index_type == 'Annoy':
+            index_parameters.setdefault('initial_update_size', batch_size)
+        self.index = DND_INDEX_TYPES[index_type](self.embeddings, **index_parameters)
+
+        # held while the dictionary is changed or queried. with snapshot_rebuilds, adding keys only holds it for
+        # writing the new keys and swapping in the rebuilt index, while matching the keys and rebuilding the index
+        # are done without it.
+        self.lock = threading.Lock()
 
     def add(self, keys, values):
         # Adds new embeddings and values to the dictionary
-        indices = []
-        indices_to_remove = []
-        for i in range(keys.shape[0]):
-            index = self._lookup_key_index(keys[i])
-            if index:
-                # update existing value
-                self.values[index] += self.new_value_shift_coefficient * (values[i] - self.values[index])
-                self.lru_timestamps[index] = self.current_timestamp
-                indices_to_remove.append(i)
-            else:
-                # add new
-                if self.curr_size >= self.max_size:
-                    # find the LRU entry
-                    index = np.argmin(self.lru_timestamps)
-                else:
-                    index = self.curr_size
-                    self.curr_size += 1
-                self.lru_timestamps[index] = self.current_timestamp
-                indices.append(index)
-
-        for i in reversed(indices_to_remove):
-            keys = np.delete(keys, i, 0)
-            values = np.delete(values, i, 0)
-
-        self.buffered_keys = np.vstack((self.buffered_keys, keys))
-        self.buffered_values = np.vstack((self.buffered_values, values))
-        self.buffered_indices = self.buffered_indices + indices
-
-        if len(self.buffered_indices) >= self.min_update_size:
-            self.min_update_size = max(self.initial_update_size, int(self.curr_size * 0.02))
-            self._rebuild_index()
+        keys = np.asarray(keys, dtype=np.float32)
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        existing_indices = self._lookup_key_indices(keys)
+        with self.lock:
+            self._write(keys, values, existing_indices)
+            if not self.snapshot_rebuilds:
+                self.index.rebuild()
+                return
+        rebuild = self.index.prepare_rebuild()
+        if rebuild is not None:
+            with self.lock:
+                self.index.apply_rebuild(rebuild)
+
+    def _write(self, keys, values, existing_indices):
+        is_existing = existing_indices >= 0
+
+        # update existing values. a key that appears several times shifts the value once for each appearance, in
+        # order: v <- (1 - alpha)^m * v + sum_j alpha * (1 - alpha)^(m - 1 - j) * x_j
+        if np.any(is_existing):
+            updated_indices = existing_indices[is_existing]
+            order = np.argsort(updated_indices, kind='mergesort')
+            updated_indices = updated_indices[order]
+            updated_values = values[is_existing][order]
+            unique_indices, first_appearance, counts = np.unique(updated_indices, return_index=True,
+                                                                 return_counts=True)
+            appearances_left = np.repeat(first_appearance + counts, counts) - 1 - np.arange(len(updated_indices))
+            decay = 1 - self.new_value_shift_coefficient
+            self.values[unique_indices] *= decay ** counts
+            np.add.at(self.values, updated_indices,
+                      self.new_value_shift_coefficient * decay ** appearances_left * updated_values)
+            self.lru.touch(unique_indices, self.current_timestamp)
+
+        # add new keys to the free slots, and when there are none, replace the least recently used entries
+        num_new_keys = len(keys) - np.sum(is_existing)
+        if num_new_keys > 0:
+            num_free_slots = min(num_new_keys, self.max_size - self.curr_size)
+            indices = np.arange(self.curr_size, self.curr_size + num_free_slots)
+            self.lru.touch(indices, self.current_timestamp)
+            self.curr_size += num_free_slots
+            num_replaced_slots = num_new_keys - num_free_slots
+            if num_replaced_slots > 0:
+                # replace the LRU entries. if there are more new keys than entries, the last keys are kept.
+                replaced_indices = self.lru.evict(min(num_replaced_slots, self.max_size))
+                self.lru.touch(replaced_indices, self.current_timestamp)
+                indices = np.concatenate([indices, np.resize(replaced_indices, num_replaced_slots)])
+            self.embeddings[indices] = keys[~is_existing]
+            self.values[indices] = values[~is_existing]
+            self.index.add(indices)
 
         self.current_timestamp += 1
 
@@ -86,67 +220,138 @@ class AnnoyDictionary(object):
         if not self.has_enough_entries(k):
             # this will only happen when the DND is not yet populated with enough entries, which is only during heatup
             # these values won't be used and therefore they are meaningless
-            return [0.0], [0.0], [0]
-
-        _, indices = self._get_k_nearest_neighbors_indices(keys, k)
-
-        embeddings = []
-        values = []
-        for ind in indices:
-            self.lru_timestamps[ind] = self.current_timestamp
-            embeddings.append(self.embeddings[ind])
-            values.append(self.values[ind])
-
+            return np.zeros(len(keys), dtype=np.float32), np.zeros(len(keys), dtype=np.float32), \
+                np.zeros(len(keys), dtype=np.int64)
+
+        with self.lock:
+            indices = self._search(keys, k)
+            return self.embeddings[indices], self.values[indices], indices
+
+    def query_indices(self, keys, k):
+        """
+        Find the slots of the closest embeddings without gathering them, for readers that have their own view of the
+        slots (see map_slots)
+        :param keys: the query keys (batch x key width)
+        :param k: the number of neighbors
+        :return: the slots of the neighbors (batch x k)
+        """
+        with self.lock:
+            return self._search(keys, k)
+
+    def _search(self, keys, k):
+        _, indices = self.index.search(np.asarray(keys, dtype=np.float32), k)
+        self.lru.touch(indices.ravel(), self.current_timestamp)
         self.current_timestamp += 1
-
-        return embeddings, values, indices
+        return indices
 
     def has_enough_entries(self, k):
-        return self.curr_size > k and (self.built_capacity > k)
-
-    def _get_k_nearest_neighbors_indices(self, keys, k):
-        distances = []
-        indices = []
-        for key in keys:
-            index, distance = self.index.get_nns_by_vector(key, k, include_distances=True)
-            distances.append(distance)
-            indices.append(index)
-        return distances, indices
-
-    def _rebuild_index(self):
-        self.index.unbuild()
-        self.embeddings[self.buffered_indices] = self.buffered_keys
-        self.values[self.buffered_indices] = np.squeeze(self.buffered_values)
-        for idx, key in zip(self.buffered_indices, self.buffered_keys):
-            self.index.add_item(idx, key)
-
-        self._reset_buffer()
-
-        self.index.build(50)
-        self.built_capacity = self.curr_size
-
-    def _reset_buffer(self):
-        self.buffered_keys = np.zeros((0, self.key_dimension))
-        self.buffered_values = np.zeros((0, self.value_dimension))
-        self.buffered_indices = []
-
-    def _lookup_key_index(self, key):
-        distance, index = self._get_k_nearest_neighbors_indices([key], 1)
-        if distance != [[]] and distance[0][0] <= self.key_error_threshold:
-            return index
-        return None
+        return self.curr_size > k and (self.index.num_searchable() > k)
+
+    def save(self, directory):
+        """
+        Save the dictionary to a directory. The keys and the values of the used slots are saved as float32 .npy
+        files, and the index is saved next to them.
+        :param directory: the directory to create
+        :return: None
+        """
+        os.makedirs(directory)
+        with self.lock:
+            np.save(os.path.join(directory, 'embeddings.npy'), self.embeddings[:self.curr_size])
+            np.save(os.path.join(directory, 'values.npy'), self.values[:self.curr_size])
+            lru_slots = self.lru.ordered_slots()
+            np.save(os.path.join(directory, 'lru_slots.npy'), lru_slots)
+            np.save(os.path.join(directory, 'lru_timestamps.npy'), self.lru.timestamps[lru_slots])
+            self.index.save(os.path.join(directory, 'index'))
+            attributes = {name: value for name, value in self.__dict__.items()
+                          if name not in ['embeddings', 'values', 'lru', 'index', 'lock', 'snapshot_rebuilds']}
+            with open(os.path.join(directory, 'dictionary.p'), 'wb') as f:
+                pickle.dump(attributes, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(directory):
+        """
+        Load a dictionary that was saved by save. A full dictionary is memory mapped from the saved files (copy on
+        write), and its index is loaded as is, so none of the keys are added again.
+        :param directory: the directory of the saved dictionary
+        :return: the loaded dictionary
+        """
+        with open(os.path.join(directory, 'dictionary.p'), 'rb') as f:
+            attributes = pickle.load(f)
+        dictionary = NeuralDictionary.__new__(NeuralDictionary)
+        dictionary.__dict__.update(attributes)
+        dictionary.embeddings = dictionary._load_slots(os.path.join(directory, 'embeddings.npy'))
+        dictionary.values = dictionary._load_slots(os.path.join(directory, 'values.npy'))
+        dictionary.lru = LRUQueue(dictionary.max_size)
+        dictionary.lru.set_order(np.load(os.path.join(directory, 'lru_slots.npy')),
+                                 np.load(os.path.join(directory, 'lru_timestamps.npy')))
+        dictionary.index = DNDIndex.load(os.path.join(directory, 'index'), dictionary.embeddings)
+        dictionary.lock = threading.Lock()
+        return dictionary
+
+    def map_slots(self, embeddings_path, values_path):
+        """
+        Move the keys and the values to memory mapped files, so that other processes can read the slots that a
+        query returns directly from the files (e.g. files in /dev/shm, which are kept in shared memory)
+        :param embeddings_path: the file of the keys (max size x key width float32)
+        :param values_path: the file of the values (max size float32)
+        :return: None
+        """
+        with self.lock:
+            embeddings = np.memmap(embeddings_path, dtype=np.float32, mode='w+', shape=self.embeddings.shape)
+            embeddings[:self.curr_size] = self.embeddings[:self.curr_size]
+            values = np.memmap(values_path, dtype=np.float32, mode='w+', shape=self.values.shape)
+            values[:self.curr_size] = self.values[:self.curr_size]
+            self.embeddings = embeddings
+            self.values = values
+            self.index.embeddings = embeddings
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _load_slots(self, path):
+        if self.curr_size == self.max_size:
+            return np.load(path, mmap_mode='c')
+        used_slots = np.load(path)
+        slots = np.zeros((self.max_size,) + used_slots.shape[1:], dtype=used_slots.dtype)
+        slots[:self.curr_size] = used_slots
+        return slots
+
+    def _lookup_key_indices(self, keys):
+        # the slot of the stored key that matches each key, or -1 for new keys
+        if len(keys) == 0 or self.index.num_searchable() == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        _, indices = self.index.search(keys, 1)
+        if indices.shape[1] == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        indices = indices[:, 0]
+        # the distance to the nearest key is calculated again directly, since the search distances are not exact
+        # enough for a key error threshold of 0
+        distances = np.sqrt(np.sum(np.square(keys - self.embeddings[indices]), axis=1))
+        return np.where(distances <= self.key_error_threshold, indices, -1)
 
 
 class QDND:
     def __init__(self, dict_size, key_width, num_actions, new_value_shift_coefficient=0.1, key_error_threshold=0.01,
-                 learning_rate=0.01):
+                 learning_rate=0.01, index_type='Annoy', index_parameters=None, num_query_threads=0):
         self.num_actions = num_actions
         self.dicts = []
         self.learning_rate = learning_rate
 
+        # the action dictionaries are queried in parallel by this number of threads (0 queries them one by one)
+        self.num_query_threads = num_query_threads
+        self.query_pool = None
+
         # create a dict for each action
         for a in range(num_actions):
-            new_dict = AnnoyDictionary(dict_size, key_width, new_value_shift_coefficient, key_error_threshold=key_error_threshold)
+            new_dict = NeuralDictionary(dict_size, key_width, new_value_shift_coefficient,
+                                        key_error_threshold=key_error_threshold, index_type=index_type,
+                                        index_parameters=index_parameters)
             self.dicts.append(new_dict)
 
     def add(self, embeddings, actions, values):
@@ -164,16 +369,55 @@ class QDND:
 
     def query(self, embeddings, action, k):
         # query for nearest neighbors to the given embeddings
-        dnd_embeddings = []
-        dnd_values = []
-        dnd_indices = []
-        for i in range(len(embeddings)):
-            embedding, value, indices = self.dicts[action].query([embeddings[i]], k)
-            dnd_embeddings.append(embedding[0])
-            dnd_values.append(value[0])
-            dnd_indices.append(indices[0])
+        return self.dicts[action].query(embeddings, k)
+
+    def enable_snapshot_rebuilds(self):
+        """
+        Rebuild the indices into new copies that are swapped in, for dictionaries that are queried by other threads
+        while episodes are added to them
+        :return: None
+        """
+        for dictionary in self.dicts:
+            dictionary.snapshot_rebuilds = True
+
+    def query_all(self, embeddings, k):
+        """
+        Query the dictionaries of all the actions for the nearest neighbors of a batch of embeddings
+        :param embeddings: the query embeddings (batch x key width)
+        :param k: the number of neighbors
+        :return: the embeddings (actions x batch x k x key width), the values (actions x batch x k) and the indices
+                 (actions x batch x k) of the neighbors
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not self.has_enough_entries(k):
+            # this will only happen when the DND is not yet populated with enough entries, which is only during heatup
+            # these values won't be used and therefore they are meaningless
+            return np.zeros((self.num_actions, len(embeddings), k, embeddings.shape[1]), dtype=np.float32), \
+                np.zeros((self.num_actions, len(embeddings), k), dtype=np.float32), \
+                np.zeros((self.num_actions, len(embeddings), k), dtype=np.int64)
+
+        results = self._map_dicts(lambda d: d.query(embeddings, k))
+        return tuple(np.stack(result) for result in zip(*results))
+
+    def query_all_indices(self, embeddings, k):
+        """
+        Like query_all, but only the indices of the neighbors are returned
+        :param embeddings: the query embeddings (batch x key width)
+        :param k: the number of neighbors
+        :return: the indices of the neighbors (actions x batch x k), or None if the dictionaries do not have enough
+                 entries yet
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not self.has_enough_entries(k):
+            return None
+        return np.stack(self._map_dicts(lambda d: d.query_indices(embeddings, k)))
 
-        return dnd_embeddings, dnd_values, dnd_indices
+    def _map_dicts(self, function):
+        if self.num_query_threads > 0:
+            if self.query_pool is None:
+                self.query_pool = ThreadPoolExecutor(self.num_query_threads)
+            return list(self.query_pool.map(function, self.dicts))
+        return [function(d) for d in self.dicts]
 
     def has_enough_entries(self, k):
         # check if each of the action dictionaries has at least k entries
@@ -182,6 +426,133 @@ class QDND:
                 return False
         return True
 
+    def save(self, directory):
+        """
+        Save the dictionaries of all the actions to a directory. The directory is written under a temporary name and
+        renamed when it is complete, so a crash while saving does not leave a partial checkpoint.
+        :param directory: the directory to create
+        :return: None
+        """
+        temp_directory = directory + '.tmp'
+        if os.path.exists(temp_directory):
+            shutil.rmtree(temp_directory)
+        os.makedirs(temp_directory)
+        for a in range(self.num_actions):
+            self.dicts[a].save(os.path.join(temp_directory, str(a)))
+        attributes = {name: value for name, value in self.__dict__.items() if name not in ['dicts', 'query_pool']}
+        with open(os.path.join(temp_directory, 'qdnd.p'), 'wb') as f:
+            pickle.dump(attributes, f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(temp_directory, directory)
+
+    @staticmethod
+    def load(directory):
+        """
+        Load the dictionaries that were saved by save
+        :param directory: the directory of the saved dictionaries
+        :return: the loaded QDND
+        """
+        with open(os.path.join(directory, 'qdnd.p'), 'rb') as f:
+            attributes = pickle.load(f)
+        dnd = QDND.__new__(QDND)
+        dnd.__dict__.update(attributes)
+        dnd.query_pool = None
+        dnd.dicts = [NeuralDictionary.load(os.path.join(directory, str(a))) for a in range(dnd.num_actions)]
+        return dnd
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['query_pool'] = None
+        return state
+
+
+class DNDWriter(object):
+    def __init__(self, dnd, max_pending_insertions):
+        """
+        Inserts the episodes of an agent to a QDND from a background thread, so that the acting thread does not wait
+        for the insertions and the index rebuilds. The episodes that are waiting when the thread is ready are added
+        in a single batch. The acting thread keeps querying the DND meanwhile, and it sees the new keys of a batch
+        all at once, when they are written.
+
+        The queries are not lock free - a query waits on the lock of the action dictionary while the new keys of a
+        batch are written to it and while a rebuilt index is swapped in. Matching the keys and rebuilding the index,
+        which take most of the insertion time, are done without the lock (see NeuralDictionary.snapshot_rebuilds).
+
+        :param dnd: the QDND to add the episodes to
+        :param max_pending_insertions: the maximal number of episodes that wait to be added. adding another episode
+                                       waits until there is room, which bounds how much the DND can lag behind.
+        """
+        self.dnd = dnd
+        if isinstance(dnd, QDND):
+            # a shared DND rebuilds its indices this way on the server
+            dnd.enable_snapshot_rebuilds()
+        self.insertions = queue.Queue(maxsize=max_pending_insertions)
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    insertions = [self.insertions.get(timeout=0.1)]
+                except queue.Empty:
+                    continue
+                while True:
+                    try:
+                        insertions.append(self.insertions.get_nowait())
+                    except queue.Empty:
+                        break
+
+                embeddings, actions, values = zip(*insertions)
+                self.dnd.add(np.concatenate(embeddings), np.concatenate(actions), np.concatenate(values))
+                for _ in insertions:
+                    self.insertions.task_done()
+        except Exception as e:
+            self.error = e
+
+    def add(self, embeddings, actions, values):
+        """
+        Queue an episode to be added to the DND, waiting if there are already max_pending_insertions waiting
+        :param embeddings: the state embeddings of the episode
+        :param actions: the actions of the episode
+        :param values: the returns of the episode
+        :return: None
+        """
+        if len(actions) == 0:
+            return
+        insertion = (np.array(embeddings).reshape(len(actions), -1), np.array(actions), np.array(values))
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.insertions.put(insertion, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """
+        Wait until all the queued episodes are added to the DND
+        :return: None
+        """
+        while self.insertions.unfinished_tasks > 0:
+            if self.error is not None:
+                raise self.error
+            time.sleep(0.01)
+
+    def stop(self):
+        """
+        Add the queued episodes to the DND, and stop the thread
+        :return: None
+        """
+        self.flush()
+        self.stop_event.set()
+        self.thread.join()
+
 
 def load_dnd(model_dir):
     max_id = 0
@@ -190,17 +561,12 @@ def load_dnd(model_dir):
         if int(f.split('.')[0]) > max_id:
             max_id = int(f.split('.')[0])
 
-    model_path = str(max_id) + '.dnd'
-    with open(os.path.join(model_dir, model_path), 'rb') as f:
-        DND = pickle.load(f)
-
-        for a in range(DND.num_actions):
-            DND.dicts[a].index = AnnoyIndex(512, metric='euclidean')
-            DND.dicts[a].index.set_seed(1)
-
-            for idx, key in zip(range(DND.dicts[a].curr_size), DND.dicts[a].embeddings[:DND.dicts[a].curr_size]):
-                DND.dicts[a].index.add_item(idx, key)
+    model_path = os.path.join(model_dir, str(max_id) + '.dnd')
+    if os.path.isdir(model_path):
+        return QDND.load(model_path)
 
-            DND.dicts[a].index.build(50)
+    # a pickled DND. the indices are built again from the stored keys when unpickling
+    with open(model_path, 'rb') as f:
+        DND = pickle.load(f)
 
     return DND
@@ -0,0 +1,490 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import abc
+import os
+import pickle
+import six
+import numpy as np
+from annoy import AnnoyIndex
+
+
+def k_nearest_neighbors(keys, candidate_keys, k, candidate_squared_norms=None):
+    """
+    Find the exact nearest neighbors of a batch of keys among a set of candidate keys, using a single matrix product
+    for the distances and a partial sort for selecting the neighbors
+    :param keys: the query keys (batch x key width)
+    :param candidate_keys: the candidate keys (num candidates x key width)
+    :param k: the number of neighbors to find for each key
+    :param candidate_squared_norms: the squared norms of the candidate keys, if they are already known
+    :return: the euclidean distances (batch x k) and the positions of the neighbors in candidate_keys (batch x k),
+             sorted from the nearest neighbor. if there are less than k candidates, all of them are returned.
+    """
+    keys = np.asarray(keys)
+    num_keys = keys.shape[0]
+    k = min(k, candidate_keys.shape[0])
+    if k == 0:
+        return np.zeros((num_keys, 0)), np.zeros((num_keys, 0), dtype=np.int64)
+
+    # |q - c|^2 = |q|^2 - 2 q.c + |c|^2
+    squared_distances = np.dot(keys, candidate_keys.T)
+    squared_distances *= -2
+    squared_distances += np.sum(np.square(keys), axis=1)[:, np.newaxis]
+    if candidate_squared_norms is None:
+        candidate_squared_norms = np.sum(np.square(candidate_keys), axis=1)
+    squared_distances += candidate_squared_norms[np.newaxis, :]
+    np.maximum(squared_distances, 0, out=squared_distances)
+
+    neighbors = _k_smallest(squared_distances, k)
+    return np.sqrt(squared_distances[np.arange(num_keys)[:, np.newaxis], neighbors]), neighbors
+
+
+def _k_smallest(distances, k):
+    # the positions of the k smallest distances in each row, sorted by the distance
+    rows = np.arange(distances.shape[0])[:, np.newaxis]
+    if k < distances.shape[1]:
+        positions = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        positions = np.tile(np.arange(distances.shape[1]), (distances.shape[0], 1))
+    return positions[rows, np.argsort(distances[rows, positions], axis=1)]
+
+
+@six.add_metaclass(abc.ABCMeta)
+class DNDIndex(object):
+    # large attributes that are saved as .npy files, and memory mapped when loading
+    array_attributes = []
+    # attributes that are not saved, and are restored by _restore
+    transient_attributes = []
+
+    def __init__(self, embeddings):
+        """
+        A nearest neighbors index over the keys of a DND. The keys themselves are kept by the dictionary, in a fixed
+        array of slots that is shared with the index, and the index refers to them by their slot.
+        :param embeddings: the keys array of the dictionary
+        """
+        self.embeddings = embeddings
+
+    @abc.abstractmethod
+    def add(self, indices):
+        """
+        Index the keys in the given slots. A slot that is already indexed was overwritten with a new key, and is
+        indexed again.
+        :param indices: the slots of the keys
+        :return: None
+        """
+        pass
+
+    @abc.abstractmethod
+    def search(self, keys, k):
+        """
+        Find the nearest indexed keys to each of the given keys
+        :param keys: the query keys (batch x key width)
+        :param k: the number of neighbors to find for each key
+        :return: the euclidean distances (batch x k) and the slots (batch x k) of the neighbors, sorted from the
+                 nearest neighbor. if less than k keys are searchable, all of them are returned.
+        """
+        pass
+
+    @abc.abstractmethod
+    def num_searchable(self):
+        """
+        :return: the number of keys that can be found by a search
+        """
+        pass
+
+    def prepare_rebuild(self):
+        """
+        Build the parts of the index that are replaced as a whole (e.g. Annoy trees or IVF centroids) if they are
+        due. The index is only read, so it can still be searched by other threads while this runs, as long as no
+        keys are added.
+        :return: the rebuilt parts, to be given to apply_rebuild, or None if no rebuild is due
+        """
+        return None
+
+    def apply_rebuild(self, rebuild):
+        """
+        Replace the rebuilt parts of the index
+        :param rebuild: the result of prepare_rebuild
+        :return: None
+        """
+        pass
+
+    def rebuild(self):
+        """
+        Rebuild the index if a rebuild is due
+        :return: None
+        """
+        rebuild = self.prepare_rebuild()
+        if rebuild is not None:
+            self.apply_rebuild(rebuild)
+
+    def save(self, directory):
+        """
+        Save the index to a directory, without the keys, which are saved by the dictionary
+        :param directory: the directory to create
+        :return: None
+        """
+        os.makedirs(directory)
+        attributes = {}
+        for name, value in self.__dict__.items():
+            if name in self.array_attributes:
+                np.save(os.path.join(directory, name + '.npy'), value)
+            elif name != 'embeddings' and name not in self.transient_attributes:
+                attributes[name] = value
+        with open(os.path.join(directory, 'index.p'), 'wb') as f:
+            pickle.dump((self.__class__, attributes), f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(directory, embeddings):
+        """
+        Load an index that was saved by save, without adding the keys to it again
+        :param directory: the directory of the saved index
+        :param embeddings: the keys array of the dictionary
+        :return: the loaded index
+        """
+        with open(os.path.join(directory, 'index.p'), 'rb') as f:
+            index_class, attributes = pickle.load(f)
+        index = index_class.__new__(index_class)
+        index.__dict__.update(attributes)
+        index.embeddings = embeddings
+        for name in index_class.array_attributes:
+            # copy on write, so that the saved files are not changed by the training
+            setattr(index, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='c'))
+        index._restore(directory)
+        return index
+
+    def _restore(self, directory):
+        pass
+
+
+class ExactDNDIndex(DNDIndex):
+    array_attributes = ['squared_norms']
+
+    def __init__(self, embeddings, block_size=16384):
+        """
+        An exact search over all the keys. The distances of a batch of keys are calculated through a matrix product
+        over blocks of the stored keys, and the nearest keys of all the blocks are merged, so that the distance
+        matrix does not grow with the size of the dictionary. Adding keys costs nothing, so this index is usually the
+        fastest for small dictionaries.
+        :param embeddings: the keys array of the dictionary. the slots are expected to be filled in order.
+        :param block_size: the number of stored keys in each block
+        """
+        DNDIndex.__init__(self, embeddings)
+        self.block_size = block_size
+        self.squared_norms = np.zeros(len(embeddings))
+        self.num_indexed = 0
+
+    def add(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        self.squared_norms[indices] = np.sum(np.square(self.embeddings[indices]), axis=1)
+        self.num_indexed = max(self.num_indexed, np.max(indices) + 1)
+
+    def search(self, keys, k):
+        keys = np.asarray(keys)
+        k = min(k, self.num_indexed)
+        distances = []
+        indices = []
+        for start in range(0, self.num_indexed, self.block_size):
+            end = min(start + self.block_size, self.num_indexed)
+            block_distances, block_neighbors = k_nearest_neighbors(keys, self.embeddings[start:end], k,
+                                                                   self.squared_norms[start:end])
+            distances.append(block_distances)
+            indices.append(block_neighbors + start)
+        if len(distances) == 0:
+            return np.zeros((len(keys), 0)), np.zeros((len(keys), 0), dtype=np.int64)
+
+        distances = np.concatenate(distances, axis=1)
+        indices = np.concatenate(indices, axis=1)
+        nearest = _k_smallest(distances, k)
+        rows = np.arange(len(keys))[:, np.newaxis]
+        return distances[rows, nearest], indices[rows, nearest]
+
+    def num_searchable(self):
+        return self.num_indexed
+
+
+class AnnoyDNDIndex(DNDIndex):
+    transient_attributes = ['index']
+
+    def __init__(self, embeddings, num_trees=50, search_k=-1, initial_update_size=100):
+        """
+        An index of random projection trees through the Annoy library. Annoy indices cannot be updated after they
+        are built, so new keys are buffered and a new index is built once the buffer reaches 2% of the indexed keys.
+        The new keys are not searchable until then.
+        :param embeddings: the keys array of the dictionary
+        :param num_trees: the number of trees to build. more trees give a better recall and a slower build.
+        :param search_k: the number of nodes to inspect in a search (-1 for num_trees x k). a larger value gives a
+                         better recall and a slower search.
+        :param initial_update_size: the minimal number of buffered keys that triggers a build
+        """
+        DNDIndex.__init__(self, embeddings)
+        self.num_trees = num_trees
+        self.search_k = search_k
+        self.initial_update_size = initial_update_size
+        self.min_update_size = initial_update_size
+        self.buffered_indices = []
+        self.built_capacity = 0
+        self.index = self._create_annoy_index()
+        # a loaded Annoy index is read only, so it is replaced by a new index on the next in place rebuild
+        self.is_loaded = False
+
+    def _create_annoy_index(self):
+        index = AnnoyIndex(self.embeddings.shape[1], metric='euclidean')
+        index.set_seed(1)
+        return index
+
+    def add(self, indices):
+        self.buffered_indices.extend(indices)
+
+    def rebuild(self):
+        # when nothing searches the index meanwhile, it is unbuilt in place and only the buffered keys are added
+        if len(self.buffered_indices) < self.min_update_size:
+            return
+        if self.is_loaded:
+            self.index = self._create_annoy_index()
+            for idx in range(self.built_capacity):
+                self.index.add_item(idx, self.embeddings[idx])
+            self.is_loaded = False
+        self.index.unbuild()
+        for idx in self.buffered_indices:
+            self.index.add_item(int(idx), self.embeddings[idx])
+        self.built_capacity = self.index.get_n_items()
+        self.buffered_indices = []
+        self.index.build(self.num_trees)
+        self.min_update_size = max(self.initial_update_size, int(self.built_capacity * 0.02))
+
+    def prepare_rebuild(self):
+        if len(self.buffered_indices) < self.min_update_size:
+            return None
+        # the index that is being searched is not changed, so a new index is built with all the keys. the slots
+        # are filled in order, so the keys are in all the slots up to the last buffered one. this is only used when
+        # the index is searched while it is rebuilt (see NeuralDictionary.snapshot_rebuilds), since it costs
+        # O(capacity) instead of O(buffered keys).
+        num_buffered = len(self.buffered_indices)
+        capacity = max(self.built_capacity, int(np.max(self.buffered_indices)) + 1)
+        index = self._create_annoy_index()
+        for idx in range(capacity):
+            index.add_item(idx, self.embeddings[idx])
+        index.build(self.num_trees)
+        return index, capacity, num_buffered
+
+    def apply_rebuild(self, rebuild):
+        self.index, self.built_capacity, num_buffered = rebuild
+        self.is_loaded = False
+        self.buffered_indices = self.buffered_indices[num_buffered:]
+        self.min_update_size = max(self.initial_update_size, int(self.built_capacity * 0.02))
+
+    def search(self, keys, k):
+        distances = []
+        indices = []
+        for key in keys:
+            index, distance = self.index.get_nns_by_vector(key, k, search_k=self.search_k, include_distances=True)
+            distances.append(distance)
+            indices.append(index)
+        k = min([k] + [len(index) for index in indices])
+        return np.array([distance[:k] for distance in distances]).reshape(len(keys), k), \
+            np.array([index[:k] for index in indices], dtype=np.int64).reshape(len(keys), k)
+
+    def num_searchable(self):
+        return self.built_capacity
+
+    def save(self, directory):
+        DNDIndex.save(self, directory)
+        if self.built_capacity > 0:
+            # Annoy maps the saved file in place of the built index
+            self.index.save(os.path.join(directory, 'index.ann'))
+            self.is_loaded = True
+
+    def _restore(self, directory):
+        self.index = self._create_annoy_index()
+        if self.built_capacity > 0:
+            self.index.load(os.path.join(directory, 'index.ann'))
+            self.is_loaded = True
+
+    def __getstate__(self):
+        # Annoy indices cannot be pickled. the index is built again from the keys when unpickling.
+        state = self.__dict__.copy()
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = self._create_annoy_index()
+        self.is_loaded = False
+        for idx in range(self.built_capacity):
+            self.index.add_item(idx, self.embeddings[idx])
+        if self.built_capacity > 0:
+            self.index.build(self.num_trees)
+
+
+class IVFDNDIndex(DNDIndex):
+    array_attributes = ['slot_list', 'slot_position', 'squared_norms']
+
+    def __init__(self, embeddings, num_lists=256, num_probes=8, training_iterations=10):
+        """
+        An inverted file index, which can be updated incrementally. The keys are clustered around num_lists
+        centroids, and each key is kept in the list of its nearest centroid. A search calculates the exact distances
+        to the keys in the lists of the num_probes nearest centroids. Adding, overwriting or removing a key only
+        changes the list that holds it, so the index never has to be built again as a whole.
+
+        The centroids are trained with k-means once there are enough keys, and trained again (reassigning all the
+        keys) each time the number of keys doubles. Until the first training, a search goes over all the keys.
+
+        :param embeddings: the keys array of the dictionary
+        :param num_lists: the number of centroids
+        :param num_probes: the number of lists to search. more probes give a better recall and a slower search.
+        :param training_iterations: the number of k-means iterations when training the centroids
+        """
+        DNDIndex.__init__(self, embeddings)
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.training_iterations = training_iterations
+
+        # the list of each slot (-1 for slots that are not indexed) and the position of the slot in the list
+        self.slot_list = np.full(len(embeddings), -1, dtype=np.int64)
+        self.slot_position = np.zeros(len(embeddings), dtype=np.int64)
+        self.squared_norms = np.zeros(len(embeddings))
+        self.num_indexed = 0
+
+        # before the first training all the keys are kept in a single list
+        self.centroids = None
+        self.lists = [np.zeros(16, dtype=np.int64)]
+        self.list_sizes = np.zeros(1, dtype=np.int64)
+        self.num_indexed_at_last_training = 0
+
+    def add(self, indices):
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        self.remove(indices[self.slot_list[indices] >= 0])
+        self.squared_norms[indices] = np.sum(np.square(self.embeddings[indices]), axis=1)
+
+        if self.centroids is None:
+            self._append(0, indices)
+        else:
+            assignments = self._nearest_centroids(self.embeddings[indices], 1)[:, 0]
+            for list_idx in np.unique(assignments):
+                self._append(list_idx, indices[assignments == list_idx])
+        self.num_indexed += len(indices)
+
+    def remove(self, indices):
+        """
+        Remove the keys in the given slots from the index
+        :param indices: the slots of the keys
+        :return: None
+        """
+        for idx in indices:
+            list_idx = self.slot_list[idx]
+            if list_idx < 0:
+                continue
+            # move the last slot of the list to the position of the removed slot
+            position = self.slot_position[idx]
+            last_position = self.list_sizes[list_idx] - 1
+            last_slot = self.lists[list_idx][last_position]
+            self.lists[list_idx][position] = last_slot
+            self.slot_position[last_slot] = position
+            self.list_sizes[list_idx] -= 1
+            self.slot_list[idx] = -1
+            self.num_indexed -= 1
+
+    def _append(self, list_idx, indices):
+        size = self.list_sizes[list_idx]
+        if size + len(indices) > len(self.lists[list_idx]):
+            grown_list = np.zeros(max(2 * len(self.lists[list_idx]), size + len(indices)), dtype=np.int64)
+            grown_list[:size] = self.lists[list_idx][:size]
+            self.lists[list_idx] = grown_list
+        self.lists[list_idx][size:size + len(indices)] = indices
+        self.slot_list[indices] = list_idx
+        self.slot_position[indices] = np.arange(size, size + len(indices))
+        self.list_sizes[list_idx] += len(indices)
+
+    def _indexed_slots(self):
+        return np.concatenate([self.lists[i][:self.list_sizes[i]] for i in range(len(self.lists))])
+
+    def _nearest_centroids(self, keys, num_centroids, centroids=None, block_size=65536):
+        # blocked, so that assigning all the keys does not allocate a huge distances matrix
+        centroids = self.centroids if centroids is None else centroids
+        nearest = []
+        for start in range(0, len(keys), block_size):
+            _, block_nearest = k_nearest_neighbors(keys[start:start + block_size], centroids, num_centroids)
+            nearest.append(block_nearest)
+        return np.concatenate(nearest)
+
+    def prepare_rebuild(self):
+        # train the centroids with k-means on a sample of the indexed keys, and assign all the keys to the lists of
+        # the new centroids
+        if self.num_indexed < max(4 * self.num_lists, 2 * self.num_indexed_at_last_training):
+            return None
+
+        slots = self._indexed_slots()
+        sample = self.embeddings[np.random.choice(slots, min(len(slots), 32 * self.num_lists), replace=False)]
+        centroids = sample[np.random.choice(len(sample), self.num_lists, replace=False)].copy()
+        for _ in range(self.training_iterations):
+            assignments = self._nearest_centroids(sample, 1, centroids)[:, 0]
+            counts = np.bincount(assignments, minlength=self.num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+            # empty clusters are moved to random keys
+            centroids[~non_empty] = sample[np.random.choice(len(sample), np.sum(~non_empty))]
+
+        assignments = self._nearest_centroids(self.embeddings[slots], 1, centroids)[:, 0]
+        order = np.argsort(assignments, kind='mergesort')
+        list_sizes = np.bincount(assignments, minlength=self.num_lists).astype(np.int64)
+        lists = [np.array(l, dtype=np.int64) for l in np.split(slots[order], np.cumsum(list_sizes)[:-1])]
+        return centroids, lists, list_sizes, slots
+
+    def apply_rebuild(self, rebuild):
+        self.centroids, self.lists, self.list_sizes, slots = rebuild
+        for list_idx, l in enumerate(self.lists):
+            self.slot_list[l] = list_idx
+            self.slot_position[l] = np.arange(len(l))
+        self.num_indexed_at_last_training = len(slots)
+
+    def search(self, keys, k):
+        keys = np.asarray(keys)
+        if self.centroids is None:
+            candidates = self.lists[0][:self.list_sizes[0]]
+            distances, neighbors = k_nearest_neighbors(keys, self.embeddings[candidates], k,
+                                                       self.squared_norms[candidates])
+            return distances, candidates[neighbors]
+
+        k = min(k, self.num_indexed)
+        probes = self._nearest_centroids(keys, self.num_lists)
+        # probe more lists than num_probes if the nearest lists of a key hold less than k keys
+        num_probes = max(self.num_probes, np.max(np.sum(np.cumsum(self.list_sizes[probes], axis=1) < k, axis=1)) + 1)
+        probes = probes[:, :num_probes]
+
+        # each probed list is searched once for all the keys that probe it, and then the nearest keys from all the
+        # lists of each key are merged
+        candidate_distances = np.full((len(keys), num_probes * k), np.inf)
+        candidate_indices = np.zeros((len(keys), num_probes * k), dtype=np.int64)
+        order = np.argsort(probes, axis=None, kind='mergesort')
+        for group in np.split(order, np.flatnonzero(np.diff(probes.flat[order])) + 1):
+            list_idx = probes.flat[group[0]]
+            rows, columns = np.unravel_index(group, probes.shape)
+            candidates = self.lists[list_idx][:self.list_sizes[list_idx]]
+            list_distances, neighbors = k_nearest_neighbors(keys[rows], self.embeddings[candidates], k,
+                                                            self.squared_norms[candidates])
+            positions = columns[:, np.newaxis] * k + np.arange(neighbors.shape[1])
+            candidate_distances[rows[:, np.newaxis], positions] = list_distances
+            candidate_indices[rows[:, np.newaxis], positions] = candidates[neighbors]
+
+        nearest = _k_smallest(candidate_distances, k)
+        rows = np.arange(len(keys))[:, np.newaxis]
+        return candidate_distances[rows, nearest], candidate_indices[rows, nearest]
+
+    def num_searchable(self):
+        return self.num_indexed
@@ -0,0 +1,246 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import os, shutil, tempfile, threading, time
+from multiprocessing.connection import Listener, Client
+from memories.differentiable_neural_dictionary import QDND, load_dnd
+
+
+def parse_address(address):
+    """
+    :param address: a 'host:port' string
+    :return: a (host, port) tuple
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def _shared_memory_directory():
+    # /dev/shm is backed by memory, so mapping files from it shares the memory between the processes
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return None
+
+
+class DNDServer(object):
+    def __init__(self, address, authkey, checkpoint_restore_dir=None, save_model_dir=None, save_model_sec=None):
+        """
+        Serves a single QDND to all the workers of a distributed run on the same host, so that the dictionary is
+        kept once instead of once per worker, and each worker learns from the episodes of all the workers.
+        The server is the only owner of the nearest neighbors indices. The keys and the values of the dictionaries
+        are kept in shared memory files, so a query only sends the indices of the neighbors back, and the workers
+        read the neighbors themselves (see RemoteQDND). The additions of the workers are applied one batch at a time,
+        while the queries of the other workers go on.
+
+        The dictionary is created when the first worker connects, since only the workers know the width of the keys.
+
+        :param address: the 'host:port' to listen on
+        :param authkey: the key that the workers authenticate with
+        :param checkpoint_restore_dir: a directory to load the last saved DND from
+        :param save_model_dir: the directory to save the DND to
+        :param save_model_sec: the time in seconds between saving the DND (None to never save it)
+        """
+        self.address = parse_address(address)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.checkpoint_restore_dir = checkpoint_restore_dir
+        self.save_model_dir = save_model_dir
+        self.save_model_sec = save_model_sec
+
+        self.dnd = None
+        self.storage = None
+        self.storage_dir = tempfile.mkdtemp(prefix='coach_dnd_', dir=_shared_memory_directory())
+        # taken while the dictionaries are created, added to or saved
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.last_saved_dir = None
+
+    def serve_forever(self):
+        """
+        Accept workers until the process is stopped. Each worker is served by its own thread.
+        :return: None
+        """
+        listener = Listener(self.address, authkey=self.authkey)
+        if self.save_model_sec and self.save_model_dir:
+            saver = threading.Thread(target=self._save_periodically)
+            saver.daemon = True
+            saver.start()
+        try:
+            while not self.stop_event.is_set():
+                connection = listener.accept()
+                thread = threading.Thread(target=self._serve, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+            self.stop()
+
+    def _serve(self, connection):
+        try:
+            while True:
+                try:
+                    command, args = connection.recv()
+                except EOFError:
+                    return
+                try:
+                    result = ('ok', getattr(self, '_' + command)(*args))
+                except Exception as e:
+                    result = ('error', e)
+                connection.send(result)
+        finally:
+            connection.close()
+
+    def _create(self, dnd_parameters):
+        with self.lock:
+            if self.dnd is None:
+                if self.checkpoint_restore_dir and \
+                        any(s.endswith('.dnd') for s in os.listdir(self.checkpoint_restore_dir)):
+                    self.dnd = load_dnd(self.checkpoint_restore_dir)
+                else:
+                    self.dnd = QDND(**dnd_parameters)
+                # the workers query the dictionaries while the additions of other workers are applied
+                self.dnd.enable_snapshot_rebuilds()
+                self.storage = []
+                for a, dictionary in enumerate(self.dnd.dicts):
+                    embeddings_path = os.path.join(self.storage_dir, '{}_embeddings'.format(a))
+                    values_path = os.path.join(self.storage_dir, '{}_values'.format(a))
+                    dictionary.map_slots(embeddings_path, values_path)
+                    self.storage.append((embeddings_path, values_path, dictionary.embeddings.shape))
+
+            assert self.dnd.num_actions == dnd_parameters['num_actions'] and \
+                self.storage[0][2] == (dnd_parameters['dict_size'], dnd_parameters['key_width']), \
+                'The shared DND was created with a different size than the one requested by the worker'
+            return self.storage
+
+    def _query_all_indices(self, embeddings, k):
+        return self.dnd.query_all_indices(embeddings, k)
+
+    def _add(self, embeddings, actions, values):
+        with self.lock:
+            return self.dnd.add(embeddings, actions, values)
+
+    def _has_enough_entries(self, k):
+        return self.dnd.has_enough_entries(k)
+
+    def _save(self, directory):
+        with self.lock:
+            self.dnd.save(directory)
+
+    def _save_periodically(self):
+        # the ids of the saved DNDs continue the ones in the directory, so that load_dnd picks the last one
+        saved_ids = [int(s.split('.')[0]) for s in os.listdir(self.save_model_dir) if s.endswith('.dnd')]
+        model_id = max(saved_ids + [0])
+        while not self.stop_event.wait(self.save_model_sec):
+            if self.dnd is None:
+                continue
+            model_id += 1
+            directory = os.path.join(self.save_model_dir, str(model_id) + '.dnd')
+            self._save(directory)
+            # only the last DND is kept, since each one is as large as the dictionary
+            if self.last_saved_dir is not None:
+                shutil.rmtree(self.last_saved_dir)
+            self.last_saved_dir = directory
+
+    def stop(self):
+        self.stop_event.set()
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+
+class RemoteQDND(object):
+    def __init__(self, address, authkey, dict_size, key_width, num_actions, connection_timeout=60, **dnd_parameters):
+        """
+        A QDND that is served by a DNDServer. The queries of all the actions and the additions of a whole episode
+        are each sent to the server as a single request, and the neighbors that a query returns are read from the
+        shared memory files of the server. Every thread has its own connection to the server, so that a background
+        DNDWriter does not hold back the queries of the acting thread.
+
+        A neighbor that is replaced by another worker between the query and the read is read with its new key and
+        value, like a query that ran a moment later.
+
+        :param address: the 'host:port' of the server
+        :param authkey: the key to authenticate with
+        :param dict_size: the size of each action dictionary
+        :param key_width: the width of the keys
+        :param num_actions: the number of actions
+        :param connection_timeout: the time in seconds to wait for the server to start
+        :param dnd_parameters: the rest of the QDND parameters, which are used if the server creates the dictionary
+        """
+        self.address = parse_address(address)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.connection_timeout = connection_timeout
+        self.num_actions = num_actions
+        self.connections = threading.local()
+        self.enough_entries_k = None
+
+        dnd_parameters.update({'dict_size': dict_size, 'key_width': int(key_width), 'num_actions': num_actions})
+        storage = self._call('create', dnd_parameters)
+        self.embeddings = [np.memmap(embeddings_path, dtype=np.float32, mode='r', shape=shape)
+                           for embeddings_path, _, shape in storage]
+        self.values = [np.memmap(values_path, dtype=np.float32, mode='r', shape=shape[:1])
+                       for _, values_path, shape in storage]
+
+    def _connection(self):
+        if not hasattr(self.connections, 'connection'):
+            start_time = time.time()
+            while True:
+                try:
+                    self.connections.connection = Client(self.address, authkey=self.authkey)
+                    break
+                except ConnectionRefusedError:
+                    # the server may still be starting
+                    if time.time() - start_time > self.connection_timeout:
+                        raise
+                    time.sleep(0.1)
+        return self.connections.connection
+
+    def _call(self, command, *args):
+        connection = self._connection()
+        connection.send((command, args))
+        status, result = connection.recv()
+        if status == 'error':
+            raise result
+        return result
+
+    def add(self, embeddings, actions, values):
+        return self._call('add', np.asarray(embeddings, dtype=np.float32), np.asarray(actions), np.asarray(values))
+
+    def query(self, embeddings, action, k):
+        embeddings, values, indices = self.query_all(embeddings, k)
+        return embeddings[action], values[action], indices[action]
+
+    def query_all(self, embeddings, k):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        indices = self._call('query_all_indices', embeddings, k)
+        if indices is None:
+            # the DND is not populated with enough entries yet. these values won't be used.
+            return np.zeros((self.num_actions, len(embeddings), k, embeddings.shape[1]), dtype=np.float32), \
+                np.zeros((self.num_actions, len(embeddings), k), dtype=np.float32), \
+                np.zeros((self.num_actions, len(embeddings), k), dtype=np.int64)
+        return np.stack([self.embeddings[a][indices[a]] for a in range(self.num_actions)]), \
+            np.stack([self.values[a][indices[a]] for a in range(self.num_actions)]), \
+            indices
+
+    def has_enough_entries(self, k):
+        # entries are never removed, so once there are enough of them the server does not need to be asked again
+        if self.enough_entries_k is not None and k <= self.enough_entries_k:
+            return True
+        if self._call('has_enough_entries', k):
+            self.enough_entries_k = k
+            return True
+        return False
+
+    def save(self, directory):
+        self._call('save', directory)
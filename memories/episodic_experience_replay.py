@@ -30,13 +30,22 @@ class EpisodicExperienceReplay(Memory):
         self.max_size_in_episodes = tuning_parameters.agent.num_episodes_in_experience_replay
         self.max_size_in_transitions = tuning_parameters.agent.num_transitions_in_experience_replay
         self.discount = tuning_parameters.agent.discount
-        self.buffer = [Episode()]  # list of episodes
+        self.columnar_episodes = tuning_parameters.agent.store_episodes_in_arrays
+        self.buffer = [self._new_episode()]  # list of episodes
         self.transitions = []
         self._length = 1
         self._num_transitions = 0
         self._num_transitions_in_complete_episodes = 0
+        # the index (in the concatenation of all the stored episodes) where each stored episode ends. it is updated
+        # when episodes are stored or removed, so sampling from the columnar episodes does not recalculate it.
+        self._episodes_end_idx = np.zeros(0, dtype=np.int64)
         self.return_is_bootstrapped = tuning_parameters.agent.bootstrap_total_return_from_old_policy
 
+    def _new_episode(self):
+        if self.columnar_episodes:
+            return ColumnarEpisode()
+        return Episode()
+
     def length(self):
         """ Get the number of episodes in the ER (even if they are not complete) """
         if self._length is not 0 and self.buffer[-1].is_empty():
@@ -80,11 +89,46 @@ class EpisodicExperienceReplay(Memory):
                 .format(self.num_transitions_in_complete_episodes(), size)
         batch = []
         transitions_idx = np.random.randint(self.num_transitions_in_complete_episodes(), size=size)
+        if self.columnar_episodes:
+            # the transitions are kept only inside the episodes, so each index is mapped to its episode
+            episodes_end_idx = self._episodes_end_idx
+            episodes_idx = np.searchsorted(episodes_end_idx, transitions_idx, side='right')
+            for episode_idx, i in zip(episodes_idx, transitions_idx):
+                episode_start_idx = episodes_end_idx[episode_idx] - self.buffer[episode_idx].length()
+                batch.append(self.buffer[episode_idx].get_transition(i - episode_start_idx))
+            return batch
+
         for i in transitions_idx:
             batch.append(self.transitions[i])
 
         return batch
 
+    def sample_sequences(self, num_sequences, sequence_length, burn_in=0):
+        """
+        Sample contiguous sequences of transitions for training a recurrent network. Each sequence is contained in a
+        single complete episode and starts with burn_in transitions that only warm up the recurrent state.
+        :param num_sequences: The number of sequences to sample
+        :param sequence_length: The number of trained transitions in each sequence
+        :param burn_in: The number of transitions that precede the trained transitions of each sequence
+        :return: a TransitionBatch of num_sequences * (burn_in + sequence_length) transitions, sequence after sequence
+        """
+        total_length = burn_in + sequence_length
+        episodes = self.buffer[:self.num_complete_episodes()]
+        episodes_idx, offsets = sample_sequence_starts([episode.length() for episode in episodes],
+                                                       num_sequences, total_length)
+        sequences = [episodes[episode_idx].get_batch(offset, offset + total_length)
+                     for episode_idx, offset in zip(episodes_idx, offsets)]
+        if self.columnar_episodes:
+            batch = TransitionBatch.concatenate(sequences)
+        else:
+            batch = TransitionBatch.from_transitions([transition for sequence in sequences for transition in sequence])
+        batch.set_sequences(total_length, burn_in)
+        return batch
+
+    def _add_episode_end_idx(self, episode_length):
+        last_end_idx = self._episodes_end_idx[-1] if len(self._episodes_end_idx) > 0 else 0
+        self._episodes_end_idx = np.append(self._episodes_end_idx, last_end_idx + episode_length)
+
     def enforce_length(self):
         # clean up if necessary
         if self.max_size_in_transitions is not None:
@@ -96,20 +140,22 @@ class EpisodicExperienceReplay(Memory):
 
     def store(self, transition):
         if len(self.buffer) == 0:
-            self.buffer.append(Episode())
+            self.buffer.append(self._new_episode())
         last_episode = self.buffer[-1]
         last_episode.insert(transition)
-        self.transitions.append(transition)
+        if not self.columnar_episodes:
+            self.transitions.append(transition)
         self._num_transitions += 1
         if transition.game_over:
             self._num_transitions_in_complete_episodes += last_episode.length()
+            self._add_episode_end_idx(last_episode.length())
             self._length += 1
             self.buffer[-1].update_returns(self.discount,
                                            is_bootstrapped=self.tp.agent.bootstrap_total_return_from_old_policy,
                                            n_step_return=self.tp.agent.n_step)
             self.buffer[-1].update_measurements_targets(self.tp.agent.num_predicted_steps_ahead)
             # self.buffer[-1].update_actions_probabilities() # used for off-policy policy optimization
-            self.buffer.append(Episode())
+            self.buffer.append(self._new_episode())
 
         self.enforce_length()
 
@@ -121,9 +167,11 @@ class EpisodicExperienceReplay(Memory):
         episode.update_returns(self.discount)
         episode.update_measurements_targets(self.tp.agent.num_predicted_steps_ahead)
         self.buffer.append(episode)
-        self.transitions += episode.transitions
+        if not self.columnar_episodes:
+            self.transitions += episode.transitions
         self._length += 1
         self._num_transitions += episode.length()
+        self._add_episode_end_idx(episode.length())
 
         self.enforce_length()
 
@@ -141,6 +189,9 @@ class EpisodicExperienceReplay(Memory):
             self._length -= 1
             self._num_transitions -= episode_length
             self._num_transitions_in_complete_episodes -= episode_length
+            if episode_index < len(self._episodes_end_idx):
+                self._episodes_end_idx = np.delete(self._episodes_end_idx, episode_index)
+                self._episodes_end_idx[episode_index:] -= episode_length
             del self.transitions[:episode_length]
             del self.buffer[episode_index]
 
@@ -165,12 +216,21 @@ class EpisodicExperienceReplay(Memory):
             if len(self.buffer) < 2:
                 return
             episode = self.buffer[-2]
-        for key, val in info.items():
-            episode.transitions[-1].info[key] = val
+        episode.update_last_transition_info(info)
+
+    def get_all_transitions(self):
+        """
+        Get all the transitions in the memory, including the transitions of the last episode if it is not complete
+        :return: a list of transitions, or a TransitionBatch if the episodes are stored in arrays
+        """
+        if not self.columnar_episodes:
+            return self.transitions
+        return TransitionBatch.concatenate([episode.get_batch() for episode in self.buffer if not episode.is_empty()])
 
     def clean(self):
         self.transitions = []
-        self.buffer = [Episode()]
+        self.buffer = [self._new_episode()]
         self._length = 1
         self._num_transitions = 0
         self._num_transitions_in_complete_episodes = 0
+        self._episodes_end_idx = np.zeros(0, dtype=np.int64)
@@ -15,8 +15,12 @@
 #
 
 import numpy as np
+import scipy.signal
 import copy
+import os
+import pickle
 from configurations import *
+from utils import Signal
 
 
 class Memory(object):
@@ -25,7 +29,8 @@ class Memory(object):
         :param tuning_parameters: A Preset class instance with all the running paramaters
         :type tuning_parameters: Preset
         """
-        pass
+        # signals of the memory that are logged by the agent
+        self.signals = []
 
     def store(self, obj):
         pass
@@ -42,6 +47,31 @@ class Memory(object):
     def clean(self):
         pass
 
+    def _saved_attributes(self):
+        # the parameters and the signals belong to the running agent, so they are not replaced when loading
+        return {name: value for name, value in self.__dict__.items()
+                if name != 'tp' and name != 'signals' and not isinstance(value, Signal)}
+
+    def save(self, directory):
+        """
+        Save the content of the memory into the given directory, so that it can be loaded back using load()
+        :param directory: the directory to save the memory into
+        :return: None
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'memory.p'), 'wb') as f:
+            pickle.dump(self._saved_attributes(), f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, directory):
+        """
+        Load the content of a memory that was saved using save()
+        :param directory: the directory that the memory was saved into
+        :return: None
+        """
+        with open(os.path.join(directory, 'memory.p'), 'rb') as f:
+            self.__dict__.update(pickle.load(f))
+
 
 class Episode(object):
     def __init__(self):
@@ -49,6 +79,14 @@ class Episode(object):
         # a num_transitions x num_transitions table with the n step return in the n'th row
         self.returns_table = None
         self._length = 0
+        self._init_segment_returns()
+
+    def _init_segment_returns(self):
+        # the returns are updated one segment at a time while the episode is in progress. the returns of each segment
+        # are truncated at the segment end until the segments are joined (see update_segment_returns)
+        self._returns_end_idx = 0
+        self._segments_start_idx = []
+        self._segments_discount = None
 
     def insert(self, transition):
         self.transitions.append(transition)
@@ -70,39 +108,69 @@ class Episode(object):
         return self.get_transition(0)
 
     def update_returns(self, discount, is_bootstrapped=False, n_step_return=-1):
-        if n_step_return == -1 or n_step_return > self.length():
-            n_step_return = self.length()
         rewards = np.array([t.reward for t in self.transitions])
-        rewards = rewards.astype('float')
-        total_return = rewards.copy()
-        current_discount = discount
-        for i in range(1, n_step_return):
-            total_return += current_discount * np.pad(rewards[i:], (0, i), 'constant', constant_values=0)
-            current_discount *= discount
-
-        # calculate the bootstrapped returns
-        bootstraps = np.array([np.squeeze(t.info['max_action_value']) for t in self.transitions[n_step_return:]])
-        bootstrapped_return = total_return + current_discount * np.pad(bootstraps, (0, n_step_return), 'constant',
-                                                                       constant_values=0)
+        bootstraps = None
         if is_bootstrapped:
-            total_return = bootstrapped_return
+            bootstraps = np.array([np.squeeze(t.info['max_action_value']) for t in self.transitions])
+        total_return = calculate_discounted_returns(rewards, discount, bootstraps, n_step_return)
 
         for transition_idx in range(self.length()):
             self.transitions[transition_idx].total_return = total_return[transition_idx]
+        self._returns_end_idx = self.length()
+        self._segments_start_idx = [0]
+
+    def update_segment_returns(self, discount):
+        """
+        Update the discounted returns of the transitions that were inserted since the last update, as if the episode
+        ends at its last transition. This only costs time for the new transitions - the returns of the earlier
+        transitions are missing the discounted return of the new segment, and it is added to them once, when the
+        returns are read through get_returns().
+        :param discount: the discount factor
+        :return: None
+        """
+        start_idx = self._returns_end_idx
+        if start_idx == self.length():
+            return
+        self._set_segment_returns(start_idx, self.length(),
+                                  calculate_discounted_returns(self._get_segment_rewards(start_idx, self.length()),
+                                                               discount))
+        self._segments_start_idx.append(start_idx)
+        self._segments_discount = discount
+        self._returns_end_idx = self.length()
+
+    def _join_segment_returns(self):
+        # the return at the start of each segment is propagated to the segment before it, from the last segment back
+        if len(self._segments_start_idx) < 2:
+            return
+        segments_end_idx = self._segments_start_idx[1:] + [self._returns_end_idx]
+        next_segment_return = 0
+        for start_idx, end_idx in reversed(list(zip(self._segments_start_idx, segments_end_idx))):
+            steps_to_segment_end = end_idx - np.arange(start_idx, end_idx)
+            returns = self._get_segment_returns(start_idx, end_idx) + \
+                self._segments_discount ** steps_to_segment_end * next_segment_return
+            self._set_segment_returns(start_idx, end_idx, returns)
+            next_segment_return = returns[0]
+        self._segments_start_idx = self._segments_start_idx[:1]
+
+    def _get_segment_rewards(self, start_idx, end_idx):
+        return np.array([t.reward for t in self.transitions[start_idx:end_idx]], dtype='float')
+
+    def _get_segment_returns(self, start_idx, end_idx):
+        return np.array([t.total_return for t in self.transitions[start_idx:end_idx]], dtype='float')
+
+    def _set_segment_returns(self, start_idx, end_idx, returns):
+        for transition, total_return in zip(self.transitions[start_idx:end_idx], returns):
+            transition.total_return = total_return
 
     def update_measurements_targets(self, num_steps):
         if 'measurements' not in self.transitions[0].state:
             return
-        measurements_size = self.transitions[0].state['measurements'].shape[-1]
+        measurements = np.array([transition.state['measurements'] for transition in self.transitions])
+        next_measurements = np.array([transition.next_state['measurements'] for transition in self.transitions])
+        future_measurements = calculate_future_measurements(measurements, next_measurements, num_steps)
         total_return = sum([transition.reward for transition in self.transitions])
-        for transition_idx, transition in enumerate(self.transitions):
-            transition.info['future_measurements'] = np.zeros((num_steps, measurements_size))
-            for step in range(num_steps):
-                offset_idx = transition_idx + 2 ** step
-                if offset_idx >= self.length():
-                    offset_idx = -1
-                transition.info['future_measurements'][step] = self.transitions[offset_idx].next_state['measurements'] - \
-                                                               transition.state['measurements']
+        for transition, transition_future_measurements in zip(self.transitions, future_measurements):
+            transition.info['future_measurements'] = transition_future_measurements
             transition.info['total_episode_return'] = total_return
 
     def update_actions_probabilities(self):
@@ -117,6 +185,7 @@ class Episode(object):
         return self.returns_table
 
     def get_returns(self):
+        self._join_segment_returns()
         return self.get_transitions_attribute('total_return')
 
     def get_transitions_attribute(self, attribute_name):
@@ -131,6 +200,303 @@ class Episode(object):
             batch.append(self.get_transition(i))
         return batch
 
+    def get_batch(self, start_idx=0, end_idx=None):
+        """
+        Get the transitions in the range [start_idx, end_idx) of the episode
+        :param start_idx: the index of the first transition
+        :param end_idx: the index after the last transition. defaults to the episode length
+        :return: a list of transitions
+        """
+        return self.transitions[start_idx:end_idx]
+
+    def update_last_transition_info(self, info):
+        for key, val in info.items():
+            self.transitions[-1].info[key] = val
+
+
+class ColumnarEpisode(Episode):
+    def __init__(self, initial_capacity=64):
+        """
+        An episode which stores its transitions in growable numpy arrays (one array per transition element) instead
+        of a list of Transition objects. The arrays double their size whenever they are full, so inserting a
+        transition takes amortized constant time, and any range of transitions can be read as a TransitionBatch
+        of array views without copying.
+
+        :param initial_capacity: The number of transitions to allocate the arrays for before the first growth
+        """
+        # the transitions are not kept as objects, so Episode.__init__ is not called
+        self.returns_table = None
+        self._length = 0
+        self._capacity = initial_capacity
+        self.states = {}
+        self.next_states = {}
+        self.info = {}
+        self.actions = None
+        self.rewards = np.zeros(initial_capacity)
+        self.game_overs = np.zeros(initial_capacity, dtype=np.bool_)
+        self.total_returns = np.zeros(initial_capacity)
+        self._init_segment_returns()
+
+    @property
+    def transitions(self):
+        # slow path for code that still iterates over transitions. changes to these transitions are not stored.
+        return [self.get_transition(i) for i in range(self.length())]
+
+    def _allocate_column(self, value):
+        dtype = value.dtype if value.dtype.kind in 'biuf' else object
+        return np.zeros((self._capacity,) + value.shape, dtype=dtype)
+
+    def _store_in_columns(self, columns, values, idx):
+        for key, value in values.items():
+            value = np.asarray(value)
+            if key not in columns:
+                columns[key] = self._allocate_column(value)
+            columns[key][idx] = value
+
+    def _grow(self):
+        def grow(column):
+            grown_column = np.zeros((2 * self._capacity,) + column.shape[1:], dtype=column.dtype)
+            grown_column[:self._capacity] = column
+            return grown_column
+
+        for columns in [self.states, self.next_states, self.info]:
+            for key in columns.keys():
+                columns[key] = grow(columns[key])
+        self.actions = grow(self.actions)
+        self.rewards = grow(self.rewards)
+        self.game_overs = grow(self.game_overs)
+        self.total_returns = grow(self.total_returns)
+        self._capacity *= 2
+
+    def insert(self, transition):
+        if self._length == self._capacity:
+            self._grow()
+
+        idx = self._length
+        self._store_in_columns(self.states, transition.state, idx)
+        self._store_in_columns(self.next_states, transition.next_state, idx)
+        self._store_in_columns(self.info, transition.info, idx)
+        action = np.asarray(transition.action)
+        if self.actions is None:
+            self.actions = self._allocate_column(action)
+        self.actions[idx] = action
+        self.rewards[idx] = transition.reward
+        self.game_overs[idx] = transition.game_over
+        if transition.total_return is not None:
+            self.total_returns[idx] = transition.total_return
+        self._length += 1
+
+    def get_batch(self, start_idx=0, end_idx=None):
+        """
+        Get the transitions in the range [start_idx, end_idx) of the episode. The arrays of the batch are views of
+        the episode arrays.
+        :param start_idx: the index of the first transition
+        :param end_idx: the index after the last transition. defaults to the episode length
+        :return: a TransitionBatch
+        """
+        end_idx = self._length if end_idx is None else min(end_idx, self._length)
+        rows = slice(start_idx, end_idx)
+        return TransitionBatch(
+            states={k: v[rows] for k, v in self.states.items()},
+            next_states={k: v[rows] for k, v in self.next_states.items()},
+            actions=self.actions[rows],
+            rewards=self.rewards[rows],
+            game_overs=self.game_overs[rows],
+            total_returns=self.total_returns[rows],
+            info={k: v[rows] for k, v in self.info.items()}
+        )
+
+    def to_batch(self):
+        return self.get_batch()
+
+    def get_transition(self, transition_idx):
+        return self.get_batch()[transition_idx]
+
+    def update_last_transition_info(self, info):
+        self._store_in_columns(self.info, info, self._length - 1)
+
+    def _set_info_column(self, key, values):
+        values = np.asarray(values)
+        if key not in self.info or self.info[key].shape[1:] != values.shape[1:]:
+            self.info[key] = self._allocate_column(values[0])
+        self.info[key][:self._length] = values
+
+    def update_returns(self, discount, is_bootstrapped=False, n_step_return=-1):
+        bootstraps = None
+        if is_bootstrapped:
+            bootstraps = self.info['max_action_value'][:self._length].reshape(self._length)
+        self.total_returns[:self._length] = calculate_discounted_returns(self.rewards[:self._length], discount,
+                                                                         bootstraps, n_step_return)
+        self._returns_end_idx = self._length
+        self._segments_start_idx = [0]
+
+    def _get_segment_rewards(self, start_idx, end_idx):
+        return self.rewards[start_idx:end_idx]
+
+    def _get_segment_returns(self, start_idx, end_idx):
+        return self.total_returns[start_idx:end_idx]
+
+    def _set_segment_returns(self, start_idx, end_idx, returns):
+        self.total_returns[start_idx:end_idx] = returns
+
+    def update_measurements_targets(self, num_steps):
+        if 'measurements' not in self.states:
+            return
+        self._set_info_column('future_measurements',
+                              calculate_future_measurements(self.states['measurements'][:self._length],
+                                                            self.next_states['measurements'][:self._length],
+                                                            num_steps))
+        self._set_info_column('total_episode_return',
+                              np.full(self._length, np.sum(self.rewards[:self._length])))
+
+    def update_actions_probabilities(self):
+        probability_product = 1
+        if 'action_probabilities' in self.info.keys():
+            probability_product = np.prod(self.info['action_probabilities'][:self._length], axis=0)
+        self._set_info_column('probability_product', [probability_product] * self._length)
+
+    def get_returns(self):
+        self._join_segment_returns()
+        return self.total_returns[:self._length]
+
+    def get_transitions_attribute(self, attribute_name):
+        columns = {'action': self.actions, 'reward': self.rewards, 'game_over': self.game_overs,
+                   'total_return': self.total_returns}
+        if attribute_name in columns.keys():
+            return columns[attribute_name][:self._length]
+        return Episode.get_transitions_attribute(self, attribute_name)
+
+
+class TransitionBatch(object):
+    def __init__(self, states, next_states, actions, rewards, game_overs, total_returns, info=None, indices=None,
+                 importance_weights=None):
+        """
+        A batch of transitions stored as one array per transition element instead of a list of Transition objects.
+        Memories that keep their transitions in arrays return this from sample() so that the batch does not need to
+        be assembled one transition at a time.
+
+        :param states: A dictionary of state arrays, each with a leading batch axis
+        :param next_states: A dictionary of next state arrays, each with a leading batch axis
+        :param actions: An array of the actions taken
+        :param rewards: An array of the rewards received
+        :param game_overs: An array of the game over flags
+        :param total_returns: An array of the total (discounted) returns
+        :param info: A dictionary of arrays holding the transitions info fields
+        :param indices: The indices of the transitions in the memory they were sampled from (optional)
+        :param importance_weights: The importance sampling weights of the transitions, for memories that do not
+                                   sample uniformly (optional)
+        """
+        self.states = states
+        self.next_states = next_states
+        self.actions = actions
+        self.rewards = rewards
+        self.game_overs = game_overs
+        self.total_returns = total_returns
+        self.info = info if info is not None else {}
+        self.indices = indices
+        self.importance_weights = importance_weights
+
+        # for batches of contiguous sequences (see sample_sequences) - the length of each sequence, including its
+        # first burn_in transitions
+        self.sequence_length = None
+        self.burn_in = 0
+
+        # for batches whose returns are calculated on sample (see calculate_returns_on_sample) - the index of the
+        # transition whose next state is the bootstrap state, the bootstrap state itself, and the discount of the
+        # bootstrap value
+        self.bootstrap_indices = None
+        self.bootstrap_next_states = None
+        self.bootstrap_discounts = None
+
+        # for batches that were prepared by the batch prefetcher - the arrays returned by the agent's extract_batch
+        self.extracted = None
+
+    def __len__(self):
+        return len(self.rewards)
+
+    def set_sequences(self, sequence_length, burn_in=0):
+        """
+        Mark the batch as a concatenation of contiguous sequences of sequence_length transitions each. The first
+        burn_in transitions of each sequence are only used for warming up the recurrent state, so their importance
+        weight is set to 0.
+        :param sequence_length: The number of transitions in each sequence, including the burn in transitions
+        :param burn_in: The number of burn in transitions at the start of each sequence
+        :return: None
+        """
+        self.sequence_length = sequence_length
+        self.burn_in = burn_in
+        if burn_in > 0:
+            mask = np.tile(np.arange(sequence_length) >= burn_in, len(self) // sequence_length).astype(np.float32)
+            self.importance_weights = mask if self.importance_weights is None else self.importance_weights * mask
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return TransitionBatch({k: v[item] for k, v in self.states.items()},
+                                   {k: v[item] for k, v in self.next_states.items()},
+                                   self.actions[item], self.rewards[item], self.game_overs[item],
+                                   self.total_returns[item], {k: v[item] for k, v in self.info.items()},
+                                   None if self.indices is None else self.indices[item],
+                                   None if self.importance_weights is None else self.importance_weights[item])
+
+        # slow path for code that still iterates over transitions
+        transition = Transition({k: v[item] for k, v in self.states.items()}, self.actions[item], self.rewards[item],
+                                {k: v[item] for k, v in self.next_states.items()}, self.game_overs[item])
+        transition.total_return = self.total_returns[item]
+        transition.info = {k: v[item] for k, v in self.info.items()}
+        return transition
+
+    @staticmethod
+    def from_transitions(transitions):
+        """
+        Gather a list of transitions into a batch
+        :param transitions: a list of Transition objects
+        :return: a TransitionBatch
+        """
+        def stack(values):
+            try:
+                return np.array([np.array(value) for value in values])
+            except ValueError:
+                # elements with different shapes are kept as objects
+                stacked_values = np.empty(len(values), dtype=object)
+                stacked_values[:] = values
+                return stacked_values
+
+        def stack_columns(dicts):
+            # only the elements that all the transitions have are kept
+            return {k: stack([d[k] for d in dicts]) for k in dicts[0].keys() if all(k in d for d in dicts)}
+
+        return TransitionBatch(
+            states=stack_columns([t.state for t in transitions]),
+            next_states=stack_columns([t.next_state for t in transitions]),
+            actions=np.array([t.action for t in transitions]),
+            rewards=np.array([t.reward for t in transitions]),
+            game_overs=np.array([t.game_over for t in transitions]),
+            total_returns=np.array([t.total_return for t in transitions]),
+            info=stack_columns([t.info for t in transitions])
+        )
+
+    @staticmethod
+    def concatenate(batches):
+        """
+        Concatenate several batches with the same transition elements into a single batch
+        :param batches: a list of TransitionBatch
+        :return: a TransitionBatch
+        """
+        def concatenate_columns(columns):
+            # only the elements that all the batches have are kept
+            return {k: np.concatenate([c[k] for c in columns]) for k in columns[0].keys()
+                    if all(k in c for c in columns)}
+
+        return TransitionBatch(
+            states=concatenate_columns([b.states for b in batches]),
+            next_states=concatenate_columns([b.next_states for b in batches]),
+            actions=np.concatenate([b.actions for b in batches]),
+            rewards=np.concatenate([b.rewards for b in batches]),
+            game_overs=np.concatenate([b.game_overs for b in batches]),
+            total_returns=np.concatenate([b.total_returns for b in batches]),
+            info=concatenate_columns([b.info for b in batches])
+        )
+
 
 class Transition(object):
     def __init__(self, state, action, reward=0, next_state=None, game_over=False):
@@ -159,3 +525,74 @@ class Transition(object):
         self.next_state = next_state
         self.game_over = game_over
         self.info = {}
+
+
+def calculate_discounted_returns(rewards, discount, bootstraps=None, n_step_return=-1):
+    """
+    Calculates the n-step discounted return for each step of a single episode
+    :param rewards: The rewards of the episode
+    :param discount: The discount factor
+    :param bootstraps: Optional values to bootstrap from for each step of the episode (e.g. the max action value).
+                       The return of step i is bootstrapped from the value of step i + n_step_return.
+    :param n_step_return: The number of steps to sum. -1 stands for the full episode return.
+    :return: An array with the discounted return for each step
+    """
+    num_steps = len(rewards)
+    if n_step_return == -1 or n_step_return > num_steps:
+        n_step_return = num_steps
+    rewards = np.asarray(rewards).astype('float')
+    if num_steps == 0:
+        return rewards
+
+    if n_step_return == num_steps:
+        # the full discounted return is a first order recursive filter running backwards over the rewards:
+        # G_t = r_t + discount * G_t+1
+        total_return = scipy.signal.lfilter([1], [1, -discount], rewards[::-1])[::-1]
+    else:
+        # the n step return is a finite filter with the weights discount^k for k < n, running backwards over the
+        # rewards. the window is summed directly rather than taken as a difference of two full returns, which loses
+        # the precision of the short returns next to large ones.
+        window = discount ** np.arange(n_step_return)
+        total_return = scipy.signal.lfilter(window, [1], rewards[::-1])[::-1]
+    current_discount = discount ** n_step_return
+
+    # calculate the bootstrapped returns
+    if bootstraps is not None:
+        bootstraps = np.asarray(bootstraps).astype('float')
+        total_return[:num_steps - n_step_return] += current_discount * bootstraps[n_step_return:]
+
+    return total_return
+
+
+def calculate_future_measurements(measurements, next_measurements, num_steps):
+    """
+    Calculates the DFP targets for each step of a single episode - the difference between the measurements of the
+    step and the measurements 2^j steps later (or at the end of the episode), for each j in [0, num_steps)
+    :param measurements: The measurements of the states of the episode
+    :param next_measurements: The measurements of the next states of the episode
+    :param num_steps: The number of future steps to predict
+    :return: An array of shape (episode length, num_steps, measurements size)
+    """
+    episode_length = len(measurements)
+    future_steps = np.arange(episode_length)[:, np.newaxis] + 2 ** np.arange(num_steps)[np.newaxis, :]
+    future_steps = np.minimum(future_steps, episode_length - 1)
+    return np.asarray(next_measurements, dtype='float')[future_steps] - \
+        np.asarray(measurements, dtype='float')[:, np.newaxis, :]
+
+
+def sample_sequence_starts(episode_lengths, num_sequences, sequence_length):
+    """
+    Uniformly samples the start of contiguous sequences of transitions, such that each sequence is contained in a
+    single episode. Episodes that are shorter than the sequence length are never sampled.
+    :param episode_lengths: The lengths of the episodes to sample from
+    :param num_sequences: The number of sequences to sample
+    :param sequence_length: The number of transitions in each sequence
+    :return: The index of the episode of each sequence, and the index of the sequence start inside its episode
+    """
+    num_starts = np.maximum(np.asarray(episode_lengths, dtype=np.int64) - sequence_length + 1, 0)
+    episodes_end_idx = np.cumsum(num_starts)
+    assert len(episodes_end_idx) > 0 and episodes_end_idx[-1] > 0, \
+        'There are no complete episodes with at least {} transitions in the memory'.format(sequence_length)
+    starts_idx = np.random.randint(episodes_end_idx[-1], size=num_sequences)
+    episodes_idx = np.searchsorted(episodes_end_idx, starts_idx, side='right')
+    return episodes_idx, starts_idx - (episodes_end_idx[episodes_idx] - num_starts[episodes_idx])
@@ -0,0 +1,148 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+from memories.array_experience_replay import *
+
+
+class MemoryMappedExperienceReplay(ArrayExperienceReplay):
+    # the paged columns are allocated again in the paging directory of the running process when loading
+    transient_attributes = ArrayExperienceReplay.transient_attributes + ['paging_dir', 'paged_columns']
+
+    def __init__(self, tuning_parameters):
+        """
+        An array based experience replay where the state columns (the observations and the deduplicated frames) are
+        stored in np.memmap files, so that the operating system pages them to and from the disk as needed. Only the
+        buffer indices and the small per transition elements (actions, rewards, info, etc.) are kept in RAM.
+
+        The buffer files are placed in agent.replay_buffer_paging_dir (or in the experiment directory if it is not
+        set). Calling flush() writes the in RAM part of the buffer next to the files, and a memory that is created
+        in a directory which holds a flushed buffer continues from where the flushed buffer stopped.
+
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        self.paging_dir = tuning_parameters.agent.replay_buffer_paging_dir
+        if self.paging_dir is None:
+            self.paging_dir = os.path.join(tuning_parameters.experiment_path, 'replay_buffer')
+        if not os.path.exists(self.paging_dir):
+            os.makedirs(self.paging_dir)
+        self.paged_columns = {}
+
+        ArrayExperienceReplay.__init__(self, tuning_parameters)
+        assert self.compression is None, 'MemoryMappedExperienceReplay does not support replay buffer compression'
+
+        if os.path.exists(self._index_path()):
+            self.restore()
+
+    def _index_path(self):
+        return os.path.join(self.paging_dir, 'index.npz')
+
+    def _column_path(self, name):
+        return os.path.join(self.paging_dir, name.replace('/', '_') + '.dat')
+
+    @staticmethod
+    def _is_paged(name, dtype):
+        return np.dtype(dtype) != object and \
+            (name.startswith('state/') or name.startswith('next_state/') or name == 'frames')
+
+    def _allocate_column(self, name, shape, dtype, length=None):
+        if not self._is_paged(name, dtype):
+            return ArrayExperienceReplay._allocate_column(self, name, shape, dtype, length)
+
+        length = self.capacity if length is None else length
+        shape = (length,) + tuple(shape)
+        path = self._column_path(name)
+
+        # reuse an existing file only if it matches the requested column exactly
+        expected_size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        mode = 'r+' if os.path.exists(path) and os.path.getsize(path) == expected_size else 'w+'
+        column = np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+        self.paged_columns[name] = column
+        return column
+
+    def flush(self):
+        """
+        Write the paged columns to the disk, and save the buffer indices and the in RAM columns next to them
+        :return: None
+        """
+        # the next frame of the last transition may still be waiting for the next store. it is kept separately so
+        # that the buffer is complete on the disk.
+        if self.deduplicate_frames and self._last_next_frame is not None:
+            self.frames[self.capacity + self._last_slot] = self._last_next_frame
+            self.has_separate_next_frame[self._last_slot] = True
+
+        for column in self.paged_columns.values():
+            column.flush()
+
+        paged_columns = np.empty((len(self.paged_columns), 3), dtype=object)
+        for row, (name, column) in enumerate(self.paged_columns.items()):
+            paged_columns[row] = name, column.shape[1:], column.dtype.str
+
+        index = {
+            'head': self._head,
+            'size': self._size,
+            'episode_start': self._episode_start,
+            'open_episode_length': self._open_episode_length,
+            'complete_episodes': np.array(list(self._complete_episodes), dtype=np.int64).reshape(-1, 2),
+            'rewards': self.rewards,
+            'game_overs': self.game_overs,
+            'total_returns': self.total_returns,
+            'frame_positions': self.frame_positions,
+            'has_separate_next_frame': self.has_separate_next_frame,
+            'paged_columns': paged_columns,
+        }
+        if self.actions is not None:
+            index['action'] = self.actions
+        for key, value in self.info.items():
+            index['info/' + key] = value
+        np.savez(self._index_path(), **index)
+
+    def restore(self):
+        """
+        Load a buffer that was previously flushed to the paging directory
+        :return: None
+        """
+        index = np.load(self._index_path(), allow_pickle=True)
+        assert len(index['rewards']) == self.capacity, \
+            'The replay buffer in {} has a capacity of {} transitions while the current capacity is {}'\
+            .format(self.paging_dir, len(index['rewards']), self.capacity)
+
+        self._head = int(index['head'])
+        self._size = int(index['size'])
+        self._episode_start = int(index['episode_start'])
+        self._open_episode_length = int(index['open_episode_length'])
+        self._complete_episodes = deque(tuple(episode) for episode in index['complete_episodes'].tolist())
+        self.rewards = index['rewards']
+        self.game_overs = index['game_overs']
+        self.total_returns = index['total_returns']
+        self.frame_positions = index['frame_positions']
+        self.has_separate_next_frame = index['has_separate_next_frame']
+        if 'action' in index:
+            self.actions = index['action']
+        for key in index.keys():
+            if key.startswith('info/'):
+                self.info[key[len('info/'):]] = index[key]
+
+        for name, shape, dtype in index['paged_columns']:
+            length = 2 * self.capacity if name == 'frames' else None
+            column = self._allocate_column(name, shape, np.dtype(dtype), length)
+            if name == 'frames':
+                self.frames = column
+            elif name.startswith('next_state/'):
+                self.next_states[name[len('next_state/'):]] = column
+            else:
+                self.states[name[len('state/'):]] = column
@@ -0,0 +1,188 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from memories.array_experience_replay import *
+
+
+class SegmentTree(object):
+    def __init__(self, capacity, operation, neutral_element):
+        """
+        A binary tree stored in an array, where each node holds the result of applying the operation on its two
+        children. Updating a batch of leaves and reducing over all the leaves are both O(log n) per leaf.
+
+        :param capacity: The number of leaves in the tree
+        :param operation: A numpy ufunc that is used to combine two nodes (e.g. np.add or np.minimum)
+        :param neutral_element: The value of an empty leaf for the given operation (e.g. 0 for sum)
+        """
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.operation = operation
+        self.neutral_element = neutral_element
+        self.tree = np.full(2 * self.size, neutral_element, dtype=np.float64)
+
+    def update(self, indices, values):
+        nodes = np.asarray(indices) + self.size
+        if len(nodes) == 0:
+            return
+        self.tree[nodes] = values
+        # all the leaves are in the same depth, so the parents are updated one level at a time
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.size]
+
+    def reduce(self):
+        return self.tree[1]
+
+    def find_prefix_sum_indices(self, prefix_sums):
+        """
+        For each prefix sum, find the highest leaf index i such that the sum of the leaves before i is smaller or equal
+        to the prefix sum. This is only meaningful for a sum tree with non-negative leaves.
+        :param prefix_sums: an array of values in the range [0, total sum)
+        :return: an array with the leaf index for each prefix sum
+        """
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        while nodes[0] < self.size:
+            left_sums = self.tree[2 * nodes]
+            right_sums = self.tree[2 * nodes + 1]
+            # never walk into an empty subtree, even if the prefix sum says so due to floating point errors
+            go_right = np.where(right_sums > 0, (prefix_sums >= left_sums) | (left_sums <= 0), False)
+            prefix_sums -= np.where(go_right, left_sums, 0)
+            nodes = 2 * nodes + go_right
+        return nodes - self.size
+
+
+# Prioritized Experience Replay - https://arxiv.org/abs/1511.05952
+class PrioritizedExperienceReplay(ArrayExperienceReplay):
+    def __init__(self, tuning_parameters):
+        """
+        An array based experience replay which samples transitions proportionally to their priority, where the
+        priority of a transition is its last absolute TD error. New transitions get the maximal priority seen so far.
+        Sampled batches include the importance sampling weights that correct the bias of the prioritized sampling.
+
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        ArrayExperienceReplay.__init__(self, tuning_parameters)
+        self.alpha = tuning_parameters.agent.prioritized_replay_alpha
+        self.initial_beta = tuning_parameters.agent.prioritized_replay_beta
+        self.beta_annealing_steps = tuning_parameters.agent.prioritized_replay_beta_annealing_steps
+        self.epsilon = tuning_parameters.agent.prioritized_replay_epsilon
+        self.num_sampled_batches = 0
+
+    def _set_priorities(self, indices, priorities):
+        priorities = np.power(priorities, self.alpha)
+        self.sum_tree.update(indices, priorities)
+        self.min_tree.update(indices, priorities)
+
+    def _clear_priorities(self, indices):
+        self.sum_tree.update(indices, np.zeros(len(indices)))
+        self.min_tree.update(indices, np.full(len(indices), np.inf))
+
+    def _clear_unsampleable_priorities(self):
+        # the oldest transitions whose stacked observations cannot be rebuilt must not be sampled
+        num_unsampleable = self._num_unsampleable_oldest_transitions()
+        if num_unsampleable > 0:
+            self._clear_priorities(self._episode_slots(self._tail(), num_unsampleable))
+
+    def _evict_oldest_transition(self):
+        self._clear_priorities([self._tail()])
+        ArrayExperienceReplay._evict_oldest_transition(self)
+        self._clear_unsampleable_priorities()
+
+    def store(self, transition):
+        ArrayExperienceReplay.store(self, transition)
+        if self.returns_on_sample and self._open_episode_length > self.n_step:
+            # when the returns are calculated on sample, a transition of the open episode can be sampled once n
+            # transitions follow it
+            self._set_priorities([(self._head - self.n_step - 1) % self.capacity], [self.max_priority])
+            self._clear_unsampleable_priorities()
+
+    def _close_episode(self):
+        # the other transitions can be sampled only after their episode is complete
+        slots = self._episode_slots(self._episode_start, self._open_episode_length)
+        if self.returns_on_sample:
+            # the priorities of the transitions that n transitions followed before the last one were already set, and
+            # may have been updated since
+            slots = slots[max(self._open_episode_length - 1 - self.n_step, 0):]
+        ArrayExperienceReplay._close_episode(self)
+        self._set_priorities(slots, np.full(len(slots), self.max_priority))
+        self._clear_unsampleable_priorities()
+
+    def get_beta(self):
+        if self.beta_annealing_steps == 0:
+            return self.initial_beta
+        progress = min(1.0, self.num_sampled_batches / float(self.beta_annealing_steps))
+        return self.initial_beta + progress * (1.0 - self.initial_beta)
+
+    def sample(self, size):
+        num_transitions = self.num_transitions_available_for_sampling()
+        assert num_transitions > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested transitions: {}.'\
+                .format(num_transitions, size)
+
+        # stratified sampling - one sample from each of size equally weighted segments
+        total_priority = self.sum_tree.reduce()
+        prefix_sums = (np.arange(size) + np.random.uniform(size=size)) * total_priority / size
+        indices = self.sum_tree.find_prefix_sum_indices(prefix_sums)
+
+        # importance sampling weights, normalized by the maximal weight
+        beta = self.get_beta()
+        probabilities = self.sum_tree.get(indices) / total_priority
+        min_probability = self.min_tree.reduce() / total_priority
+        weights = np.power(num_transitions * probabilities, -beta) / np.power(num_transitions * min_probability, -beta)
+        self.num_sampled_batches += 1
+
+        batch = self.get_batch(indices)
+        batch.importance_weights = weights.astype(np.float32)
+        if self.returns_on_sample:
+            self.calculate_returns_on_sample(batch)
+        return batch
+
+    def update_priorities(self, indices, td_errors):
+        """
+        Update the priorities of the given transitions using their new TD errors
+        :param indices: the indices of the transitions in the buffer (as given in the sampled batch)
+        :param td_errors: the TD errors of the transitions
+        :return: None
+        """
+        indices = np.asarray(indices)
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)).reshape(len(indices)) + self.epsilon
+
+        # ignore transitions that were overwritten (or became unsampleable) since they were sampled
+        offsets = (indices - self._tail()) % self.capacity
+        num_unsampleable = self._num_unsampleable_oldest_transitions()
+        is_valid = (offsets >= num_unsampleable) & \
+                   (offsets < num_unsampleable + self.num_transitions_available_for_sampling())
+        indices, priorities = indices[is_valid], priorities[is_valid]
+        if len(indices) == 0:
+            return
+        self.max_priority = max(self.max_priority, np.max(priorities))
+        self._set_priorities(indices, priorities)
+
+    def clean(self):
+        ArrayExperienceReplay.clean(self)
+        self.sum_tree = SegmentTree(self.capacity, np.add, 0.0)
+        self.min_tree = SegmentTree(self.capacity, np.minimum, np.inf)
+        self.max_priority = 1.0
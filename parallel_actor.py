@@ -26,6 +26,8 @@ from logger import *
 from configurations import *
 from presets import *
 import shutil
+import signal
+from memories.dnd_server import DNDServer
 
 start_time = time.time()
 
@@ -40,7 +42,7 @@ if __name__ == "__main__":
                         default='',
                         type=str)
     parser.add_argument('--job_name',
-                        help="(string) One of 'ps', 'worker'",
+                        help="(string) One of 'ps', 'worker', 'dnd'",
                         default='',
                         type=str)
     parser.add_argument('--load_json_path',
@@ -64,6 +66,21 @@ if __name__ == "__main__":
                                  config=tf.ConfigProto())#device_filters=["/job:ps"]))
         server.join()
 
+    elif args.job_name == "dnd":
+        # serve the DND that is shared by all the workers
+        tuning_parameters = json_to_preset(args.load_json_path)
+        if tuning_parameters.checkpoint_restore_dir:
+            save_model_dir = tuning_parameters.checkpoint_restore_dir
+        else:
+            save_model_dir = tuning_parameters.experiment_path
+        server = DNDServer(tuning_parameters.agent.dnd_server_address, tuning_parameters.agent.dnd_server_authkey,
+                           checkpoint_restore_dir=tuning_parameters.checkpoint_restore_dir,
+                           save_model_dir=save_model_dir, save_model_sec=tuning_parameters.save_model_sec)
+
+        # exit through the cleanup of the server when terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server.serve_forever()
+
     elif args.job_name == "worker":
         # get tuning parameters
         tuning_parameters = json_to_preset(args.load_json_path)
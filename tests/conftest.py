@@ -0,0 +1,42 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configurations import DQN, Preset, GymVectorObservation, ExplorationParameters
+
+
+@pytest.fixture
+def make_tuning_parameters():
+    """
+    The agent and environment parameters of a preset are classes, so the overrides are set on subclasses that are
+    created for each test instead of on the shared parameter classes
+    """
+    def _make_tuning_parameters(agent=DQN, env=GymVectorObservation, **overrides):
+        agent_overrides = {k: v for k, v in overrides.items() if hasattr(agent, k)}
+        env_overrides = {k: v for k, v in overrides.items() if not hasattr(agent, k) and hasattr(env, k)}
+        general_overrides = {k: v for k, v in overrides.items() if k not in agent_overrides and k not in env_overrides}
+        tuning_parameters = Preset(type('TestAgent', (agent,), agent_overrides),
+                                   type('TestEnvironment', (env,), env_overrides), ExplorationParameters)
+        for k, v in general_overrides.items():
+            setattr(tuning_parameters, k, v)
+        return tuning_parameters
+    return _make_tuning_parameters
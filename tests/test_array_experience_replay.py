@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import deque
+
+import numpy as np
+import pytest
+
+from agents.td_targets import n_step_targets
+from memories.array_experience_replay import ArrayExperienceReplay
+from memories.memory import Transition
+from utils import LazyStack
+
+
+def store_episodes(memory, episode_lengths, open_episode_length=0, seed=0):
+    """
+    Store episodes whose observation is the global step number, and return the reward and game over of each step
+    """
+    random = np.random.RandomState(seed)
+    rewards, game_overs = [], []
+    step = 0
+    for episode_idx, length in enumerate(list(episode_lengths) + [open_episode_length]):
+        is_open_episode = episode_idx == len(episode_lengths)
+        for i in range(length):
+            game_over = not is_open_episode and i == length - 1
+            reward = float(random.randint(-3, 4))
+            transition = Transition({'observation': np.array([step], dtype=np.float32)}, 0, reward,
+                                    {'observation': np.array([step + 1], dtype=np.float32)}, game_over)
+            memory.store(transition)
+            rewards.append(reward)
+            game_overs.append(game_over)
+            step += 1
+    return np.array(rewards), np.array(game_overs)
+
+
+def expected_n_step_return(rewards, game_overs, step, n_step, discount):
+    """ The n-step return of a step, the step whose next state is bootstrapped from, and the bootstrap discount """
+    total_return = 0
+    for i in range(n_step):
+        total_return += discount ** i * rewards[step + i]
+        if game_overs[step + i]:
+            return total_return, step + i, 0
+    return total_return, step + n_step - 1, discount ** n_step
+
+
+def test_returns_calculated_on_sample_match_the_n_step_windows(make_tuning_parameters):
+    n_step, discount = 3, 0.9
+    memory = ArrayExperienceReplay(make_tuning_parameters(
+        num_transitions_in_experience_replay=100, calculate_returns_on_sample=True, n_step=n_step,
+        discount=discount))
+    rewards, game_overs = store_episodes(memory, [5, 2, 7], open_episode_length=6)
+
+    # the open episode transitions are sampleable once n transitions follow them
+    assert memory.num_transitions_available_for_sampling() == 14 + 6 - n_step
+
+    np.random.seed(1)
+    batch = memory.sample(16)
+    steps = batch.states['observation'][:, 0].astype(np.int64)
+    assert np.all(steps < 14 + 6 - n_step)
+    for i, step in enumerate(steps):
+        total_return, bootstrap_step, bootstrap_discount = expected_n_step_return(rewards, game_overs, step, n_step,
+                                                                                  discount)
+        assert np.isclose(batch.total_returns[i], total_return)
+        assert np.isclose(batch.bootstrap_discounts[i], bootstrap_discount)
+        assert batch.bootstrap_next_states['observation'][i, 0] == bootstrap_step + 1
+
+
+def test_n_step_targets_bootstrap_each_transition_with_its_own_discount(make_tuning_parameters):
+    n_step, discount = 2, 0.5
+    memory = ArrayExperienceReplay(make_tuning_parameters(
+        num_transitions_in_experience_replay=100, calculate_returns_on_sample=True, n_step=n_step,
+        discount=discount))
+    rewards, game_overs = store_episodes(memory, [4, 4])
+    batch = memory.sample(6)
+
+    # a state value that is unique to each bootstrap state
+    bootstrap_values = 10.0 * batch.bootstrap_next_states['observation'][:, 0]
+    targets = n_step_targets(batch.total_returns, batch.bootstrap_discounts, bootstrap_values)
+
+    for i, step in enumerate(batch.states['observation'][:, 0].astype(np.int64)):
+        total_return, bootstrap_step, bootstrap_discount = expected_n_step_return(rewards, game_overs, step, n_step,
+                                                                                  discount)
+        assert np.isclose(targets[i], total_return + bootstrap_discount * 10.0 * (bootstrap_step + 1))
+
+
+def store_stacked_episodes(memory, episodes, stack_size, lazy_stacks):
+    """
+    Store episodes of stacked frames the way the agent stacks them, where the frame of each step is filled with a
+    unique frame number and the reward is the global step number. Each episode is given as its length and whether it
+    ends with a game over. Returns the stacked state and next state of each step.
+    """
+    states, next_states = [], []
+    frame_number = 0
+    for length, ends_with_game_over in episodes:
+        frame = np.full((2, 3), frame_number, dtype=np.uint8)
+        frame_number += 1
+        stack = deque([frame] * stack_size, maxlen=stack_size)
+        for i in range(length):
+            state = LazyStack(stack, -1)
+            stack.append(np.full((2, 3), frame_number, dtype=np.uint8))
+            frame_number += 1
+            next_state = LazyStack(stack, -1)
+            if not lazy_stacks:
+                state, next_state = np.array(state), np.array(next_state)
+            game_over = ends_with_game_over and i == length - 1
+            memory.store(Transition({'observation': state}, 0, float(len(states)), {'observation': next_state},
+                                    game_over))
+            states.append(np.array(state))
+            next_states.append(np.array(next_state))
+    return np.array(states), np.array(next_states)
+
+
+@pytest.mark.parametrize('lazy_stacks, compression', [(True, None), (False, None), (True, 'zlib')])
+def test_deduplicated_frames_are_stacked_back_after_wrapping_around(make_tuning_parameters, lazy_stacks, compression):
+    stack_size = 4
+    memory = ArrayExperienceReplay(make_tuning_parameters(
+        num_transitions_in_experience_replay=23, deduplicate_frames_in_replay_buffer=True,
+        replay_buffer_compression=compression, observation_stack_size=stack_size))
+    # the buffer wraps around several times, and one episode is cut without a game over
+    episodes = [(9, True), (2, True), (13, False), (1, True), (7, True), (11, True), (6, True), (5, False)]
+    states, next_states = store_stacked_episodes(memory, episodes, stack_size, lazy_stacks)
+
+    np.random.seed(0)
+    for _ in range(20):
+        batch = memory.sample(15)
+        steps = batch.rewards.astype(np.int64)
+        # only the transitions that are still in the buffer are sampled
+        assert np.all(steps >= len(states) - 23)
+        assert np.array_equal(batch.states['observation'], states[steps])
+        assert np.array_equal(batch.next_states['observation'], next_states[steps])
@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import types
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'contrib'):
+    pytest.skip('the networks are built with the TensorFlow 1 graph API', allow_module_level=True)
+
+from configurations import CategoricalDQN
+from architectures.tensorflow_components.heads import CategoricalQHead
+
+
+def project_distribution(distributions, rewards, game_overs, discount, z_values):
+    """ The categorical projection of the best next action distribution, one atom at a time """
+    delta_z = z_values[1] - z_values[0]
+    projected = np.zeros((len(rewards), len(z_values)))
+    for i in range(len(rewards)):
+        target_action = np.argmax(np.dot(distributions[i], z_values))
+        for j, z in enumerate(z_values):
+            tz = np.clip(rewards[i] + (1 - game_overs[i]) * discount * z, z_values[0], z_values[-1])
+            bj = (tz - z_values[0]) / delta_z
+            l, u = int(np.floor(bj)), int(np.ceil(bj))
+            if l == u:
+                projected[i, l] += distributions[i, target_action, j]
+            else:
+                projected[i, l] += distributions[i, target_action, j] * (u - bj)
+                projected[i, u] += distributions[i, target_action, j] * (bj - l)
+    return projected
+
+
+@pytest.fixture
+def head(make_tuning_parameters):
+    tuning_parameters = make_tuning_parameters(agent=CategoricalDQN, v_min=-2.0, v_max=2.0, atoms=5, discount=0.5)
+    tuning_parameters.env_instance = types.SimpleNamespace(action_space_size=2)
+    tf.reset_default_graph()
+    head = CategoricalQHead(tuning_parameters)
+    head(tf.placeholder(tf.float32, [None, 3]))
+    return head
+
+
+def test_projection_keeps_the_probability_of_updates_that_land_on_an_atom(head):
+    random = np.random.RandomState(0)
+    distributions = random.dirichlet(np.ones(5), size=(4, 2))
+    # a game over with no reward and a reward that shifts all the atoms by whole atoms land exactly on atoms, and
+    # the rest land between atoms or are clipped
+    rewards = np.array([0.0, 1.0, 0.3, 5.0])
+    game_overs = np.array([1.0, 0.0, 0.0, 0.0])
+    z_values = np.linspace(-2.0, 2.0, 5)
+
+    with tf.Session() as sess:
+        projected = sess.run(head._project_distribution(tf.range(4)), feed_dict={
+            head.distributions: distributions, head.rewards: rewards, head.game_overs: game_overs,
+            head.actions: np.zeros(4, dtype=np.int32)})
+
+    assert np.allclose(np.sum(projected, axis=1), 1.0)
+    assert np.allclose(projected, project_distribution(distributions, rewards, game_overs, 0.5, z_values))
@@ -0,0 +1,79 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import deque
+
+import numpy as np
+
+from memories.demonstrations import DemonstrationsWriter, read_demonstrations
+from memories.memory import Episode, Transition
+from utils import LazyStack
+
+
+def make_episode(first_frame_number, length, stack_size=3):
+    """ An episode whose frames are filled with consecutive frame numbers, with measurements and an info field """
+    episode = Episode()
+    stack = deque([np.full((2, 2), first_frame_number, dtype=np.uint8)] * stack_size, maxlen=stack_size)
+    for i in range(length):
+        state = {'observation': LazyStack(stack, -1), 'measurements': np.array([i, -i], dtype=np.float32)}
+        stack.append(np.full((2, 2), first_frame_number + i + 1, dtype=np.uint8))
+        next_state = {'observation': LazyStack(stack, -1), 'measurements': np.array([i + 1, -i - 1], dtype=np.float32)}
+        transition = Transition(state, i % 3, float(i), next_state, i == length - 1)
+        transition.info['max_action_value'] = 0.5 * i
+        episode.insert(transition)
+    return episode
+
+
+def assert_same_episode(transitions, expected_episode):
+    assert len(transitions) == expected_episode.length()
+    for transition, expected in zip(transitions, expected_episode.transitions):
+        for state, expected_state in [(transition.state, expected.state),
+                                      (transition.next_state, expected.next_state)]:
+            assert np.array_equal(np.array(state['observation']), np.array(expected_state['observation']))
+            assert np.array_equal(state['measurements'], expected_state['measurements'])
+        assert transition.action == expected.action
+        assert transition.reward == expected.reward
+        assert transition.game_over == expected.game_over
+        assert transition.info['max_action_value'] == expected.info['max_action_value']
+
+
+def test_demonstrations_file_recovers_from_a_partially_written_record(tmpdir):
+    path = str(tmpdir.join('demonstrations.bin'))
+    episodes = [make_episode(0, 5), make_episode(10, 1), make_episode(20, 7)]
+    writer = DemonstrationsWriter(path)
+    for episode in episodes:
+        writer.write_episode(episode)
+    writer.close()
+    assert [len(episode) for episode in read_demonstrations(path)] == [5, 1, 7]
+
+    # the recording crashed in the middle of the last record
+    with open(path, 'r+b') as f:
+        f.seek(0, 2)
+        f.truncate(f.tell() - 10)
+    read_episodes = list(read_demonstrations(path))
+    assert len(read_episodes) == 2
+    for transitions, expected_episode in zip(read_episodes, episodes):
+        assert_same_episode(transitions, expected_episode)
+
+    # a new recording drops the partial record and appends after the complete ones
+    new_episode = make_episode(30, 4)
+    writer = DemonstrationsWriter(path)
+    writer.write_episode(new_episode)
+    writer.close()
+    read_episodes = list(read_demonstrations(path))
+    assert len(read_episodes) == 3
+    for transitions, expected_episode in zip(read_episodes, episodes[:2] + [new_episode]):
+        assert_same_episode(transitions, expected_episode)
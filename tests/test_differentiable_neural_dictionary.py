@@ -0,0 +1,51 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+
+import numpy as np
+
+from memories.differentiable_neural_dictionary import LRUQueue
+
+
+def test_lru_queue_evicts_the_least_recently_used_slots():
+    random = np.random.RandomState(0)
+    size = 50
+    queue = LRUQueue(size)
+    # the reference order of the queued slots, from the least recently used
+    expected = OrderedDict()
+    for timestamp in range(2000):
+        if random.uniform() < 0.8:
+            slots = random.randint(size, size=random.randint(1, 20))
+            queue.touch(slots, timestamp)
+            # the slots of a single use are ordered by their number
+            for slot in np.unique(slots):
+                expected.pop(slot, None)
+                expected[slot] = timestamp
+        else:
+            num_slots = random.randint(1, 10)
+            evicted = queue.evict(num_slots)
+            expected_evicted = [expected.popitem(last=False)[0] for _ in range(min(num_slots, len(expected)))]
+            assert list(evicted) == expected_evicted
+
+        if timestamp % 100 == 0:
+            assert list(queue.ordered_slots()) == list(expected.keys())
+            assert np.array_equal(np.flatnonzero(queue.in_queue), np.sort(list(expected.keys())))
+
+    # the queue was compacted on the way, and keeps the last use time of each slot
+    assert queue.queue_length <= queue.compaction_factor * size + 1024
+    assert list(queue.ordered_slots()) == list(expected.keys())
+    assert np.array_equal(queue.timestamps[list(expected.keys())], list(expected.values()))
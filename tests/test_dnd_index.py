@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+
+from memories.dnd_index import DNDIndex, ExactDNDIndex, IVFDNDIndex, k_nearest_neighbors
+
+
+def brute_force_neighbors(keys, candidate_keys, k):
+    distances = np.linalg.norm(keys[:, np.newaxis, :] - candidate_keys[np.newaxis, :, :], axis=2)
+    neighbors = np.argsort(distances, axis=1)[:, :k]
+    return np.take_along_axis(distances, neighbors, axis=1), neighbors
+
+
+def test_k_nearest_neighbors_match_the_brute_force_search():
+    random = np.random.RandomState(0)
+    keys, candidate_keys = random.randn(20, 8), random.randn(300, 8)
+    for k in [1, 10, 300, 400]:
+        distances, neighbors = k_nearest_neighbors(keys, candidate_keys, k)
+        expected_distances, expected_neighbors = brute_force_neighbors(keys, candidate_keys, k)
+        assert np.array_equal(neighbors, expected_neighbors)
+        assert np.allclose(distances, expected_distances)
+
+
+def test_exact_index_merges_the_nearest_keys_of_all_the_blocks():
+    random = np.random.RandomState(0)
+    embeddings = random.randn(500, 8)
+    index = ExactDNDIndex(embeddings, block_size=64)
+    keys = random.randn(20, 8)
+    # less indexed keys than neighbors
+    index.add(np.arange(5))
+    distances, neighbors = index.search(keys, 10)
+    assert neighbors.shape == (20, 5)
+
+    index.add(np.arange(5, 450))
+    # overwritten keys are indexed again
+    embeddings[:100] = random.randn(100, 8)
+    index.add(np.arange(100))
+    assert index.num_searchable() == 450
+    distances, neighbors = index.search(keys, 10)
+    expected_distances, expected_neighbors = brute_force_neighbors(keys, embeddings[:450], 10)
+    assert np.array_equal(neighbors, expected_neighbors)
+    assert np.allclose(distances, expected_distances)
+
+
+def test_ivf_index_probing_all_the_lists_is_exact(tmpdir):
+    random = np.random.RandomState(0)
+    np.random.seed(0)
+    embeddings = random.randn(1000, 8)
+    index = IVFDNDIndex(embeddings, num_lists=16, num_probes=16)
+    keys = random.randn(20, 8)
+
+    # before the centroids are trained, the search goes over all the keys
+    index.add(np.arange(40))
+    index.rebuild()
+    assert index.centroids is None
+    _, neighbors = index.search(keys, 5)
+    assert np.array_equal(neighbors, brute_force_neighbors(keys, embeddings[:40], 5)[1])
+
+    index.add(np.arange(40, 800))
+    index.rebuild()
+    assert index.centroids is not None
+    # keys that are added, overwritten or removed after the training only change their lists
+    index.add(np.arange(800, 900))
+    embeddings[:100] = random.randn(100, 8)
+    index.add(np.arange(100))
+    index.remove(np.arange(100, 200))
+    indexed = np.append(np.arange(100), np.arange(200, 900))
+    assert index.num_searchable() == len(indexed)
+    assert np.array_equal(np.sort(index._indexed_slots()), indexed)
+
+    distances, neighbors = index.search(keys, 10)
+    expected_distances, expected_neighbors = brute_force_neighbors(keys, embeddings[indexed], 10)
+    assert np.array_equal(neighbors, indexed[expected_neighbors])
+    assert np.allclose(distances, expected_distances)
+
+    # the loaded index gives the same results without adding the keys again
+    directory = str(tmpdir.join('index'))
+    index.save(directory)
+    loaded_index = DNDIndex.load(directory, embeddings)
+    loaded_distances, loaded_neighbors = loaded_index.search(keys, 10)
+    assert np.array_equal(loaded_neighbors, neighbors)
+    assert np.allclose(loaded_distances, distances)
+
+
+def test_ivf_index_probes_enough_lists_for_k_neighbors():
+    random = np.random.RandomState(0)
+    np.random.seed(0)
+    embeddings = random.randn(600, 4)
+    index = IVFDNDIndex(embeddings, num_lists=64, num_probes=1)
+    index.add(np.arange(600))
+    index.rebuild()
+    distances, neighbors = index.search(random.randn(10, 4), 50)
+    assert neighbors.shape == (10, 50)
+    assert np.all(np.isfinite(distances))
+    assert all(len(np.unique(row)) == 50 for row in neighbors)
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import types
+
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'contrib'):
+    pytest.skip('the networks are built with the TensorFlow 1 graph API', allow_module_level=True)
+
+from configurations import NEC, Preset, GymVectorObservation, ExplorationParameters
+from architectures.tensorflow_components.heads import DNDQHead
+
+
+class SmallNEC(NEC):
+    dnd_size = 100
+    number_of_knn = 5
+    dnd_index_type = 'Exact'
+
+
+def build_nec_head(num_actions=3, key_width=8):
+    tuning_parameters = Preset(SmallNEC, GymVectorObservation, ExplorationParameters)
+    tuning_parameters.env_instance = types.SimpleNamespace(action_space_size=num_actions)
+    tf.reset_default_graph()
+    input_layer = tf.placeholder(tf.float32, [None, key_width])
+    head = DNDQHead(tuning_parameters)
+    head(input_layer)
+    return head
+
+
+def test_nec_head_builds_with_a_loss():
+    head = build_nec_head()
+    assert len(head.loss) == 1
+    assert len(head.target) == 1
+
+
+def test_nec_head_dnd_query_has_static_shapes():
+    head = build_nec_head(num_actions=3, key_width=8)
+    for action in range(3):
+        assert head.dnd_embeddings[action].shape.as_list() == [None, 5, 8]
+        assert head.dnd_values[action].shape.as_list() == [None, 5]
+        assert head.dnd_indices[action].shape.as_list() == [None, 5]
+    assert head.output[0].shape.as_list() == [None, 3]
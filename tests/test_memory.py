@@ -0,0 +1,49 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+
+from memories.memory import calculate_discounted_returns
+
+
+def direct_n_step_returns(rewards, discount, bootstraps, n_step):
+    returns = []
+    for step in range(len(rewards)):
+        window = rewards[step:step + n_step]
+        total_return = sum(discount ** k * reward for k, reward in enumerate(window))
+        if step + n_step < len(rewards):
+            total_return += discount ** n_step * bootstraps[step + n_step]
+        returns.append(total_return)
+    return np.array(returns)
+
+
+def test_n_step_returns_match_the_direct_sum():
+    random = np.random.RandomState(0)
+    rewards = random.randint(-3, 4, 30).astype('float')
+    bootstraps = random.randn(30)
+    for n_step in [1, 3, 29, 30, 50]:
+        np.testing.assert_allclose(calculate_discounted_returns(rewards, 0.9, bootstraps, n_step),
+                                   direct_n_step_returns(rewards, 0.9, bootstraps, n_step))
+    np.testing.assert_allclose(calculate_discounted_returns(rewards, 0.9),
+                               direct_n_step_returns(rewards, 0.9, bootstraps, 30))
+
+
+def test_short_n_step_returns_keep_their_precision_next_to_large_returns():
+    # the n step returns of the first steps are tiny compared to their full returns
+    rewards = np.array([1e-3] * 20 + [1e8] * 20)
+    n_step_returns = calculate_discounted_returns(rewards, 0.99, n_step_return=3)
+    expected = direct_n_step_returns(rewards, 0.99, np.zeros(40), 3)
+    np.testing.assert_allclose(n_step_returns, expected, rtol=1e-12)
@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+
+from memories.prioritized_experience_replay import PrioritizedExperienceReplay, SegmentTree
+from test_array_experience_replay import store_episodes, expected_n_step_return
+
+
+def test_segment_tree_reduces_over_the_updated_leaves():
+    random = np.random.RandomState(0)
+    capacity = 37
+    sum_tree = SegmentTree(capacity, np.add, 0.0)
+    min_tree = SegmentTree(capacity, np.minimum, np.inf)
+    leaves = np.zeros(capacity)
+    for _ in range(5):
+        indices = random.choice(capacity, 10, replace=False)
+        values = random.uniform(0.1, 2, 10)
+        sum_tree.update(indices, values)
+        min_tree.update(indices, values)
+        leaves[indices] = values
+        assert np.isclose(sum_tree.reduce(), np.sum(leaves))
+        assert min_tree.reduce() == np.min(leaves[leaves > 0])
+        assert np.array_equal(sum_tree.get(np.arange(capacity)), leaves)
+
+
+def test_segment_tree_finds_the_leaves_of_prefix_sums():
+    random = np.random.RandomState(0)
+    capacity = 50
+    leaves = random.uniform(0, 1, capacity)
+    # empty leaves, including the first and the last ones, are never found
+    leaves[[0, 10, 11, 12, 30, capacity - 1]] = 0
+    sum_tree = SegmentTree(capacity, np.add, 0.0)
+    sum_tree.update(np.arange(capacity), leaves)
+
+    prefix_sums = np.append(random.uniform(0, sum_tree.reduce(), 1000), [0, np.sum(leaves[:10])])
+    indices = sum_tree.find_prefix_sum_indices(prefix_sums)
+    assert np.array_equal(indices, np.searchsorted(np.cumsum(leaves), prefix_sums, side='right'))
+    assert np.all(leaves[indices] > 0)
+
+
+def test_returns_calculated_on_sample_include_the_open_episode(make_tuning_parameters):
+    n_step, discount = 3, 0.9
+    memory = PrioritizedExperienceReplay(make_tuning_parameters(
+        num_transitions_in_experience_replay=100, calculate_returns_on_sample=True, n_step=n_step,
+        discount=discount))
+    rewards, game_overs = store_episodes(memory, [5, 2, 7], open_episode_length=6)
+
+    # the open episode transitions get a priority once n transitions follow them, like in ArrayExperienceReplay
+    num_sampleable = 14 + 6 - n_step
+    assert memory.num_transitions_available_for_sampling() == num_sampleable
+    assert np.isclose(memory.sum_tree.reduce(), num_sampleable)
+
+    np.random.seed(1)
+    batch = memory.sample(16)
+    steps = batch.states['observation'][:, 0].astype(np.int64)
+    assert np.all(steps < num_sampleable)
+    for i, step in enumerate(steps):
+        total_return, _, bootstrap_discount = expected_n_step_return(rewards, game_overs, step, n_step, discount)
+        assert np.isclose(batch.total_returns[i], total_return)
+        assert np.isclose(batch.bootstrap_discounts[i], bootstrap_discount)
+
+    # the updated priorities of the open episode transitions are kept when the episode is completed
+    memory.update_priorities(batch.indices, np.zeros(len(batch)))
+    updated_priority = np.power(memory.epsilon, memory.alpha)
+    store_episodes(memory, [2])
+    assert np.allclose(memory.sum_tree.get(batch.indices), updated_priority)
+    num_unchanged = 14 + 6 + 2 - len(np.unique(batch.indices))
+    assert np.isclose(memory.sum_tree.reduce(), num_unchanged + updated_priority * len(np.unique(batch.indices)))
+
+
+def test_sampling_follows_the_priorities(make_tuning_parameters):
+    memory = PrioritizedExperienceReplay(make_tuning_parameters(
+        num_transitions_in_experience_replay=100, prioritized_replay_alpha=1.0, prioritized_replay_beta=0.5))
+    store_episodes(memory, [10, 10])
+    # priorities 1 to 20 for the steps 0 to 19
+    indices = np.arange(20)
+    memory.update_priorities(indices, indices + 1 - memory.epsilon)
+
+    np.random.seed(0)
+    batch = memory.sample(19)
+    steps = batch.states['observation'][:, 0].astype(np.int64)
+    # stratified sampling over the cumulative priorities
+    assert np.all(np.diff(steps) >= 0)
+    probabilities = (steps + 1) / 210.0
+    min_probability = 1 / 210.0
+    expected_weights = np.power(20 * probabilities, -0.5) / np.power(20 * min_probability, -0.5)
+    assert np.allclose(batch.importance_weights, expected_weights)